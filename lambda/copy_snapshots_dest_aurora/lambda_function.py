@@ -12,8 +12,13 @@ or in the "license" file accompanying this file. This file is distributed on an
 # This lambda function will copy shared Aurora snapshots that match the regex specified in the environment variable PATTERN, into the account where it runs. If the snapshot is shared and exists in the local region, it will copy it to the region specified in the environment variable DEST_REGION. If it finds that the snapshots are shared, exist in the local and destination regions, it will delete them from the local region. Copying snapshots cross-account and cross-region need to be separate operations. This function will need to run as many times necessary for the workflow to complete.
 # Set PATTERN to a regex that matches your Aurora cluster identifiers (by default: <instance_name>-cluster)
 # Set DEST_REGION to the destination AWS region
+# Shared snapshots are partitioned by the account that shared them. Accounts take turns and each runs at most COPY_MAX_PER_ACCOUNT operations at once, so one busy account cannot use up the time budget. Results are reported per account
+# Scheduled runs start the copies with the longest predicted duration first. Set COPY_MAX_IN_FLIGHT to keep at most that many in progress into each region. Copies left without a slot are pending and started by the retry or the next scheduled run
+# With MANIFEST_LOCATION set, only the snapshots announced by share_snapshots_aurora since the last run, and those still in progress, are described. Every MANIFEST_FULL_DISCOVERY_HOURS all snapshots are listed instead
+# Invoke with {"Snapshots": ["<snapshot identifier or shared snapshot ARN>"]} or {"Clusters": ["<cluster identifier>"]} to work only on those snapshots. Add "Force": true to copy snapshots older than RETENTION_DAYS. The outcome for each snapshot is returned
 import boto3
 from datetime import datetime
+import functools
 import time
 import os
 import logging
@@ -28,6 +33,13 @@ KMS_KEY_DEST_REGION = os.getenv('KMS_KEY_DEST_REGION', 'None').strip()
 KMS_KEY_SOURCE_REGION = os.getenv('KMS_KEY_SOURCE_REGION', 'None').strip()
 RETENTION_DAYS = int(os.getenv('RETENTION_DAYS'))
 TIMESTAMP_FORMAT = '%Y-%m-%d-%H-%M'
+# Shared snapshots are processed per source account, concurrently and taking turns
+COPY_MAX_WORKERS = int(os.getenv('COPY_MAX_WORKERS', '8'))
+COPY_MAX_PER_ACCOUNT = int(os.getenv('COPY_MAX_PER_ACCOUNT', '2'))
+# Stop starting new work this many seconds before the Lambda timeout
+TIME_MARGIN_SECONDS = int(os.getenv('TIME_MARGIN_SECONDS', '30'))
+# With LEASE_MODE PARTITIONS, a run that finds another run in progress still copies for the source accounts that run has not leased
+PARTITIONED_LEASE = True
 
 if os.getenv('REGION_OVERRIDE', 'NO') != 'NO':
     REGION = os.getenv('REGION_OVERRIDE').strip()
@@ -40,82 +52,293 @@ logger.setLevel(LOGLEVEL.upper())
 
 
 
+def process_shared_snapshot(shared_identifier, shared_attributes, own_snapshots, own_dest_snapshots, client, force=False, quotas=None, errors=None, planner=None):
+    # Starts the next step of the workflow for one shared snapshot. Returns the outcome and whether it still needs work.
+    # quotas maps region to its manual snapshot quota and planner holds the copy slots of each region. Work deferred on either is left
+    # for the next run. Copies without a slot are pending, so a retry starts them once slots free up. The exception of a failed copy is kept in errors
+    quotas = quotas or {}
+    errors = errors if errors is not None else {}
+    if shared_identifier not in own_snapshots.keys() and shared_identifier not in own_dest_snapshots.keys():
+    # Check date
+        creation_date = get_timestamp(shared_identifier, {shared_identifier: shared_attributes})
+        if creation_date or force:
+            if creation_date:
+                time_difference = datetime.now() - creation_date
+                days_difference = time_difference.total_seconds() / 3600 / 24
+
+            # Only copy if it's newer than RETENTION_DAYS
+            if force or days_difference < RETENTION_DAYS:
+
+                # A local copy holds a second slot until it reaches DESTINATION_REGION
+                if not admit(quotas.get(REGION), 'low' if REGION != DESTINATION_REGION else 'high'):
+                    return 'deferred_quota', False
+
+                if planner is not None and not planner.admit(REGION):
+                    if quotas.get(REGION) is not None:
+                        quotas[REGION].cancel()
+                    return 'deferred_copy_slots', True
+
+                # Copy to own account
+                try:
+                    with stage('mutations'):
+                        copy_local(shared_identifier, shared_attributes)
+
+                except Exception as e:
+                    if quotas.get(REGION) is not None:
+                        quotas[REGION].cancel(e)
+                    if planner is not None:
+                        planner.cancel(REGION)
+                    errors[shared_identifier] = e
+                    logger.error(e)
+                    logger.error('Local copy failed: %s' % shared_identifier)
+                    return 'local_copy_failed', True
+
+                else:
+                    if planner is not None:
+                        planner.started(shared_identifier, REGION, REGION, shared_attributes['AllocatedStorage'])
+
+                    if REGION != DESTINATION_REGION:
+                        log_item(logging.ERROR, 'Remote copy pending: %s', shared_identifier)
+                        return 'local_copy_started', True
+
+                    return 'local_copy_started', False
+
+            else:
+                log_item(logging.INFO, 'Not copying %s locally. Older than %s days', shared_identifier, RETENTION_DAYS)
+                return 'too_old', False
+
+        else: 
+            log_item(logging.INFO, 'Not copying %s locally. No valid timestamp', shared_identifier)
+            return 'no_timestamp', False
+
+
+    # Copy to DESTINATION_REGION
+    elif shared_identifier not in own_dest_snapshots.keys() and shared_identifier in own_snapshots.keys() and REGION != DESTINATION_REGION:
+        if own_snapshots[shared_identifier]['Status'] == 'available':
+            if not admit(quotas.get(DESTINATION_REGION)):
+                return 'deferred_quota', False
+
+            if planner is not None and not planner.admit(DESTINATION_REGION):
+                if quotas.get(DESTINATION_REGION) is not None:
+                    quotas[DESTINATION_REGION].cancel()
+                return 'deferred_copy_slots', True
+
+            try:
+                with stage('mutations'):
+                    copy_remote(shared_identifier, own_snapshots[shared_identifier])
+                 
+            except Exception as e:
+                if quotas.get(DESTINATION_REGION) is not None:
+                    quotas[DESTINATION_REGION].cancel(e)
+                if planner is not None:
+                    planner.cancel(DESTINATION_REGION)
+                errors[shared_identifier] = e
+                logger.error(e)
+                logger.error('Remote copy failed: %s: %s' % (
+                    shared_identifier, own_snapshots[shared_identifier]['Arn']))
+                return 'remote_copy_failed', True
+
+            if planner is not None:
+                planner.started(shared_identifier, REGION, DESTINATION_REGION, own_snapshots[shared_identifier]['AllocatedStorage'])
+
+            return 'remote_copy_started', False
+        else:
+            log_item(logging.ERROR, 'Remote copy pending: %s: %s', shared_identifier, own_snapshots[shared_identifier]['Arn'])
+            return 'local_copy_in_progress', True
+
+    # Delete local snapshots
+    elif shared_identifier in own_dest_snapshots.keys() and shared_identifier in own_snapshots.keys() and own_dest_snapshots[shared_identifier]['Status'] == 'available' and REGION != DESTINATION_REGION:
+
+        with stage('mutations'):
+            delete_cluster_snapshot(client, shared_identifier)
+
+        if quotas.get(REGION) is not None:
+            quotas[REGION].freed()
+
+        log_item(logging.INFO, 'Deleting local snapshot: %s', shared_identifier)
+        return 'local_deleted', False
+
+    # The copy to DESTINATION_REGION is still in progress. The local copy is deleted by a later run once it is available
+    elif shared_identifier in own_dest_snapshots.keys() and shared_identifier in own_snapshots.keys() and REGION != DESTINATION_REGION:
+        log_item(logging.INFO, 'Remote copy in progress: %s', shared_identifier)
+        return 'remote_copy_pending', False
+
+    return 'up_to_date', False
+
+
+@snapshots_tool_handler
 def lambda_handler(event, context):
     # Describe all snapshots
-    pending_copies = 0
-    client = boto3.client('rds', region_name=REGION)
-    response = paginate_api_call(client, 'describe_db_cluster_snapshots', 'DBClusterSnapshots', IncludeShared=True)
+    client = get_rds_client(REGION)
+    targets = get_targets(event)
+    force = targets is not None and targets['Force']
+
+    if targets is not None:
+        # On-demand run: describe only the requested snapshots. Local copies have the name of the shared snapshot
+        outcomes = target_outcomes(targets)
+        response = describe_target_snapshots(client, dict(targets, Snapshots=sorted(set(targets['Snapshots']) | set(outcomes))), IncludeShared=True)
+        manifest = None
+
+    else:
+        manifest = read_manifest(get_account_id(), REGION)
+
+        if manifest is not None and not manifest.full_discovery:
+            # Shared snapshots are described by ARN and their local copies by name
+            announced = manifest.snapshots()
+            response = describe_target_snapshots(client, {'Clusters': [], 'Snapshots': sorted(announced.values())}, IncludeShared=True)
+            response['DBClusterSnapshots'].extend(describe_target_snapshots(
+                client, {'Clusters': [], 'Snapshots': sorted(announced)}, SnapshotType='manual')['DBClusterSnapshots'])
 
-    shared_snapshots = get_shared_snapshots(PATTERN, response)
-    own_snapshots = get_own_snapshots_dest(PATTERN, response)
+        else:
+            # Manual and shared snapshots only. Automated snapshots are never copied, so they are not paged through
+            response = {'DBClusterSnapshots': describe_cluster_snapshots(client, SnapshotType='manual')['DBClusterSnapshots'] +
+                        describe_cluster_snapshots(client, IncludeShared=True, SnapshotType='shared')['DBClusterSnapshots']}
+
+    with stage('filtering'):
+        shared_snapshots = get_shared_snapshots(PATTERN, response)
+        own_snapshots = get_own_snapshots_dest(PATTERN, response)
 
     # Get list of snapshots in DEST_REGION
-    client_dest = boto3.client('rds', region_name=DESTINATION_REGION)
-    response_dest = paginate_api_call(client_dest, 'describe_db_cluster_snapshots', 'DBClusterSnapshots')
-    own_dest_snapshots = get_own_snapshots_dest(PATTERN, response_dest)
+    client_dest = get_rds_client(DESTINATION_REGION)
+
+    if targets is not None or (manifest is not None and not manifest.full_discovery):
+        response_dest = describe_target_snapshots(client_dest, {
+            'Clusters': [], 'Snapshots': sorted(set(shared_snapshots) | set(own_snapshots))}, SnapshotType='manual')
+
+    else:
+        response_dest = describe_cluster_snapshots(client_dest, SnapshotType='manual')
+    with stage('filtering'):
+        own_dest_snapshots = get_own_snapshots_dest(PATTERN, response_dest)
+
+    quotas = {REGION: get_snapshot_quota(client, len(own_snapshots))}
+
+    if DESTINATION_REGION not in quotas:
+        quotas[DESTINATION_REGION] = get_snapshot_quota(client_dest, len(own_dest_snapshots))
 
+    if REGION != DESTINATION_REGION:
+        # Make room in DESTINATION_REGION for the copies waiting there by expiring copies older than RETENTION_DAYS.
+        # Copies still present locally are kept, or the workflow would copy them again
+        needed = len([shared_identifier for shared_identifier in shared_snapshots
+                      if shared_identifier in own_snapshots and shared_identifier not in own_dest_snapshots])
+
+        def eligible(snapshot_identifier):
+            return snapshot_identifier not in own_snapshots and search_tag_copied(
+                list_tags(client_dest, own_dest_snapshots[snapshot_identifier]['Arn']))
+
+        for snapshot_identifier in expire_snapshots(client_dest, quotas[DESTINATION_REGION], own_dest_snapshots, RETENTION_DAYS, needed, eligible):
+            own_dest_snapshots.pop(snapshot_identifier)
+
+    # Partition by the account that shared the snapshot
+    partitions = {}
     for shared_identifier, shared_attributes in shared_snapshots.items():
+        partitions.setdefault(get_snapshot_owner(shared_attributes['Arn']), []).append(shared_identifier)
 
-        if shared_identifier not in own_snapshots.keys() and shared_identifier not in own_dest_snapshots.keys():
-        # Check date
-            creation_date = get_timestamp(shared_identifier, shared_snapshots)
-            if creation_date:
-                time_difference = datetime.now() - creation_date
-                days_difference = time_difference.total_seconds() / 3600 / 24
+    partitions = lease_partitions(partitions)
 
-                # Only copy if it's newer than RETENTION_DAYS
-                if days_difference < RETENTION_DAYS:
+    # On-demand runs copy what they are asked to. Scheduled runs and their retries time the copies finished since the last run,
+    # count those still in progress against the copy slots and order the work so the longest copies start first
+    planner = CopyPlanner(get_account_id()) if targets is None or is_retry(event) else None
 
-                    # Copy to own account
-                    try:
-                        copy_local(shared_identifier, shared_attributes)
+    def route(shared_identifier):
+        # The copy the snapshot needs next, as (source region, region, GiB), or None
+        if shared_identifier not in own_snapshots and shared_identifier not in own_dest_snapshots:
+            return REGION, REGION, shared_snapshots[shared_identifier]['AllocatedStorage']
 
-                    except Exception as e:
-                        pending_copies += 1
-                        logger.error(e)
-                        logger.error('Local copy pending: %s' % shared_identifier)
+        if shared_identifier in own_snapshots and shared_identifier not in own_dest_snapshots and REGION != DESTINATION_REGION:
+            return REGION, DESTINATION_REGION, own_snapshots[shared_identifier]['AllocatedStorage']
 
-                    else:
-                        if REGION != DESTINATION_REGION:
-                            pending_copies += 1
-                            logger.error('Remote copy pending: %s' % shared_identifier)
+        return None
 
-                else:
-                    logger.info('Not copying %s locally. Older than %s days' % (shared_identifier, RETENTION_DAYS))
+    if planner is not None:
+        # Retries and runs driven by the manifest only list some snapshots
+        complete = targets is None and (manifest is None or manifest.full_discovery)
+        planner.observe(REGION, own_snapshots, complete)
+        planner.observe(DESTINATION_REGION, own_dest_snapshots, complete)
 
-            else: 
-                logger.info('Not copying %s locally. No valid timestamp' % shared_identifier)
+        # Each account starts its longest copies first, and the accounts with the longest copies take the first turns
+        ordered = [(account, planner.longest_first(items, route)) for account, items in partitions.items()]
+        ordered.sort(key=lambda partition: planner.predicted(route(partition[1][0])) if partition[1] else 0, reverse=True)
+        partitions = dict(ordered)
 
+    errors = {}
 
-        # Copy to DESTINATION_REGION
-        elif shared_identifier not in own_dest_snapshots.keys() and shared_identifier in own_snapshots.keys() and REGION != DESTINATION_REGION:
-            if own_snapshots[shared_identifier]['Status'] == 'available':
-                try:
-                    copy_remote(shared_identifier, own_snapshots[shared_identifier])
-                 
-                except Exception as e:
-                    pending_copies += 1
-                    logger.error(e)
-                    logger.error('Remote copy pending: %s: %s' % (
-                        shared_identifier, own_snapshots[shared_identifier]['Arn']))
-            else:
-                pending_copies += 1
-                logger.error('Remote copy pending: %s: %s' % (
-                    shared_identifier, own_snapshots[shared_identifier]['Arn']))
+    def process(shared_identifier):
+        if not partition_lease_held(get_snapshot_owner(shared_snapshots[shared_identifier]['Arn'])):
+            return 'lease_lost', True
 
-        # Delete local snapshots
-        elif shared_identifier in own_dest_snapshots.keys() and shared_identifier in own_snapshots.keys() and own_dest_snapshots[shared_identifier]['Status'] == 'available' and REGION != DESTINATION_REGION:
+        try:
+            return process_shared_snapshot(shared_identifier, shared_snapshots[shared_identifier], own_snapshots, own_dest_snapshots, client, force, quotas, errors, planner)
 
-            response = client.delete_db_cluster_snapshot(
-                DBClusterSnapshotIdentifier=shared_identifier
-            )
+        except Exception as e:
+            errors[shared_identifier] = e
+            logger.error(e)
+            logger.error('Could not process %s' % shared_identifier)
+            return 'failed', True
 
-            logger.info('Deleting local snapshot: %s' % shared_identifier)
+    def retry(shared_identifier):
+        result = process(shared_identifier)
+
+        if shared_identifier in errors:
+            raise errors.pop(shared_identifier)
+
+        return result
+
+    deadline = get_deadline(context, TIME_MARGIN_SECONDS)
+
+    with stage('decision_loop'):
+        results = run_fair_share(partitions, process, COPY_MAX_WORKERS, COPY_MAX_PER_ACCOUNT, deadline)
+
+    # Copies that failed on throttling or a busy snapshot get another try once every account was handled
+    retries = RetryQueue(deadline=deadline)
+
+    for shared_identifier in list(errors):
+        retries.add(shared_identifier, errors.pop(shared_identifier), functools.partial(retry, shared_identifier))
+
+    retried = retries.drain()
+
+    if planner is not None:
+        planner.save()
+
+    for account, account_results in results.items():
+        results[account] = [(shared_identifier, retried.get(shared_identifier, result)) for shared_identifier, result in account_results]
+
+    accounts = {}
+    pending_copies = 0
+    snapshot_outcomes = {}
+    pending_snapshots = []
+
+    for account, account_results in results.items():
+        report = accounts.setdefault(account, {'Pending': 0})
+
+        for shared_identifier, result in account_results:
+            outcome, pending = result if result is not None else ('not_started', True)
+            report[outcome] = report.get(outcome, 0) + 1
+            snapshot_outcomes[shared_identifier] = outcome
+
+            if pending:
+                report['Pending'] += 1
+                pending_snapshots.append(shared_identifier)
+
+        pending_copies += report['Pending']
+        logger.info('Account %s: %s' % (account, ', '.join('%s %s' % (key, value) for key, value in sorted(report.items()))))
+
+    if targets is None:
+        record_outcomes(snapshot_outcomes)
+
+    if manifest is not None:
+        manifest.commit(snapshot_outcomes, shared_snapshots)
+
+    if targets is not None:
+        outcomes.update(snapshot_outcomes)
+        return targeted_result(outcomes, retries.failed(), pending=pending_snapshots)
 
     if pending_copies > 0:
-        log_message = 'Copies pending: %s. Needs retrying' % pending_copies
+        log_message = 'Copies pending: %s. Needs retrying. Pending per account: %s' % (pending_copies, ', '.join(
+            '%s: %s' % (account, report['Pending']) for account, report in sorted(accounts.items()) if report['Pending'] > 0))
         logger.error(log_message)
-        raise SnapshotToolException(log_message)
+        raise items_pending(log_message, retries.failed(), pending=pending_snapshots)
+
+    return {'Accounts': accounts}
 
 
 if __name__ == '__main__':
@@ -12,6 +12,7 @@ or in the "license" file accompanying this file. This file is distributed on an
 # This lambda function will copy source Aurora snapshots that match the regex specified in the environment variable PATTERN into DEST_REGION. This function will need to run as many times necessary for the workflow to complete.
 # Set PATTERN to a regex that matches your Aurora cluster identifiers (by default: <instance_name>-cluster)
 # Set DEST_REGION to the destination AWS region
+# Copies are started longest predicted duration first. Set COPY_MAX_IN_FLIGHT to keep at most that many in progress into DEST_REGION. Copies left without a slot are pending and started by the retry or the next scheduled run
 import boto3
 from datetime import datetime
 import time
@@ -40,49 +41,81 @@ logger.setLevel(LOGLEVEL.upper())
 
 
 
+@snapshots_tool_handler
 def lambda_handler(event, context):
     # Describe all snapshots
     pending_copies = 0
-    client = boto3.client('rds', region_name=REGION)
-    response = paginate_api_call(client, 'describe_db_cluster_snapshots', 'DBClusterSnapshots')
+    client = get_rds_client(REGION)
+    response = describe_cluster_snapshots(client, SnapshotType='manual')
 
-    source_snapshots = get_own_snapshots_source(PATTERN, response)
-    own_snapshots_encryption = get_own_snapshots_dest(PATTERN, response)
+    with stage('filtering'):
+        source_snapshots = get_own_snapshots_source(PATTERN, response)
+        own_snapshots_encryption = get_own_snapshots_dest(PATTERN, response)
 
     # Get list of snapshots in DEST_REGION
-    client_dest = boto3.client('rds', region_name=DESTINATION_REGION)
-    response_dest = paginate_api_call(client_dest, 'describe_db_cluster_snapshots', 'DBClusterSnapshots')
-    dest_snapshots = get_own_snapshots_dest(PATTERN, response_dest)
-
-
-    for source_identifier, source_attributes in source_snapshots.items():
-        creation_date = get_timestamp(source_identifier, source_snapshots)
-        if creation_date:
-            time_difference = datetime.now() - creation_date
-            days_difference = time_difference.total_seconds() / 3600 / 24
-
-            # Only copy if it's newer than RETENTION_DAYS
-            if days_difference < RETENTION_DAYS:
-            # Copy to DESTINATION_REGION
-                if source_identifier not in dest_snapshots.keys() and REGION != DESTINATION_REGION:
-                    if source_snapshots[source_identifier]['Status'] == 'available':
-                        try:
-                            copy_remote(source_identifier, own_snapshots_encryption[source_identifier])
-                 
-                        except Exception as e:
+    client_dest = get_rds_client(DESTINATION_REGION)
+    response_dest = describe_cluster_snapshots(client_dest, SnapshotType='manual')
+    with stage('filtering'):
+        dest_snapshots = get_own_snapshots_dest(PATTERN, response_dest)
+
+    # Copies still in progress in DEST_REGION hold copy slots, and the ones that finished since the last run are timed
+    planner = CopyPlanner(get_account_id())
+    planner.observe(DESTINATION_REGION, dest_snapshots)
+    copies = []
+
+    with stage('decision_loop'):
+        for source_identifier, source_attributes in source_snapshots.items():
+            creation_date = get_timestamp(source_identifier, source_snapshots)
+            if creation_date:
+                time_difference = datetime.now() - creation_date
+                days_difference = time_difference.total_seconds() / 3600 / 24
+
+                # Only copy if it's newer than RETENTION_DAYS
+                if days_difference < RETENTION_DAYS:
+                # Copy to DESTINATION_REGION
+                    if source_identifier not in dest_snapshots.keys() and REGION != DESTINATION_REGION:
+                        if source_snapshots[source_identifier]['Status'] == 'available':
+                            copies.append(source_identifier)
+                        else:
                             pending_copies += 1
-                            logger.error(e)
-                            logger.error('Remote copy pending: %s: %s' % (
-                                source_identifier, source_snapshots[source_identifier]['Arn']))
+                            record_outcome(source_identifier, 'not_available')
+                            log_item(logging.ERROR, 'Remote copy pending: %s: %s', source_identifier, source_snapshots[source_identifier]['Arn'])
                     else:
-                        pending_copies += 1
-                        logger.error('Remote copy pending: %s: %s' % (
-                            source_identifier, source_snapshots[source_identifier]['Arn']))
-            else:
-                logger.info('Not copying %s locally. Older than %s days' % (source_identifier, RETENTION_DAYS))
-
-        else: 
-            logger.info('Not copying %s locally. No valid timestamp' % source_identifier)
+                        record_outcome(source_identifier, 'up_to_date')
+                else:
+                    record_outcome(source_identifier, 'too_old')
+                    log_item(logging.INFO, 'Not copying %s locally. Older than %s days', source_identifier, RETENTION_DAYS)
+
+            else: 
+                record_outcome(source_identifier, 'no_timestamp')
+                log_item(logging.INFO, 'Not copying %s locally. No valid timestamp', source_identifier)
+
+    def route(source_identifier):
+        return REGION, DESTINATION_REGION, own_snapshots_encryption[source_identifier]['AllocatedStorage']
+
+    with stage('decision_loop'):
+        for source_identifier in planner.longest_first(copies, route):
+            if not planner.admit(DESTINATION_REGION):
+                pending_copies += 1
+                record_outcome(source_identifier, 'deferred_copy_slots')
+                continue
+
+            try:
+                with stage('mutations'):
+                    copy_remote(source_identifier, own_snapshots_encryption[source_identifier])
+
+                planner.started(source_identifier, *route(source_identifier))
+                record_outcome(source_identifier, 'remote_copy_started')
+
+            except Exception as e:
+                planner.cancel(DESTINATION_REGION)
+                pending_copies += 1
+                record_outcome(source_identifier, 'remote_copy_failed')
+                logger.error(e)
+                logger.error('Remote copy failed: %s: %s' % (
+                    source_identifier, source_snapshots[source_identifier]['Arn']))
+
+    planner.save()
 
     if pending_copies > 0:
         log_message = 'Copies pending: %s. Needs retrying' % pending_copies
@@ -11,8 +11,10 @@ or in the "license" file accompanying this file. This file is distributed on an
 # delete_old_snapshots_aurora
 # This Lambda function will delete snapshots that have expired and match the regex set in the PATTERN environment variable. It will also look for a matching timestamp in the following format: YYYY-MM-DD-HH-mm
 # Set PATTERN to a regex that matches your Aurora cluster identifiers (by default: <instance_name>-cluster)
+# Invoke with {"Snapshots": ["<snapshot identifier>"]} or {"Clusters": ["<cluster identifier>"]} to consider only those snapshots. Add "Force": true to delete the snapshots listed under Snapshots before RETENTION_DAYS. Snapshots of the listed Clusters keep their retention. The outcome for each snapshot is returned
 import boto3
 from datetime import datetime
+import functools
 import time
 import os
 import logging
@@ -23,6 +25,8 @@ LOGLEVEL = os.getenv('LOG_LEVEL', 'ERROR').strip()
 PATTERN = os.getenv('PATTERN', 'ALL_CLUSTERS')
 RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', '7'))
 TIMESTAMP_FORMAT = '%Y-%m-%d-%H-%M'
+# Stop retrying failed deletes this many seconds before the Lambda timeout
+TIME_MARGIN_SECONDS = int(os.getenv('TIME_MARGIN_SECONDS', '30'))
 
 if os.getenv('REGION_OVERRIDE', 'NO') != 'NO':
     REGION = os.getenv('REGION_OVERRIDE').strip()
@@ -36,54 +40,80 @@ logger.setLevel(LOGLEVEL.upper())
 
 
 
+@snapshots_tool_handler
 def lambda_handler(event, context):
-    pending_delete = 0
-    client = boto3.client('rds', region_name=REGION)
-    response = paginate_api_call(client, 'describe_db_cluster_snapshots', 'DBClusterSnapshots')
+    retries = RetryQueue(deadline=get_deadline(context, TIME_MARGIN_SECONDS))
+    client = get_rds_client(REGION)
+    targets = get_targets(event)
+    forced = forced_snapshots(targets)
 
-    filtered_list = get_own_snapshots_source(PATTERN, response)
+    if targets is not None:
+        # On-demand run: describe only the requested snapshots
+        response = describe_target_snapshots(client, targets, SnapshotType='manual')
+        outcomes = target_outcomes(targets)
 
-    for snapshot in filtered_list.keys():
+    else:
+        response = describe_cluster_snapshots(client, SnapshotType='manual')
+        outcomes = {}
 
-        creation_date = get_timestamp(snapshot, filtered_list)
+    with stage('filtering'):
+        filtered_list = get_own_snapshots_source(PATTERN, response)
 
-        if creation_date:
+    with stage('decision_loop'):
+        for snapshot in filtered_list.keys():
 
-            difference = datetime.now() - creation_date
+            force = snapshot in forced
+            creation_date = get_timestamp(snapshot, filtered_list)
 
-            days_difference = difference.total_seconds() / 3600 / 24
+            if creation_date or force:
 
-            logger.debug('%s created %s days ago' %
-                         (snapshot, days_difference))
+                if creation_date:
+                    difference = datetime.now() - creation_date
 
-            # if we are past RETENTION_DAYS
-            if days_difference > RETENTION_DAYS:
+                    days_difference = difference.total_seconds() / 3600 / 24
 
-                # delete it
-                logger.info('Deleting %s' % snapshot)
+                    logger.debug('%s created %s days ago', snapshot, days_difference)
 
-                try:
-                    client.delete_db_cluster_snapshot(
-                        DBClusterSnapshotIdentifier=snapshot)
+                # if we are past RETENTION_DAYS
+                if force or days_difference > RETENTION_DAYS:
 
-                except Exception as e:
-                    pending_delete += 1
-                    logger.info(e)
-                    logger.info('Could not delete %s ' % snapshot)
+                    # delete it
+                    log_item(logging.INFO, 'Deleting %s', snapshot)
+
+                    try:
+                        with stage('mutations'):
+                            delete_cluster_snapshot(client, snapshot)
+
+                        outcomes[snapshot] = 'deleted'
+
+                    except Exception as e:
+                        retries.add(snapshot, e, functools.partial(delete_cluster_snapshot, client, snapshot))
+                        outcomes[snapshot] = 'delete_failed'
+                        logger.error(e)
+                        logger.error('Could not delete %s ' % snapshot)
+
+                else:
+                # Not older than RETENTION_DAYS
+                    outcomes[snapshot] = 'retained'
+                    logger.debug('%s created less than %s days. Not deleting', snapshot, RETENTION_DAYS)
 
             else:
-            # Not older than RETENTION_DAYS
-                logger.debug('%s created less than %s days. Not deleting' % (snapshot, RETENTION_DAYS))
+            # Did not have a timestamp
+                outcomes[snapshot] = 'no_timestamp'
+                logger.debug('Not deleting %s. Could not find a timestamp in the name', snapshot)
+
+    for snapshot in retries.drain():
+        outcomes[snapshot] = 'deleted'
 
-        else:
-        # Did not have a timestamp
-            logger.debug('Not deleting %s. Could not find a timestamp in the name' % snapshot)
+    if targets is not None:
+        return targeted_result(outcomes, retries.failed())
 
+    record_outcomes(outcomes)
 
-    if pending_delete > 0:
-        message = 'Snapshots pending delete: %s' % pending_delete
+    if retries.errors:
+        message = 'Snapshots pending delete: %s' % len(retries.errors)
         logger.error(message)
-        raise SnapshotToolException(message)
+        raise items_pending(message, retries.failed())
 
 
 if __name__ == '__main__':
@@ -13,7 +13,9 @@ or in the "license" file accompanying this file. This file is distributed on an
 # Set PATTERN to a regex that matches your Aurora cluster identifiers (by default: <instance_name>-cluster)
 # Set DEST_REGION to the destination AWS region
 # Set RETENTION_DAYS to the amount of days snapshots need to be kept before deleting
+# Invoke with {"Snapshots": ["<snapshot identifier>"]} or {"Clusters": ["<cluster identifier>"]} to consider only those snapshots. Add "Force": true to delete the snapshots listed under Snapshots before RETENTION_DAYS. Snapshots of the listed Clusters keep their retention. The outcome for each snapshot is returned
 import boto3
+import functools
 import time
 import os
 import logging
@@ -27,6 +29,8 @@ LOGLEVEL = os.getenv('LOG_LEVEL', 'ERROR').strip()
 PATTERN = os.getenv('PATTERN', 'ALL_SNAPSHOTS')
 RETENTION_DAYS = int(os.getenv('RETENTION_DAYS'))
 TIMESTAMP_FORMAT = '%Y-%m-%d-%H-%M'
+# Stop retrying failed deletes this many seconds before the Lambda timeout
+TIME_MARGIN_SECONDS = int(os.getenv('TIME_MARGIN_SECONDS', '30'))
 
 
 logger = logging.getLogger()
@@ -34,65 +38,88 @@ logger.setLevel(LOGLEVEL.upper())
 
 
 
+@snapshots_tool_handler
 def lambda_handler(event, context):
-    delete_pending = 0
+    retries = RetryQueue(deadline=get_deadline(context, TIME_MARGIN_SECONDS))
 
     # Search for all snapshots
-    client = boto3.client('rds', region_name=DEST_REGION)
-    response = paginate_api_call(client, 'describe_db_cluster_snapshots', 'DBClusterSnapshots')
+    client = get_rds_client(DEST_REGION)
+    targets = get_targets(event)
+    forced = forced_snapshots(targets)
+
+    if targets is not None:
+        # On-demand run: describe only the requested snapshots
+        response = describe_target_snapshots(client, targets, SnapshotType='manual')
+        outcomes = target_outcomes(targets)
+
+    else:
+        response = describe_cluster_snapshots(client, SnapshotType='manual')
+        outcomes = {}
 
     # Filter out the ones not created automatically or with other methods
-    filtered_list = get_own_snapshots_dest(PATTERN, response)
+    with stage('filtering'):
+        filtered_list = get_own_snapshots_dest(PATTERN, response)
+
 
+    with stage('decision_loop'):
+        for snapshot in filtered_list.keys():
+            force = snapshot in forced
+            creation_date = get_timestamp(snapshot, filtered_list)
 
-    for snapshot in filtered_list.keys():
-        creation_date = get_timestamp(snapshot, filtered_list)
+            if creation_date or force:
 
-        if creation_date:
+                snapshot_arn = filtered_list[snapshot]['Arn']
+                response_tags = list_tags(client, snapshot_arn)
 
-            snapshot_arn = filtered_list[snapshot]['Arn']
-            response_tags = client.list_tags_for_resource(
-                ResourceName=snapshot_arn)
+                if search_tag_copied(response_tags):
 
-            if search_tag_copied(response_tags):
+                    if creation_date:
+                        difference = datetime.now() - creation_date
+                        days_difference = difference.total_seconds() / 3600 / 24
+                    # if we are past RETENTION_DAYS
 
-                difference = datetime.now() - creation_date
-                days_difference = difference.total_seconds() / 3600 / 24
-                # if we are past RETENTION_DAYS
+                    if force or days_difference > RETENTION_DAYS:
 
-                if days_difference > RETENTION_DAYS:
+                        # delete it
+                        log_item(logging.INFO, 'Deleting %s. Created %s', snapshot, creation_date)
 
-                    # delete it
-                    logger.info('Deleting %s. %s days old' %
-                                (snapshot, days_difference))
+                        try:
+                            with stage('mutations'):
+                                delete_cluster_snapshot(client, snapshot)
 
-                    try:
-                        client.delete_db_cluster_snapshot(
-                            DBClusterSnapshotIdentifier=snapshot)
+                            outcomes[snapshot] = 'deleted'
 
-                    except Exception as e:
-                        delete_pending += 1
-                        logger.error(e)
-                        logger.error('Could not delete %s' % snapshot)
+                        except Exception as e:
+                            retries.add(snapshot, e, functools.partial(delete_cluster_snapshot, client, snapshot))
+                            outcomes[snapshot] = 'delete_failed'
+                            logger.error(e)
+                            logger.error('Could not delete %s' % snapshot)
+
+                    else:
+                        outcomes[snapshot] = 'retained'
+                        log_item(logging.INFO, 'Not deleting %s. Only %s days old', snapshot, days_difference)
 
                 else:
-                    logger.info('Not deleting %s. Only %s days old' %
-                                (snapshot, days_difference))
+                    outcomes[snapshot] = 'not_tagged'
+                    log_item(logging.INFO, 'Not deleting %s. Did not find correct tag', snapshot)
+
+            else: 
+                outcomes[snapshot] = 'no_timestamp'
+                logger.debug('Not deleting %s. Did not find a timestamp', snapshot)
 
-            else:
-                logger.info(
-                    'Not deleting %s. Did not find correct tag' % snapshot)
+    for snapshot in retries.drain():
+        outcomes[snapshot] = 'deleted'
 
-        else: 
-            logger.debug(
-                'Not deleting %s. Did not find a timestamp' % snapshot)
+    if targets is not None:
+        return targeted_result(outcomes, retries.failed())
 
+    record_outcomes(outcomes)
 
-    if delete_pending > 0:
+    if retries.errors:
 
-        log_message = 'Snapshots pending delete: %s' % delete_pending
+        log_message = 'Snapshots pending delete: %s' % len(retries.errors)
         logger.error(log_message)
-        raise SnapshotToolException(log_message)
+        raise items_pending(log_message, retries.failed())
 
 
 if __name__ == '__main__':
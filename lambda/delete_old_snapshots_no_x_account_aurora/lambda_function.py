@@ -34,57 +34,61 @@ logger.setLevel(LOGLEVEL.upper())
 
 
 
+@snapshots_tool_handler
 def lambda_handler(event, context):
     delete_pending = 0
 
     # Search for all snapshots
-    client = boto3.client('rds', region_name=DEST_REGION)
-    response = paginate_api_call(client, 'describe_db_cluster_snapshots', 'DBClusterSnapshots')
+    client = get_rds_client(DEST_REGION)
+    response = describe_cluster_snapshots(client, SnapshotType='manual')
 
     # Filter out the ones not created automatically or with other methods
-    filtered_list = get_own_snapshots_no_x_account(PATTERN, response, DEST_REGION)
+    with stage('filtering'):
+        filtered_list = get_own_snapshots_no_x_account(PATTERN, response, DEST_REGION)
 
 
-    for snapshot in filtered_list.keys():
-        creation_date = get_timestamp(snapshot, filtered_list)
+    with stage('decision_loop'):
+        for snapshot in filtered_list.keys():
+            creation_date = get_timestamp(snapshot, filtered_list)
 
-        if creation_date:
+            if creation_date:
 
-            snapshot_arn = filtered_list[snapshot]['Arn']
-            response_tags = client.list_tags_for_resource(
-                ResourceName=snapshot_arn)
+                snapshot_arn = filtered_list[snapshot]['Arn']
+                response_tags = list_tags(client, snapshot_arn)
 
-            if search_tag_created(response_tags):
+                if search_tag_created(response_tags):
 
-                difference = datetime.now() - creation_date
-                days_difference = difference.total_seconds() / 3600 / 24
-                # if we are past RETENTION_DAYS
+                    difference = datetime.now() - creation_date
+                    days_difference = difference.total_seconds() / 3600 / 24
+                    # if we are past RETENTION_DAYS
 
-                if days_difference > RETENTION_DAYS:
+                    if days_difference > RETENTION_DAYS:
 
-                    # delete it
-                    logger.info('Deleting %s. %s days old' %
-                                (snapshot, days_difference))
+                        # delete it
+                        log_item(logging.INFO, 'Deleting %s. %s days old', snapshot, days_difference)
 
-                    try:
-                        client.delete_db_cluster_snapshot(
-                            DBClusterSnapshotIdentifier=snapshot)
+                        try:
+                            with stage('mutations'):
+                                delete_cluster_snapshot(client, snapshot)
 
-                    except Exception:
-                        delete_pending += 1
-                        logger.info('Could not delete %s' % snapshot)
+                            record_outcome(snapshot, 'deleted')
 
-                else:
-                    logger.info('Not deleting %s. Only %s days old' %
-                                (snapshot, days_difference))
+                        except Exception as e:
+                            delete_pending += 1
+                            record_outcome(snapshot, 'delete_failed')
+                            logger.error('Could not delete %s: %s' % (snapshot, e))
+
+                    else:
+                        record_outcome(snapshot, 'retained')
+                        log_item(logging.INFO, 'Not deleting %s. Only %s days old', snapshot, days_difference)
 
-            else:
-                logger.info(
-                    'Not deleting %s. Did not find correct tag' % snapshot)
+                else:
+                    record_outcome(snapshot, 'not_tagged')
+                    log_item(logging.INFO, 'Not deleting %s. Did not find correct tag', snapshot)
 
-        else: 
-            logger.debug(
-                'Not deleting %s. Did not find a timestamp' % snapshot)
+            else: 
+                record_outcome(snapshot, 'no_timestamp')
+                logger.debug('Not deleting %s. Did not find a timestamp', snapshot)
 
 
     if delete_pending > 0:
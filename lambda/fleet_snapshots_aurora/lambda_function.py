@@ -0,0 +1,120 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# fleet_snapshots_aurora
+# This lambda function runs the snapshot creation, retention deletion and sharing logic in every account of FLEET_ACCOUNTS from one deployment,
+# assuming FLEET_ROLE_NAME in each account. Accounts are worked on concurrently and the outcome of every account is returned in one report.
+# Set the environment variables of the stages it runs (PATTERN, INTERVAL, RETENTION_DAYS, DEST_ACCOUNT...), which apply to every account
+# Set FLEET_STAGES to a comma separated list of the functions to run in each account, in order (by default: take_snapshots_aurora,delete_old_snapshots_aurora,share_snapshots_aurora)
+# Set FLEET_MAX_WORKERS to the number of accounts worked on at once (default: 4) and FLEET_MAX_CALLS_PER_ACCOUNT to cap the RDS calls in flight per account
+# Invoked with ReportRetry, it returns the accounts and stages left failed or pending as Retry, so a retry works only on those
+import os
+import logging
+import time
+from snapshots_tool_utils import *
+
+# Initialize everything
+LOGLEVEL = os.getenv('LOG_LEVEL', 'ERROR').strip()
+FLEET_STAGES = [stage_name.strip() for stage_name in os.getenv(
+    'FLEET_STAGES', 'take_snapshots_aurora,delete_old_snapshots_aurora,share_snapshots_aurora').split(',') if stage_name.strip()]
+FLEET_MAX_WORKERS = int(os.getenv('FLEET_MAX_WORKERS', '4'))
+
+# Accounts are not started with less than this much time left in the invocation
+TIMEOUT_MARGIN_SECONDS = 60
+
+if os.getenv('REGION_OVERRIDE', 'NO') != 'NO':
+    REGION = os.getenv('REGION_OVERRIDE').strip()
+else:
+    REGION = os.getenv('AWS_DEFAULT_REGION')
+
+
+logger = logging.getLogger()
+logger.setLevel(LOGLEVEL.upper())
+
+
+def run_account(account, event, context):
+    # Runs the stages in account. Returns the report of the account, with the Retry of its stages left failed or pending
+    start = time.time()
+    report = {'Account': account}
+
+    with account_scope(account):
+        try:
+            # List every manual snapshot of the account once, as the pipeline does, so the stages share one listing
+            describe_cluster_snapshots(get_rds_client(REGION), SnapshotType='manual')
+            report['Stages'], pending_stages, retry = run_stages(FLEET_STAGES, event, context)
+            report['Status'] = 'failed' if pending_stages > 0 else 'succeeded'
+
+            if retry:
+                report['Retry'] = {'Stages': retry}
+
+        except Exception as e:
+            report['Status'] = 'failed'
+            report['Error'] = '%s: %s' % (e.__class__.__name__, e)
+            logger.error('Account %s failed: %s' % (account, e))
+
+    report['Seconds'] = round(time.time() - start, 3)
+    logger.info('Account %s %s in %s seconds' % (account, report['Status'], report['Seconds']))
+
+    return report
+
+
+@snapshots_tool_handler
+def lambda_handler(event, context):
+    accounts = fleet_accounts()
+
+    if not accounts:
+        raise SnapshotToolException('FLEET_ACCOUNTS is not set')
+
+    # A retry works only on the accounts left failed or pending, each on its own stages. An empty retry runs the account in full
+    retry_accounts = event.get('Accounts') if is_retry(event) else None
+
+    if retry_accounts is not None:
+        accounts = [account for account in accounts if account in retry_accounts]
+
+    def account_event(account):
+        if retry_accounts is None:
+            return event
+
+        return dict(dict((key, value) for key, value in event.items() if key != 'Accounts'), **retry_accounts[account])
+
+    # Each account is its own partition, so an account is never worked on by two workers at once
+    results = run_fair_share(dict((account, [account]) for account in accounts),
+                             lambda account: run_account(account, account_event(account), context),
+                             FLEET_MAX_WORKERS, 1, get_deadline(context, TIMEOUT_MARGIN_SECONDS))
+
+    reports = []
+
+    for account in accounts:
+        for _, report in results[account]:
+            reports.append(report or {'Account': account, 'Status': 'not_started'})
+
+    pending = [report['Account'] for report in reports if report['Status'] != 'succeeded']
+    summary = {'Accounts': reports, 'Succeeded': len(reports) - len(pending), 'Pending': pending}
+
+    if pending:
+        log_message = 'Fleet accounts pending: %s. %s' % (len(pending), ', '.join(
+            '%s %s' % (report['Account'], report['Status']) for report in reports))
+        logger.error(log_message)
+
+        if isinstance(event, dict) and event.get('ReportRetry'):
+            return dict(summary, Retry={'Accounts': dict(
+                (report['Account'], report.get('Retry') or (retry_accounts or {}).get(report['Account']) or {})
+                for report in reports if report['Status'] != 'succeeded')})
+
+        raise SnapshotToolException(log_message)
+
+    logger.info('Fleet run succeeded in %s accounts' % len(reports))
+
+    return summary
+
+
+if __name__ == '__main__':
+    lambda_handler(None, None)
@@ -0,0 +1,48 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# pipeline_snapshots_aurora
+# This lambda function runs the snapshot creation, retention deletion and sharing logic of the source account in one invocation, against one snapshot inventory.
+# Snapshots just created are seen as pending by the sharing stage and snapshots just deleted are not shared. The time spent in each stage is reported.
+# Set the environment variables of take_snapshots_aurora, delete_old_snapshots_aurora and share_snapshots_aurora (PATTERN, INTERVAL, RETENTION_DAYS, DEST_ACCOUNT...)
+# Set PIPELINE_STAGES to a comma separated list of the functions to run, in order (by default: take_snapshots_aurora,delete_old_snapshots_aurora,share_snapshots_aurora)
+# Set INVENTORY_CACHE_TTL (for example 600), since the stages share their inventory through the cache
+# Invoked with ReportRetry, it returns the stages left failed or pending as Retry, so a retry runs only those stages, each on its own items
+import os
+import logging
+from snapshots_tool_utils import *
+
+# Initialize everything
+LOGLEVEL = os.getenv('LOG_LEVEL', 'ERROR').strip()
+PIPELINE_STAGES = [stage_name.strip() for stage_name in os.getenv(
+    'PIPELINE_STAGES', 'take_snapshots_aurora,delete_old_snapshots_aurora,share_snapshots_aurora').split(',') if stage_name.strip()]
+
+if os.getenv('REGION_OVERRIDE', 'NO') != 'NO':
+    REGION = os.getenv('REGION_OVERRIDE').strip()
+else:
+    REGION = os.getenv('AWS_DEFAULT_REGION')
+
+
+logger = logging.getLogger()
+logger.setLevel(LOGLEVEL.upper())
+
+
+
+@snapshots_tool_handler
+def lambda_handler(event, context):
+    # List every manual snapshot once. The targeted listing of take_snapshots_aurora and the full listings of the other stages are answered from it
+    describe_cluster_snapshots(get_rds_client(REGION), SnapshotType='manual')
+
+    return run_pipeline(PIPELINE_STAGES, event, context)
+
+
+if __name__ == '__main__':
+    lambda_handler(None, None)
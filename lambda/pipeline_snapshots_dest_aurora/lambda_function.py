@@ -0,0 +1,41 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# pipeline_snapshots_dest_aurora
+# This lambda function runs the copy and retention deletion logic of the destination account in one invocation, against one snapshot inventory.
+# Copies started by the copy stage are seen by the deletion stage without listing DEST_REGION again. The time spent in each stage is reported.
+# Set the environment variables of the copy and delete functions (SNAPSHOT_PATTERN, PATTERN, DEST_REGION, RETENTION_DAYS, KMS keys...)
+# Set PIPELINE_STAGES to a comma separated list of the functions to run, in order (by default: copy_snapshots_dest_aurora,delete_old_snapshots_dest_aurora)
+# Use copy_snapshots_no_x_account_aurora,delete_old_snapshots_no_x_account_aurora when not copying across accounts
+# Set INVENTORY_CACHE_TTL (for example 600), since the stages share their inventory through the cache
+# Invoked with ReportRetry, it returns the stages left failed or pending as Retry, so a retry runs only those stages, each on its own items
+import os
+import logging
+from snapshots_tool_utils import *
+
+# Initialize everything
+LOGLEVEL = os.getenv('LOG_LEVEL', 'ERROR').strip()
+PIPELINE_STAGES = [stage_name.strip() for stage_name in os.getenv(
+    'PIPELINE_STAGES', 'copy_snapshots_dest_aurora,delete_old_snapshots_dest_aurora').split(',') if stage_name.strip()]
+
+
+logger = logging.getLogger()
+logger.setLevel(LOGLEVEL.upper())
+
+
+
+@snapshots_tool_handler
+def lambda_handler(event, context):
+    return run_pipeline(PIPELINE_STAGES, event, context)
+
+
+if __name__ == '__main__':
+    lambda_handler(None, None)
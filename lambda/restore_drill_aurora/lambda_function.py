@@ -0,0 +1,273 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# restore_drill_aurora
+# This lambda function measures how long a restore from the copied snapshots really takes. It restores the latest snapshot copied by the tool for a cluster to a throwaway cluster, adds one instance, records when each phase became available, publishes the durations against the snapshot size and deletes the throwaway cluster.
+# Restores take longer than a Lambda invocation, so the state of each drill is kept in tags on the drill cluster and every invocation moves the drills one step forward. Like the copy function, it reports the drills in progress as pending, as a Retry with ReportRetry or otherwise by raising SnapshotToolException, so the state machine invokes it again. Durations are as precise as the retry interval.
+# Set DEST_REGION to the region the snapshots were copied to
+# Set PATTERN to a regex that matches the cluster identifiers to drill (by default: ALL_SNAPSHOTS)
+# Set DRILL_MAX_CLUSTERS to the number of clusters drilled at a time (default: 1). Clusters take turns, one round per day
+# Set DRILL_INSTANCE_CLASS to the instance class of the drill instance (default: db.t3.medium)
+# Set DRILL_SUBNET_GROUP and DRILL_SECURITY_GROUPS (comma separated) to place the drill cluster. By default the default VPC is used
+# Set DRILL_PREFIX to the prefix of the drill cluster identifiers (default: snapshots-tool-drill-). It must not be empty. Only clusters with this prefix that also carry the drill tags set by this function are deleted by it
+# Set DRILL_TIMEOUT_HOURS to the time after which a drill that is not complete is deleted and reported as failed (default: 6)
+# Set DRILL_METRIC_NAMESPACE to the CloudWatch namespace of the published durations, or to NONE to only log them (default: SnapshotsToolAurora/RestoreDrill)
+import boto3
+from datetime import datetime, timezone
+import json
+import os
+import logging
+import time
+from snapshots_tool_utils import *
+
+# Initialize everything
+LOGLEVEL = os.getenv('LOG_LEVEL', 'ERROR').strip()
+DEST_REGION = os.getenv('DEST_REGION', os.getenv('AWS_DEFAULT_REGION')).strip()
+PATTERN = os.getenv('PATTERN', 'ALL_SNAPSHOTS')
+DRILL_MAX_CLUSTERS = int(os.getenv('DRILL_MAX_CLUSTERS', '1'))
+DRILL_INSTANCE_CLASS = os.getenv('DRILL_INSTANCE_CLASS', 'db.t3.medium').strip()
+DRILL_SUBNET_GROUP = os.getenv('DRILL_SUBNET_GROUP', '').strip()
+DRILL_SECURITY_GROUPS = [group.strip() for group in os.getenv('DRILL_SECURITY_GROUPS', '').split(',') if group.strip()]
+DRILL_PREFIX = os.getenv('DRILL_PREFIX', 'snapshots-tool-drill-').strip()
+DRILL_TIMEOUT_HOURS = float(os.getenv('DRILL_TIMEOUT_HOURS', '6'))
+DRILL_METRIC_NAMESPACE = os.getenv('DRILL_METRIC_NAMESPACE', 'SnapshotsToolAurora/RestoreDrill').strip()
+
+# Tags that hold the state of a drill on its cluster. Times are epoch seconds
+TAG_SNAPSHOT = 'DrillSnapshot'
+TAG_SOURCE_CLUSTER = 'DrillSourceCluster'
+TAG_SNAPSHOT_SIZE = 'DrillSnapshotSize'
+TAG_STARTED = 'DrillStartedAt'
+TAG_CLUSTER_AVAILABLE = 'DrillClusterAvailableAt'
+
+# Cluster statuses a restore does not recover from. Any other status, such as stopped, upgrading or maintenance, leaves the drill
+# in progress until DRILL_TIMEOUT_HOURS
+FAILED_STATUSES = ('failed', 'incompatible-restore', 'incompatible-parameters', 'incompatible-network',
+                   'inaccessible-encryption-credentials', 'inaccessible-encryption-credentials-recoverable')
+
+
+logger = logging.getLogger()
+logger.setLevel(LOGLEVEL.upper())
+
+
+
+def get_drill_identifier(cluster_identifier):
+    # Cluster identifiers are limited to 63 characters and the instance identifier adds 9 more
+    return (DRILL_PREFIX + cluster_identifier)[:54].rstrip('-')
+
+
+def get_tags(db_cluster):
+    return dict((tag['Key'], tag['Value']) for tag in db_cluster.get('TagList', []))
+
+
+def is_drill_cluster(db_cluster):
+    # Drill clusters have the drill prefix and the tags start_drill sets. Anything else is never torn down, whatever its name
+    tags = get_tags(db_cluster)
+
+    return (db_cluster['DBClusterIdentifier'].startswith(DRILL_PREFIX) and tags.get('CreatedBy') == 'Snapshot Tool for Aurora'
+            and TAG_STARTED in tags and TAG_SNAPSHOT in tags)
+
+
+def select_snapshots(client, response, now):
+    # Returns the latest available snapshot copied by the tool for each cluster matching PATTERN, taking DRILL_MAX_CLUSTERS
+    # clusters in turn by day
+    snapshots = dict((snapshot['DBClusterSnapshotIdentifier'], snapshot) for snapshot in response['DBClusterSnapshots'])
+
+    with stage('filtering'):
+        own_snapshots = get_own_snapshots_dest(PATTERN, response)
+
+    per_cluster = {}
+    for snapshot_identifier, snapshot_object in own_snapshots.items():
+        if snapshot_object['Status'] == 'available':
+            creation_date = get_timestamp(snapshot_identifier, own_snapshots) or snapshots[snapshot_identifier]['SnapshotCreateTime'].replace(tzinfo=None)
+            per_cluster.setdefault(snapshot_object['DBClusterIdentifier'], []).append((creation_date, snapshot_identifier))
+
+    latest = {}
+    for cluster_identifier, candidates in per_cluster.items():
+        for creation_date, snapshot_identifier in sorted(candidates, reverse=True):
+            if search_tag_copied(list_tags(client, own_snapshots[snapshot_identifier]['Arn'])):
+                latest[cluster_identifier] = snapshots[snapshot_identifier]
+                break
+
+    clusters = sorted(latest)
+    if not clusters:
+        return []
+
+    start = (now.toordinal() * DRILL_MAX_CLUSTERS) % len(clusters)
+    turn = (clusters + clusters)[start:start + min(DRILL_MAX_CLUSTERS, len(clusters))]
+
+    return [latest[cluster_identifier] for cluster_identifier in turn]
+
+
+def start_drill(client, snapshot, now):
+    drill_identifier = get_drill_identifier(snapshot['DBClusterIdentifier'])
+    parameters = {
+        'DBClusterIdentifier': drill_identifier,
+        'SnapshotIdentifier': snapshot['DBClusterSnapshotIdentifier'],
+        'Engine': snapshot['Engine'],
+        'Tags': [
+            {'Key': 'CreatedBy', 'Value': 'Snapshot Tool for Aurora'},
+            {'Key': TAG_SNAPSHOT, 'Value': snapshot['DBClusterSnapshotIdentifier']},
+            {'Key': TAG_SOURCE_CLUSTER, 'Value': snapshot['DBClusterIdentifier']},
+            {'Key': TAG_SNAPSHOT_SIZE, 'Value': str(snapshot.get('AllocatedStorage', 0))},
+            {'Key': TAG_STARTED, 'Value': '%.0f' % now}]}
+
+    if snapshot.get('EngineVersion'):
+        parameters['EngineVersion'] = snapshot['EngineVersion']
+
+    if DRILL_SUBNET_GROUP:
+        parameters['DBSubnetGroupName'] = DRILL_SUBNET_GROUP
+
+    if DRILL_SECURITY_GROUPS:
+        parameters['VpcSecurityGroupIds'] = DRILL_SECURITY_GROUPS
+
+    logger.info('Starting restore drill %s from %s' % (drill_identifier, snapshot['DBClusterSnapshotIdentifier']))
+
+    with stage('mutations'):
+        client.restore_db_cluster_from_snapshot(**parameters)
+
+    return {'Cluster': snapshot['DBClusterIdentifier'], 'Snapshot': snapshot['DBClusterSnapshotIdentifier'], 'Phase': 'restoring_cluster'}
+
+
+def tear_down(client, db_cluster, instances):
+    with stage('mutations'):
+        for db_instance in instances:
+            if db_instance['DBInstanceStatus'] != 'deleting':
+                client.delete_db_instance(DBInstanceIdentifier=db_instance['DBInstanceIdentifier'])
+
+        if db_cluster['Status'] != 'deleting':
+            client.delete_db_cluster(DBClusterIdentifier=db_cluster['DBClusterIdentifier'], SkipFinalSnapshot=True)
+
+
+def publish_drill(result, cloudwatch=None):
+    # Logs the result of a finished drill and puts it to CloudWatch: the duration of each phase with the snapshot size, or a failure
+    logger.warning('Restore drill: %s' % json.dumps(result, sort_keys=True))
+
+    if DRILL_METRIC_NAMESPACE.upper() == 'NONE':
+        return
+
+    dimensions = [{'Name': 'DBClusterIdentifier', 'Value': result['Cluster']}]
+
+    if result['Phase'] == 'failed':
+        metrics = [('RestoreDrillFailed', 1, 'Count')]
+
+    else:
+        metrics = [('RestoreClusterSeconds', result['ClusterSeconds'], 'Seconds'),
+                   ('RestoreInstanceSeconds', result['InstanceSeconds'], 'Seconds'),
+                   ('RestoreTotalSeconds', result['TotalSeconds'], 'Seconds'),
+                   ('RestoreSnapshotSizeGiB', result['SnapshotSizeGiB'], 'Gigabytes')]
+
+    (cloudwatch or boto3.client('cloudwatch', region_name=DEST_REGION)).put_metric_data(
+        Namespace=DRILL_METRIC_NAMESPACE,
+        MetricData=[{'MetricName': name, 'Dimensions': dimensions, 'Value': value, 'Unit': unit} for name, value, unit in metrics])
+
+
+def advance_drill(client, db_cluster, now, publish):
+    # Moves one drill a step forward. Returns its state
+    tags = get_tags(db_cluster)
+    drill_identifier = db_cluster['DBClusterIdentifier']
+    state = {'Cluster': tags.get(TAG_SOURCE_CLUSTER, drill_identifier), 'Snapshot': tags.get(TAG_SNAPSHOT)}
+    instances = paginate_api_call(client, 'describe_db_instances', 'DBInstances',
+                                  Filters=[{'Name': 'db-cluster-id', 'Values': [drill_identifier]}])['DBInstances']
+
+    if db_cluster['Status'] == 'deleting':
+        state['Phase'] = 'deleting'
+        return state
+
+    started = float(tags.get(TAG_STARTED, now))
+
+    if db_cluster['Status'] in FAILED_STATUSES or now - started > DRILL_TIMEOUT_HOURS * 3600:
+        logger.error('Restore drill %s failed. Cluster status %s after %.0f seconds' % (drill_identifier, db_cluster['Status'], now - started))
+        state['Phase'] = 'failed'
+        # Tear down before publishing, so a failed put_metric_data does not leave the drill cluster running
+        tear_down(client, db_cluster, instances)
+        publish(state)
+        return state
+
+    if db_cluster['Status'] != 'available' and TAG_CLUSTER_AVAILABLE not in tags:
+        state['Phase'] = 'restoring_cluster'
+        return state
+
+    if TAG_CLUSTER_AVAILABLE not in tags:
+        tags[TAG_CLUSTER_AVAILABLE] = '%.0f' % now
+
+        with stage('mutations'):
+            client.add_tags_to_resource(ResourceName=db_cluster['DBClusterArn'], Tags=[{'Key': TAG_CLUSTER_AVAILABLE, 'Value': tags[TAG_CLUSTER_AVAILABLE]}])
+
+    if not instances:
+        with stage('mutations'):
+            client.create_db_instance(
+                DBInstanceIdentifier=drill_identifier + '-instance',
+                DBClusterIdentifier=drill_identifier,
+                DBInstanceClass=DRILL_INSTANCE_CLASS,
+                Engine=db_cluster['Engine'],
+                Tags=[{'Key': 'CreatedBy', 'Value': 'Snapshot Tool for Aurora'}])
+
+        state['Phase'] = 'creating_instance'
+        return state
+
+    if any(db_instance['DBInstanceStatus'] != 'available' for db_instance in instances):
+        state['Phase'] = 'creating_instance'
+        return state
+
+    cluster_available = float(tags[TAG_CLUSTER_AVAILABLE])
+    state.update({
+        'Phase': 'completed',
+        'ClusterSeconds': round(cluster_available - started),
+        'InstanceSeconds': round(now - cluster_available),
+        'TotalSeconds': round(now - started),
+        'SnapshotSizeGiB': int(tags.get(TAG_SNAPSHOT_SIZE, 0))})
+
+    tear_down(client, db_cluster, instances)
+    publish(state)
+
+    return state
+
+
+def run_drills(client, now=None, publish=publish_drill):
+    # Advances the drills in progress, or starts new ones when there are none. Returns the state of each drill
+    if not DRILL_PREFIX:
+        raise SnapshotToolException('DRILL_PREFIX must not be empty')
+
+    now = time.time() if now is None else now
+    drill_clusters = [db_cluster for db_cluster in paginate_api_call(client, 'describe_db_clusters', 'DBClusters')['DBClusters']
+                      if is_drill_cluster(db_cluster)]
+
+    if drill_clusters:
+        with stage('decision_loop'):
+            return [advance_drill(client, db_cluster, now, publish) for db_cluster in drill_clusters]
+
+    response = describe_cluster_snapshots(client, SnapshotType='manual')
+
+    with stage('decision_loop'):
+        return [start_drill(client, snapshot, now) for snapshot in select_snapshots(client, response, datetime.fromtimestamp(now, timezone.utc))]
+
+
+@snapshots_tool_handler
+def lambda_handler(event, context):
+    client = get_rds_client(DEST_REGION)
+    drills = run_drills(client)
+
+    for drill in drills:
+        logger.info('Restore drill of %s from %s: %s' % (drill['Cluster'], drill['Snapshot'], drill['Phase']))
+
+    # Drill clusters being deleted need no more work. Failed drills are reported through publish_drill, not retried
+    in_progress = [drill for drill in drills if drill['Phase'] not in ('completed', 'failed', 'deleting')]
+
+    if in_progress:
+        log_message = 'Restore drills in progress: %s. Needs retrying' % ', '.join(drill['Cluster'] for drill in in_progress)
+        logger.error(log_message)
+        raise items_pending(log_message, {}, 'Clusters', [drill['Cluster'] for drill in in_progress])
+
+    return {'Drills': drills}
+
+
+if __name__ == '__main__':
+    lambda_handler(None, None)
@@ -0,0 +1,170 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# run_snapshots_tool
+# Runs the logic of any of the Snapshots Tool for Aurora Lambda functions from a workstation or batch host, for backfills and bulk operations.
+# Every region and account combination runs in its own worker process, so the environment variables the functions read at import time
+# can differ between workers. Progress is reported as workers finish and the results are aggregated at the end.
+# Example:
+#   python run_snapshots_tool.py take_snapshots_aurora --regions us-east-1 us-west-2 --accounts 111111111111 222222222222 \
+#       --role-name SnapshotsToolAurora --pattern '^prod-' --env INTERVAL=24
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+
+_FUNCTIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def list_functions():
+    # Every folder next to this file that contains a lambda_function.py
+    return sorted(name for name in os.listdir(_FUNCTIONS_DIR)
+                  if os.path.isfile(os.path.join(_FUNCTIONS_DIR, name, 'lambda_function.py')))
+
+
+def parse_env(assignments):
+    env = {}
+
+    for assignment in assignments:
+        if '=' not in assignment:
+            raise argparse.ArgumentTypeError('--env expects KEY=VALUE, got %s' % assignment)
+
+        key, value = assignment.split('=', 1)
+        env[key.strip()] = value
+
+    return env
+
+
+def assume_role_env(account, role_name, region):
+    # Returns the environment variables holding temporary credentials for role_name in account
+    import boto3
+
+    credentials = boto3.client('sts', region_name=region).assume_role(
+        RoleArn='arn:aws:iam::%s:role/%s' % (account, role_name),
+        RoleSessionName='snapshots-tool-cli-%s' % account)['Credentials']
+
+    return {
+        'AWS_ACCESS_KEY_ID': credentials['AccessKeyId'],
+        'AWS_SECRET_ACCESS_KEY': credentials['SecretAccessKey'],
+        'AWS_SESSION_TOKEN': credentials['SessionToken']}
+
+
+def run_task(task):
+    # Runs in a fresh worker process. Sets the environment for the region and account, then loads and runs the function
+    start = time.time()
+    result = {'Function': task['Function'], 'Region': task['Region'], 'Account': task['Account']}
+
+    try:
+        os.environ.update(task['Env'])
+        os.environ['AWS_DEFAULT_REGION'] = task['Region']
+        os.environ['REGION_OVERRIDE'] = task['Region']
+        # Destination functions copy within the worker region unless DEST_REGION is passed with --env
+        os.environ.setdefault('DEST_REGION', task['Region'])
+
+        if task['Account'] and task['RoleName']:
+            os.environ.update(assume_role_env(task['Account'], task['RoleName'], task['Region']))
+
+        logging.basicConfig(format='%%(asctime)s %s %s %%(levelname)s %%(message)s' % (
+            task['Region'], task['Account'] or 'default'))
+
+        from snapshots_tool_utils import load_handler
+
+        result['Result'] = load_handler(task['Function']).lambda_handler(task['Event'], None)
+        result['Status'] = 'succeeded'
+
+    except Exception as e:
+        result['Status'] = 'failed'
+        result['Error'] = '%s: %s' % (e.__class__.__name__, e)
+
+    result['Seconds'] = round(time.time() - start, 3)
+
+    return result
+
+
+def build_tasks(args):
+    env = parse_env(args.env)
+    env['LOG_LEVEL'] = args.log_level
+
+    if args.pattern is not None:
+        env['PATTERN'] = args.pattern
+        env['SNAPSHOT_PATTERN'] = args.pattern
+
+    event = json.loads(args.event) if args.event else {}
+    accounts = args.accounts or [None]
+
+    return [{'Function': args.function, 'Region': region, 'Account': account, 'RoleName': args.role_name, 'Env': env, 'Event': event}
+            for account in accounts for region in args.regions]
+
+
+def run_tasks(tasks, processes, output=sys.stderr):
+    # Fans the tasks out to a pool of fresh processes and reports progress as they finish
+    results = []
+    # spawn and one task per child, so no module state read from the environment leaks between regions and accounts
+    context = multiprocessing.get_context('spawn')
+    pool = context.Pool(processes=max(1, min(processes, len(tasks))), maxtasksperchild=1)
+
+    try:
+        for result in pool.imap_unordered(run_task, tasks):
+            results.append(result)
+            output.write('[%s/%s] %s %s %s: %s in %s s%s\n' % (
+                len(results), len(tasks), result['Function'], result['Region'], result['Account'] or 'default',
+                result['Status'], result['Seconds'], ' (%s)' % result['Error'] if 'Error' in result else ''))
+            output.flush()
+
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+
+def summarize(results):
+    summary = {'Succeeded': 0, 'Failed': 0, 'Results': sorted(results, key=lambda result: (result['Account'] or '', result['Region']))}
+
+    for result in results:
+        summary['Succeeded' if result['Status'] == 'succeeded' else 'Failed'] += 1
+
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a Snapshots Tool for Aurora function across regions and accounts')
+    parser.add_argument('function', choices=list_functions(), help='Function to run')
+    parser.add_argument('--regions', nargs='+', required=True, help='Regions to run in')
+    parser.add_argument('--accounts', nargs='+', help='Accounts to run in. Requires --role-name. Defaults to the current credentials')
+    parser.add_argument('--role-name', help='Role assumed in each account')
+    parser.add_argument('--pattern', help='Sets PATTERN and SNAPSHOT_PATTERN')
+    parser.add_argument('--env', nargs='*', default=[], metavar='KEY=VALUE', help='Other environment variables the function reads')
+    parser.add_argument('--event', help='JSON event passed to the function')
+    parser.add_argument('--processes', type=int, default=8, help='Maximum number of worker processes (default: 8)')
+    parser.add_argument('--log-level', default='ERROR', help='LOG_LEVEL of the function (default: ERROR)')
+    parser.add_argument('--output', help='Write the aggregated results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    if args.accounts and not args.role_name:
+        parser.error('--accounts requires --role-name')
+
+    summary = summarize(run_tasks(build_tasks(args), args.processes))
+    sys.stderr.write('%s succeeded, %s failed\n' % (summary['Succeeded'], summary['Failed']))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(summary, output, indent=2, default=str)
+
+    return 1 if summary['Failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,8 +11,11 @@ or in the "license" file accompanying this file. This file is distributed on an
 # share_snapshots_aurora
 # This Lambda function shares snapshots created by aurora_take_snapshot with the account set in the environment variable DEST_ACCOUNT
 # It will only share snapshots tagged with shareAndCopy and a value of YES
+# Set MANIFEST_LOCATION to publish the snapshots shared for the first time to a manifest read by copy_snapshots_dest_aurora
+# Invoke with {"Snapshots": ["<snapshot identifier>"]} or {"Clusters": ["<cluster identifier>"]} to share only those snapshots. The outcome for each snapshot is returned
 import boto3
 from datetime import datetime
+import functools
 import time
 import os
 import logging
@@ -24,6 +27,8 @@ from snapshots_tool_utils import *
 LOGLEVEL = os.getenv('LOG_LEVEL', 'ERROR').strip()
 DEST_ACCOUNTID = str(os.getenv('DEST_ACCOUNT', '000000000000')).strip()
 PATTERN = os.getenv('PATTERN', 'ALL_CLUSTERS')
+# Stop retrying failed shares this many seconds before the Lambda timeout
+TIME_MARGIN_SECONDS = int(os.getenv('TIME_MARGIN_SECONDS', '30'))
 
 if os.getenv('REGION_OVERRIDE', 'NO') != 'NO':
     REGION = os.getenv('REGION_OVERRIDE').strip()
@@ -36,36 +41,76 @@ logger.setLevel(LOGLEVEL.upper())
 
 
 
+@snapshots_tool_handler
 def lambda_handler(event, context):
-    pending_snapshots = 0
-    client = boto3.client('rds', region_name=REGION)
-    response = paginate_api_call(client, 'describe_db_cluster_snapshots', 'DBClusterSnapshots', SnapshotType='manual')
-    filtered = get_own_snapshots_share(PATTERN, response)
-
-    # Search all snapshots for the correct tag
-    for snapshot_identifier,snapshot_object in filtered.items():
-        snapshot_arn = snapshot_object['Arn']
-        response_tags = client.list_tags_for_resource(
-            ResourceName=snapshot_arn)
-
-        if snapshot_object['Status'].lower() == 'available' and search_tag_share(response_tags):
-            try:
-                # Share snapshot with dest_account
-                response_modify = client.modify_db_cluster_snapshot_attribute(
+    retries = RetryQueue(deadline=get_deadline(context, TIME_MARGIN_SECONDS))
+    client = get_rds_client(REGION)
+    targets = get_targets(event)
+
+    if targets is not None:
+        # On-demand run: describe only the requested snapshots
+        response = describe_target_snapshots(client, targets, SnapshotType='manual')
+        outcomes = target_outcomes(targets)
+
+    else:
+        response = describe_cluster_snapshots(client, SnapshotType='manual')
+        outcomes = {}
+
+    with stage('filtering'):
+        filtered = get_own_snapshots_share(PATTERN, response)
+
+    shared = set()
+
+    with stage('decision_loop'):
+        # Search all snapshots for the correct tag
+        for snapshot_identifier,snapshot_object in filtered.items():
+            snapshot_arn = snapshot_object['Arn']
+            response_tags = list_tags(client, snapshot_arn)
+
+            if snapshot_object['Status'].lower() == 'available' and search_tag_share(response_tags):
+                share = functools.partial(
+                    client.modify_db_cluster_snapshot_attribute,
                     DBClusterSnapshotIdentifier=snapshot_identifier,
                     AttributeName='restore',
                     ValuesToAdd=[
                         DEST_ACCOUNTID
                     ]
                 )
-            except Exception as e:
-                logger.error('Exception sharing {}: {}'.format(snapshot_identifier, e))
-                pending_snapshots += 1
 
-    if pending_snapshots > 0:
-        log_message = 'Could not share all snapshots. Pending: %s' % pending_snapshots
+                try:
+                    # Share snapshot with dest_account
+                    with stage('mutations'):
+                        response_modify = share()
+                    outcomes[snapshot_identifier] = 'shared'
+                    shared.add(snapshot_object['Arn'])
+                except Exception as e:
+                    logger.error('Exception sharing {}: {}'.format(snapshot_identifier, e))
+                    retries.add(snapshot_identifier, e, share)
+                    outcomes[snapshot_identifier] = 'share_failed'
+
+            elif snapshot_object['Status'].lower() != 'available':
+                outcomes[snapshot_identifier] = 'not_available'
+
+            else:
+                outcomes[snapshot_identifier] = 'not_tagged'
+
+    for snapshot_identifier in retries.drain():
+        outcomes[snapshot_identifier] = 'shared'
+        shared.add(filtered[snapshot_identifier]['Arn'])
+
+    if manifest_enabled():
+        publish_shared(get_account_id(), REGION, [snapshot for snapshot in response['DBClusterSnapshots']
+                                                  if snapshot['DBClusterSnapshotArn'] in shared], DEST_ACCOUNTID, targets is None)
+
+    if targets is not None:
+        return targeted_result(outcomes, retries.failed())
+
+    record_outcomes(outcomes)
+
+    if retries.errors:
+        log_message = 'Could not share all snapshots. Pending: %s' % len(retries.errors)
         logger.error(log_message)
-        raise SnapshotToolException(log_message)
+        raise items_pending(log_message, retries.failed())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,256 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# snapshots_tool_export
+# Optional export of the snapshot catalog for analytics. Every full listing of a region that a run pages through anyway is written once
+# per invocation as a gzipped JSON lines object under
+# <EXPORT_LOCATION>/snapshots/date=<YYYY-MM-DD>/region=<region>/account=<account>/, one line per snapshot, so reports on what exists and what
+# is replicated where read the export instead of calling the RDS API. Targeted listings of a few clusters or snapshots are not exported.
+# Set EXPORT_LOCATION to s3://<bucket>/<prefix>, or to a local directory for tests and command line runs.
+# Set EXPORT_ENDPOINT_URL to use an S3 compatible store other than S3
+# Objects are written line by line to a temporary file under EXPORT_TMP_DIR (default: the system temporary directory) and uploaded
+# from there, so memory use does not grow with the number of snapshots
+
+from datetime import datetime
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+import boto3
+
+
+_EXPORT_LOCATION = os.getenv('EXPORT_LOCATION', '').strip()
+
+_EXPORT_ENDPOINT_URL = os.getenv('EXPORT_ENDPOINT_URL', '').strip() or None
+
+_EXPORT_TMP_DIR = os.getenv('EXPORT_TMP_DIR', '').strip() or None
+
+# Fields exported for each snapshot, on top of Region, Account, Listing and ExportedAt
+_EXPORT_FIELDS = ('DBClusterSnapshotIdentifier', 'DBClusterIdentifier', 'DBClusterSnapshotArn', 'SnapshotType', 'Status',
+                  'Engine', 'EngineVersion', 'StorageEncrypted', 'KmsKeyId', 'AllocatedStorage', 'SnapshotCreateTime',
+                  'PercentProgress', 'SourceDBClusterSnapshotArn')
+
+# Filters that do not narrow a listing to some clusters or snapshots
+_FULL_LISTING_FILTERS = ('engine',)
+
+logger = logging.getLogger()
+
+
+class LocalExportStore(object):
+    # Keeps exported objects as files under a directory. Used in tests and command line runs
+
+    def __init__(self, root):
+        self.root = root
+
+    def put_file(self, key, source_path):
+        path = os.path.join(self.root, key)
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        shutil.move(source_path, path + '.tmp')
+        os.rename(path + '.tmp', path)
+
+
+class S3ExportStore(object):
+    # Keeps exported objects in an S3 compatible bucket. upload_file switches to a multipart upload for large objects
+
+    def __init__(self, bucket, prefix='', client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.client = client or boto3.client('s3', endpoint_url=_EXPORT_ENDPOINT_URL)
+
+    def put_file(self, key, source_path):
+        self.client.upload_file(source_path, self.bucket, self.prefix + key,
+                                ExtraArgs={'ContentType': 'application/x-ndjson', 'ContentEncoding': 'gzip'})
+
+
+def get_export_store(location=_EXPORT_LOCATION):
+    # Returns the store for location, or None when the export is disabled
+    if not location:
+        return None
+
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        return S3ExportStore(bucket, prefix)
+
+    return LocalExportStore(location)
+
+
+_store = get_export_store()
+
+# The export of the invocation in progress, per thread. Nested handlers and pipeline stages share the export of the outer handler,
+# and worker threads, such as those of fleet accounts, are handed it through export_scope
+_local = threading.local()
+
+
+def set_export_store(store):
+    # Replaces the export store, for example with a LocalExportStore in tests. Pass None to disable the export
+    global _store
+    _store = store
+
+
+def export_enabled():
+    return _store is not None
+
+
+class ExportRun(object):
+    # The listings exported by one invocation, so each is only written once however many stages list it
+
+    def __init__(self):
+        self.exported = set()
+        self.depth = 0
+        self._lock = threading.Lock()
+
+    def claim(self, region, account, listing):
+        # Returns True the first time a listing is claimed in this run
+        with self._lock:
+            if (region, account, listing) in self.exported:
+                return False
+
+            self.exported.add((region, account, listing))
+            return True
+
+
+def current_export():
+    return getattr(_local, 'export', None)
+
+
+class export_scope(object):
+    # Makes run the export of this thread. Used to hand the export to worker threads
+
+    def __init__(self, run):
+        self.run = run
+
+    def __enter__(self):
+        self.outer_run = current_export()
+        _local.export = self.run
+        return self.run
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.export = self.outer_run
+        return False
+
+
+def begin_export():
+    # Starts the export of an invocation, or joins the one in progress in this thread. Returns None when the export is disabled
+    if _store is None:
+        return None
+
+    run = current_export()
+
+    if run is None:
+        run = ExportRun()
+        _local.export = run
+
+    with run._lock:
+        run.depth += 1
+
+    return run
+
+
+def end_export(run):
+    if run is None:
+        return
+
+    with run._lock:
+        run.depth -= 1
+        finished = run.depth == 0
+
+    if finished and current_export() is run:
+        _local.export = None
+        logger.info('Exported %s snapshot listings' % len(run.exported))
+
+
+def listing_name(query):
+    # Names a full listing after the snapshots it returns. Returns None for listings narrowed to some clusters or snapshots
+    if query.get('DBClusterIdentifier') or query.get('DBClusterSnapshotIdentifier'):
+        return None
+
+    if any(query_filter['Name'] not in _FULL_LISTING_FILTERS for query_filter in query.get('Filters', [])):
+        return None
+
+    listing = query.get('SnapshotType') or 'all'
+
+    if query.get('IncludeShared') and listing != 'shared':
+        listing += '-shared'
+
+    return listing
+
+
+def export_key(region, account, listing, now):
+    return 'snapshots/date=%s/region=%s/account=%s/%s-%s-%s.jsonl.gz' % (
+        now.strftime('%Y-%m-%d'), region, account, now.strftime('%H%M%SZ'), listing, uuid.uuid4().hex[:8])
+
+
+def export_row(snapshot, region, account, listing, exported_at):
+    row = dict((field, snapshot[field]) for field in _EXPORT_FIELDS if field in snapshot)
+    row.update({'Region': region, 'Account': account, 'Listing': listing, 'ExportedAt': exported_at})
+
+    return row
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    raise TypeError('Cannot serialize %r' % value)
+
+
+def write_export(store, key, rows):
+    # Streams rows into a gzipped JSON lines file and hands it to store. Returns the number of rows written
+    handle, temporary_path = tempfile.mkstemp(suffix='.jsonl.gz', dir=_EXPORT_TMP_DIR)
+    count = 0
+
+    try:
+        with os.fdopen(handle, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as output:
+            for row in rows:
+                output.write(json.dumps(row, default=_encode, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+                output.write(b'\n')
+                count += 1
+
+        store.put_file(key, temporary_path)
+
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+    return count
+
+
+def export_listing(region, account, query, snapshots):
+    # Exports snapshots, the result of query in region and account, if it is a full listing not yet exported by the invocation.
+    # A failed export is logged and does not fail the run
+    run = current_export()
+
+    if run is None:
+        return
+
+    listing = listing_name(query)
+
+    if listing is None or not run.claim(region, account, listing):
+        return
+
+    now = datetime.utcnow()
+    key = export_key(region, account, listing, now)
+    exported_at = now.isoformat() + 'Z'
+
+    try:
+        count = write_export(_store, key, (export_row(snapshot, region, account, listing, exported_at) for snapshot in snapshots))
+        logger.debug('Exported %s snapshots to %s' % (count, key))
+
+    except Exception as e:
+        logger.warning('Could not export %s snapshot listing of %s in %s: %s' % (listing, account, region, e))
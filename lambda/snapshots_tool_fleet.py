@@ -0,0 +1,130 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# snapshots_tool_fleet
+# Optional fleet mode: one deployment works on several accounts by assuming a role in each of them.
+# Code running inside account_scope(account) gets RDS clients for that account from get_rds_client.
+# Set FLEET_ACCOUNTS to a comma separated list of account ids and FLEET_ROLE_NAME to the role to assume in each (default: SnapshotsToolFleetRole)
+# Credentials are cached per account and renewed FLEET_CREDENTIAL_MARGIN_SECONDS (default: 900) before they expire, so a warm
+# container does not call STS on every invocation and no handler holds credentials that expire while it runs.
+# Set FLEET_MAX_CALLS_PER_ACCOUNT to the number of RDS calls that may run at once in one account (default: 4), so accounts
+# worked on concurrently stay under their own API rate limits
+
+import logging
+import os
+import threading
+import time
+
+import boto3
+
+
+_FLEET_ACCOUNTS = [account.strip() for account in os.getenv('FLEET_ACCOUNTS', '').split(',') if account.strip()]
+
+_FLEET_ROLE_NAME = os.getenv('FLEET_ROLE_NAME', 'SnapshotsToolFleetRole').strip()
+
+_FLEET_ROLE_SESSION_SECONDS = int(os.getenv('FLEET_ROLE_SESSION_SECONDS', '3600'))
+
+_FLEET_CREDENTIAL_MARGIN_SECONDS = int(os.getenv('FLEET_CREDENTIAL_MARGIN_SECONDS', '900'))
+
+_FLEET_MAX_CALLS_PER_ACCOUNT = int(os.getenv('FLEET_MAX_CALLS_PER_ACCOUNT', '4'))
+
+# Maps account to (boto3 Session, expiration as time.time())
+_sessions = {}
+_sessions_lock = threading.Lock()
+_account_locks = {}
+
+_call_limits = {}
+
+_local = threading.local()
+
+logger = logging.getLogger()
+
+
+def fleet_accounts():
+    return list(_FLEET_ACCOUNTS)
+
+
+def current_account():
+    # The account of the enclosing account_scope, or None for the account the tool runs in
+    return getattr(_local, 'account', None)
+
+
+class account_scope(object):
+    # Makes account the account of this thread's RDS clients. None is the account the tool runs in
+
+    def __init__(self, account):
+        self.account = account
+
+    def __enter__(self):
+        self.outer_account = current_account()
+        _local.account = self.account
+        return self.account
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.account = self.outer_account
+        return False
+
+
+def get_role_arn(account):
+    return 'arn:aws:iam::%s:role/%s' % (account, _FLEET_ROLE_NAME)
+
+
+def get_account_session(account):
+    # Returns a boto3 Session with credentials for account, assuming the fleet role when there are no cached credentials or they
+    # expire within the margin. Accounts renew their credentials independently of each other
+    with _sessions_lock:
+        account_lock = _account_locks.setdefault(account, threading.Lock())
+
+    with account_lock:
+        cached = _sessions.get(account)
+
+        if cached is not None and cached[1] - _FLEET_CREDENTIAL_MARGIN_SECONDS > time.time():
+            return cached[0]
+
+        credentials = boto3.client('sts').assume_role(
+            RoleArn=get_role_arn(account),
+            RoleSessionName='snapshots-tool-%s' % account,
+            DurationSeconds=_FLEET_ROLE_SESSION_SECONDS)['Credentials']
+
+        session = boto3.Session(
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken'])
+
+        expiration = credentials['Expiration']
+        expiration = expiration.timestamp() if hasattr(expiration, 'timestamp') else time.time() + _FLEET_ROLE_SESSION_SECONDS
+
+        with _sessions_lock:
+            _sessions[account] = (session, expiration)
+
+        logger.info('Assumed %s, credentials valid for %s seconds' % (get_role_arn(account), int(expiration - time.time())))
+
+        return session
+
+
+def limit_account_calls(client, account):
+    # Makes calls of client wait while FLEET_MAX_CALLS_PER_ACCOUNT calls of clients of the same account are in flight
+    with _sessions_lock:
+        limit = _call_limits.setdefault(account, threading.BoundedSemaphore(max(1, _FLEET_MAX_CALLS_PER_ACCOUNT)))
+
+    def acquire(context, **kwargs):
+        limit.acquire()
+        context['snapshots_tool_call_slot'] = True
+
+    def release(context, **kwargs):
+        if context.pop('snapshots_tool_call_slot', False):
+            limit.release()
+
+    client.meta.events.register('before-call.rds', acquire)
+    client.meta.events.register('after-call.rds', release)
+    client.meta.events.register('after-call-error.rds', release)
+
+    return client
@@ -0,0 +1,381 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# snapshots_tool_inventory
+# Warm-container cache of describe_db_cluster_snapshots listings and snapshot tags for the Snapshots Tool for Aurora
+# Listings are keyed by region, account and query. Within INVENTORY_CACHE_TTL seconds a cached listing is reused and only
+# snapshots in a transitional status (creating, copying...) are described again. Snapshots created, copied or deleted by
+# the tool are patched into the cached listings so later stages of the same run see them.
+# The cache is off by default. Set INVENTORY_CACHE_TTL to the seconds a listing is reused to enable it. Snapshots created, shared or
+# deleted outside the tool are only seen once their listing expires
+# Set INVENTORY_CACHE_DIR (for example /tmp/snapshots_tool) to persist a compact index between invocations on the same container
+
+from collections import OrderedDict
+from datetime import datetime
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+
+_INVENTORY_CACHE_TTL = int(os.getenv('INVENTORY_CACHE_TTL', '0'))
+
+_INVENTORY_CACHE_MAX_ENTRIES = int(os.getenv('INVENTORY_CACHE_MAX_ENTRIES', '32'))
+
+_INVENTORY_CACHE_MAX_TAGS = int(os.getenv('INVENTORY_CACHE_MAX_TAGS', '20000'))
+
+_INVENTORY_CACHE_DIR = os.getenv('INVENTORY_CACHE_DIR', '').strip()
+
+# Above this many transitional snapshots it is cheaper to list the query again
+_INVENTORY_REFRESH_MAX = int(os.getenv('INVENTORY_REFRESH_MAX', '100'))
+
+_INVENTORY_REFRESH_CHUNK = 50
+
+# Only the attributes the tool reads or exports are kept, to bound memory and the size of the persisted index
+_COMPACT_FIELDS = ('DBClusterSnapshotIdentifier', 'DBClusterIdentifier', 'DBClusterSnapshotArn', 'SnapshotType', 'Status',
+                   'Engine', 'EngineVersion', 'StorageEncrypted', 'KmsKeyId', 'AllocatedStorage', 'SnapshotCreateTime',
+                   'PercentProgress', 'SourceDBClusterSnapshotArn')
+
+_STABLE_STATUSES = ('available', 'failed')
+
+logger = logging.getLogger()
+
+# (region, account, query) -> {'Time': epoch seconds, 'Snapshots': OrderedDict of DBClusterSnapshotArn -> compact snapshot}
+_listings = OrderedDict()
+
+# DBClusterSnapshotArn -> {'Time': epoch seconds, 'TagList': [...]}
+_tags = OrderedDict()
+
+_lock = threading.RLock()
+_loaded = False
+_dirty = False
+
+
+def inventory_enabled():
+    return _INVENTORY_CACHE_TTL > 0
+
+
+def compact_snapshot(snapshot):
+    return dict((field, snapshot[field]) for field in _COMPACT_FIELDS if field in snapshot)
+
+
+def query_key(region, account, query):
+    return (region, account, json.dumps(query, sort_keys=True, default=str))
+
+
+def snapshot_matches(query, snapshot):
+    # Returns True if snapshot would be returned by describe_db_cluster_snapshots called with query
+    snapshot_type = query.get('SnapshotType')
+
+    if snapshot_type and snapshot['SnapshotType'] != snapshot_type:
+        return False
+
+    if snapshot['SnapshotType'] == 'shared' and not query.get('IncludeShared'):
+        return False
+
+    if query.get('DBClusterIdentifier') and query['DBClusterIdentifier'] != snapshot['DBClusterIdentifier']:
+        return False
+
+    if query.get('DBClusterSnapshotIdentifier') and query['DBClusterSnapshotIdentifier'] not in (
+            snapshot['DBClusterSnapshotIdentifier'], snapshot['DBClusterSnapshotArn']):
+        return False
+
+    for query_filter in query.get('Filters', []):
+        if query_filter['Name'] == 'engine' and snapshot.get('Engine') not in query_filter['Values']:
+            return False
+
+        if query_filter['Name'] == 'db-cluster-id' and snapshot['DBClusterIdentifier'] not in query_filter['Values']:
+            return False
+
+        if query_filter['Name'] == 'db-cluster-snapshot-id' and snapshot['DBClusterSnapshotIdentifier'] not in query_filter['Values']:
+            return False
+
+    return True
+
+
+def query_covers(covering, query):
+    # Returns True if every snapshot matching query is also returned by the covering query, so query can be answered from its listing
+    for key in ('SnapshotType', 'DBClusterIdentifier', 'DBClusterSnapshotIdentifier'):
+        if covering.get(key) and covering.get(key) != query.get(key):
+            return False
+
+    if query.get('IncludeShared') and not covering.get('IncludeShared'):
+        return False
+
+    query_filters = dict((query_filter['Name'], set(query_filter['Values'])) for query_filter in query.get('Filters', []))
+
+    for covering_filter in covering.get('Filters', []):
+        if covering_filter['Name'] not in query_filters or not query_filters[covering_filter['Name']] <= set(covering_filter['Values']):
+            return False
+
+    return True
+
+
+def is_lookup(query):
+    # True for queries for named snapshots rather than listings
+    return bool(query.get('DBClusterSnapshotIdentifier')) or any(
+        query_filter['Name'] == 'db-cluster-snapshot-id' for query_filter in query.get('Filters', []))
+
+
+def _evict():
+    while len(_listings) > _INVENTORY_CACHE_MAX_ENTRIES:
+        _listings.popitem(last=False)
+
+    while len(_tags) > _INVENTORY_CACHE_MAX_TAGS:
+        _tags.popitem(last=False)
+
+
+def _refresh(client, query, snapshots):
+    # Describes again only the snapshots whose status can still change. Snapshots no longer returned were deleted
+    transitional = [snapshot['DBClusterSnapshotIdentifier'] for snapshot in snapshots.values()
+                    if snapshot['Status'] not in _STABLE_STATUSES]
+
+    if not transitional:
+        return snapshots
+
+    if len(transitional) > _INVENTORY_REFRESH_MAX:
+        return None
+
+    logger.debug('Refreshing %s cached snapshots in a transitional status' % len(transitional))
+    refreshed = OrderedDict((arn, snapshot) for arn, snapshot in snapshots.items()
+                            if snapshot['Status'] in _STABLE_STATUSES)
+    paginator = client.get_paginator('describe_db_cluster_snapshots')
+
+    for start in range(0, len(transitional), _INVENTORY_REFRESH_CHUNK):
+        chunk = transitional[start:start + _INVENTORY_REFRESH_CHUNK]
+
+        for page in paginator.paginate(IncludeShared=True, Filters=[{'Name': 'db-cluster-snapshot-id', 'Values': chunk}]):
+            for snapshot in page['DBClusterSnapshots']:
+                if snapshot_matches(query, snapshot):
+                    refreshed[snapshot['DBClusterSnapshotArn']] = compact_snapshot(snapshot)
+
+    return refreshed
+
+
+def cached_listing(client, account, query, fetch):
+    # Returns the DBClusterSnapshots for query, from the cache when fresh. fetch() lists them from the API
+    global _dirty
+
+    if not inventory_enabled():
+        return fetch()['DBClusterSnapshots']
+
+    load_inventory()
+    region = client.meta.region_name
+    key = query_key(region, account, query)
+
+    with _lock:
+        entry = _listings.get(key)
+
+        # A fresh listing of a broader query (for example every manual snapshot in the region) can answer a targeted one
+        if entry is None:
+            for covering_key, covering_entry in reversed(_listings.items()):
+                if covering_key[:2] == key[:2] and time.time() - covering_entry['Time'] < _INVENTORY_CACHE_TTL and query_covers(
+                        json.loads(covering_key[2]), query):
+                    key, entry = covering_key, covering_entry
+                    break
+
+    if entry is not None and time.time() - entry['Time'] < _INVENTORY_CACHE_TTL:
+        covering_query = json.loads(key[2])
+
+        # Worker threads patch the listing while others read it, so it is only read under the lock
+        with _lock:
+            cached = OrderedDict(entry['Snapshots'])
+
+        snapshots = _refresh(client, covering_query, cached)
+
+        if snapshots is not None:
+            with _lock:
+                if snapshots is not cached:
+                    entry['Snapshots'] = snapshots
+                    _dirty = True
+
+                if key in _listings:
+                    _listings.move_to_end(key)
+
+                matching = [snapshot for snapshot in entry['Snapshots'].values() if snapshot_matches(query, snapshot)]
+
+            logger.debug('Inventory cache hit for %s in %s' % (key[2], region))
+            return matching
+
+        key = query_key(region, account, query)
+
+    snapshots = OrderedDict((snapshot['DBClusterSnapshotArn'], compact_snapshot(snapshot))
+                            for snapshot in fetch()['DBClusterSnapshots'])
+
+    # Lookups of named snapshots are not kept as listings, so they do not push the listings of whole regions out of the cache
+    if is_lookup(query):
+        return list(snapshots.values())
+
+    with _lock:
+        _listings[key] = {'Time': time.time(), 'Snapshots': snapshots}
+        _listings.move_to_end(key)
+        _evict()
+        _dirty = True
+
+        return list(snapshots.values())
+
+
+def cached_tags(resource_arn, fetch):
+    # Returns the list_tags_for_resource response for resource_arn, from the cache when fresh
+    global _dirty
+
+    if not inventory_enabled():
+        return fetch()
+
+    load_inventory()
+
+    with _lock:
+        entry = _tags.get(resource_arn)
+
+    if entry is not None and time.time() - entry['Time'] < _INVENTORY_CACHE_TTL:
+        return {'TagList': entry['TagList']}
+
+    response = fetch()
+
+    with _lock:
+        _tags[resource_arn] = {'Time': time.time(), 'TagList': response.get('TagList', [])}
+        _tags.move_to_end(resource_arn)
+        _evict()
+        _dirty = True
+
+    return response
+
+
+def record_snapshot(region, account, snapshot, tags=None):
+    # Patches a snapshot returned by create_db_cluster_snapshot or copy_db_cluster_snapshot into the cached listings
+    global _dirty
+
+    if not inventory_enabled():
+        return
+
+    compact = compact_snapshot(snapshot)
+
+    with _lock:
+        for key, entry in _listings.items():
+            if key[0] == region and key[1] == account and snapshot_matches(json.loads(key[2]), compact):
+                entry['Snapshots'][compact['DBClusterSnapshotArn']] = compact
+
+        if tags is not None:
+            _tags[compact['DBClusterSnapshotArn']] = {'Time': time.time(), 'TagList': tags}
+            _evict()
+
+        _dirty = True
+
+
+def forget_snapshot(region, account, snapshot_identifier):
+    # Removes a snapshot deleted by the tool from the cached listings
+    global _dirty
+
+    if not inventory_enabled():
+        return
+
+    with _lock:
+        for key, entry in _listings.items():
+            if key[0] == region and key[1] == account:
+                for arn, snapshot in list(entry['Snapshots'].items()):
+                    if snapshot_identifier in (snapshot['DBClusterSnapshotIdentifier'], arn):
+                        del entry['Snapshots'][arn]
+                        _tags.pop(arn, None)
+
+        _dirty = True
+
+
+def clear_inventory():
+    global _dirty
+
+    with _lock:
+        _listings.clear()
+        _tags.clear()
+        _dirty = True
+
+
+def _inventory_path():
+    return os.path.join(_INVENTORY_CACHE_DIR, 'inventory.json.gz')
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+
+    raise TypeError('Cannot serialize %r' % value)
+
+
+def _decode(value):
+    if '__datetime__' in value:
+        return datetime.fromisoformat(value['__datetime__'])
+
+    return value
+
+
+def load_inventory():
+    # Loads the index persisted by a previous invocation on this container. Only runs once per container
+    global _loaded
+
+    if _loaded or not _INVENTORY_CACHE_DIR:
+        _loaded = True
+        return
+
+    with _lock:
+        if _loaded:
+            return
+
+        _loaded = True
+
+        try:
+            with gzip.open(_inventory_path(), 'rt') as index:
+                persisted = json.load(index, object_hook=_decode)
+
+        except (IOError, OSError, ValueError):
+            return
+
+        now = time.time()
+
+        for region, account, query, entry_time, snapshots in persisted['Listings']:
+            if now - entry_time < _INVENTORY_CACHE_TTL:
+                _listings[(region, account, query)] = {
+                    'Time': entry_time, 'Snapshots': OrderedDict((snapshot['DBClusterSnapshotArn'], snapshot) for snapshot in snapshots)}
+
+        for arn, entry_time, tag_list in persisted['Tags']:
+            if now - entry_time < _INVENTORY_CACHE_TTL:
+                _tags[arn] = {'Time': entry_time, 'TagList': tag_list}
+
+        logger.debug('Loaded %s cached listings from %s' % (len(_listings), _inventory_path()))
+
+
+def save_inventory():
+    # Persists the cache to INVENTORY_CACHE_DIR if it changed during this invocation
+    global _dirty
+
+    if not _INVENTORY_CACHE_DIR or not inventory_enabled() or not _dirty:
+        return
+
+    with _lock:
+        persisted = {
+            'Listings': [[key[0], key[1], key[2], entry['Time'], list(entry['Snapshots'].values())] for key, entry in _listings.items()],
+            'Tags': [[arn, entry['Time'], entry['TagList']] for arn, entry in _tags.items()]}
+        _dirty = False
+
+    try:
+        if not os.path.isdir(_INVENTORY_CACHE_DIR):
+            os.makedirs(_INVENTORY_CACHE_DIR)
+
+        # One temporary file per thread, since fleet mode saves the cache from several threads
+        temporary_path = '%s.%s.tmp' % (_inventory_path(), threading.get_ident())
+
+        with gzip.open(temporary_path, 'wt') as index:
+            json.dump(persisted, index, default=_encode, separators=(',', ':'))
+
+        os.rename(temporary_path, _inventory_path())
+
+    except (IOError, OSError) as e:
+        logger.warning('Could not persist inventory cache: %s' % e)
@@ -0,0 +1,317 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# snapshots_tool_lease
+# Optional run leases for the Snapshots Tool for Aurora, so overlapping scheduled runs and Step Functions retries do not scan the same
+# inventory and race to issue the same copies and deletes.
+# Set LEASE_TABLE to the name of a DynamoDB table with a string partition key named LeaseKey to enable leases
+# Set LEASE_TTL_SECONDS to the time a lease is kept without a heartbeat (default: 120). Held leases are renewed every third of it
+# Set LEASE_MODE to EXIT (default) to return immediately when another run holds the lease, or to PARTITIONS to let functions that
+# split their work into partitions (copy_snapshots_dest_aurora partitions by source account) take over the partitions not leased by the other run
+
+import logging
+import os
+import threading
+import time
+import uuid
+
+import boto3
+
+
+_LEASE_TABLE = os.getenv('LEASE_TABLE', '').strip()
+
+_LEASE_TTL_SECONDS = int(os.getenv('LEASE_TTL_SECONDS', '120'))
+
+_LEASE_MODE = os.getenv('LEASE_MODE', 'EXIT').strip().upper()
+
+logger = logging.getLogger()
+
+
+class InMemoryLeaseStore(object):
+    # Stand-in for the DynamoDB store with the same conditional write semantics. Used in tests and local runs
+
+    def __init__(self, clock=time.time):
+        self._items = {}
+        self._lock = threading.Lock()
+        self._clock = clock
+
+    def acquire(self, key, owner, ttl):
+        with self._lock:
+            item = self._items.get(key)
+
+            if item is not None and item['Owner'] != owner and item['ExpiresAt'] > self._clock():
+                return False
+
+            self._items[key] = {'Owner': owner, 'ExpiresAt': self._clock() + ttl}
+            return True
+
+    def renew(self, key, owner, ttl):
+        with self._lock:
+            item = self._items.get(key)
+
+            if item is None or item['Owner'] != owner:
+                return False
+
+            item['ExpiresAt'] = self._clock() + ttl
+            return True
+
+    def release(self, key, owner):
+        with self._lock:
+            item = self._items.get(key)
+
+            if item is not None and item['Owner'] == owner:
+                del self._items[key]
+
+    def get_owner(self, key):
+        with self._lock:
+            item = self._items.get(key)
+
+            if item is not None and item['ExpiresAt'] > self._clock():
+                return item['Owner']
+
+            return None
+
+
+class DynamoDBLeaseStore(object):
+    # Leases as items of a DynamoDB table, taken and renewed with conditional writes
+
+    def __init__(self, table_name, client=None):
+        self.table_name = table_name
+        self.client = client or boto3.client('dynamodb')
+
+    def acquire(self, key, owner, ttl):
+        now = time.time()
+
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={'LeaseKey': {'S': key}, 'Owner': {'S': owner}, 'ExpiresAt': {'N': '%.3f' % (now + ttl)}},
+                ConditionExpression='attribute_not_exists(LeaseKey) OR ExpiresAt < :now OR #owner = :owner',
+                ExpressionAttributeNames={'#owner': 'Owner'},
+                ExpressionAttributeValues={':now': {'N': '%.3f' % now}, ':owner': {'S': owner}})
+
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+        return True
+
+    def renew(self, key, owner, ttl):
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key={'LeaseKey': {'S': key}},
+                UpdateExpression='SET ExpiresAt = :expires',
+                ConditionExpression='#owner = :owner',
+                ExpressionAttributeNames={'#owner': 'Owner'},
+                ExpressionAttributeValues={':expires': {'N': '%.3f' % (time.time() + ttl)}, ':owner': {'S': owner}})
+
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+        return True
+
+    def release(self, key, owner):
+        try:
+            self.client.delete_item(
+                TableName=self.table_name,
+                Key={'LeaseKey': {'S': key}},
+                ConditionExpression='#owner = :owner',
+                ExpressionAttributeNames={'#owner': 'Owner'},
+                ExpressionAttributeValues={':owner': {'S': owner}})
+
+        except self.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    def get_owner(self, key):
+        item = self.client.get_item(TableName=self.table_name, Key={'LeaseKey': {'S': key}}, ConsistentRead=True).get('Item')
+
+        if item is not None and float(item['ExpiresAt']['N']) > time.time():
+            return item['Owner']['S']
+
+        return None
+
+
+if _LEASE_TABLE:
+    _store = DynamoDBLeaseStore(_LEASE_TABLE)
+else:
+    _store = None
+
+# The run lease of the invocation in progress, per thread, so that fleet mode can run the handlers of several accounts at once
+_local = threading.local()
+
+
+def set_lease_store(store):
+    # Replaces the lease store, for example with an InMemoryLeaseStore in tests. Pass None to disable leases
+    global _store
+    _store = store
+
+
+def leases_enabled():
+    return _store is not None
+
+
+class RunLease(object):
+    # Leases held by one run: the run lease and, in PARTITIONS mode, one lease per partition. A heartbeat thread renews them
+    # until release_all. Leases that cannot be renewed are considered lost
+
+    def __init__(self, store, name, owner, ttl=_LEASE_TTL_SECONDS, mode=_LEASE_MODE):
+        self.store = store
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl
+        self.mode = mode
+        self.acquired = False
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire(self, key=None):
+        key = self.name if key is None else '%s:%s' % (self.name, key)
+
+        if not self.store.acquire(key, self.owner, self.ttl):
+            return False
+
+        with self._lock:
+            self._held.add(key)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._heartbeat, name='lease-heartbeat')
+                self._thread.daemon = True
+                self._thread.start()
+
+        return True
+
+    def held(self, key=None):
+        key = self.name if key is None else '%s:%s' % (self.name, key)
+
+        with self._lock:
+            return key in self._held
+
+    def renew(self):
+        # Renews every held lease once. Leases that cannot be renewed are dropped
+        with self._lock:
+            keys = list(self._held)
+
+        for key in keys:
+            try:
+                renewed = self.store.renew(key, self.owner, self.ttl)
+
+            except Exception as e:
+                logger.error('Could not renew lease %s: %s' % (key, e))
+                renewed = False
+
+            if not renewed:
+                logger.error('Lost lease %s' % key)
+
+                with self._lock:
+                    self._held.discard(key)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.ttl / 3.0):
+            self.renew()
+
+    def release_all(self):
+        self._stop.set()
+
+        with self._lock:
+            keys = list(self._held)
+            self._held.clear()
+
+        for key in keys:
+            try:
+                self.store.release(key, self.owner)
+
+            except Exception as e:
+                logger.error('Could not release lease %s: %s' % (key, e))
+
+
+def current_run():
+    return getattr(_local, 'run', None)
+
+
+class run_scope(object):
+    # Makes run the current run of this thread. Used to hand the run to worker threads
+
+    def __init__(self, run):
+        self.run = run
+
+    def __enter__(self):
+        self.outer_run = current_run()
+        _local.run = self.run
+        return self.run
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.run = self.outer_run
+        return False
+
+
+def begin_run(name, context):
+    # Takes the run lease for name. Returns the RunLease, or None when leases are disabled
+    if _store is None:
+        return None
+
+    owner = getattr(context, 'aws_request_id', None) or uuid.uuid4().hex
+    run = RunLease(_store, name, owner)
+    run.acquired = run.acquire()
+    run.outer_run = current_run()
+    _local.run = run
+
+    if not run.acquired:
+        logger.warning('Lease %s is held by %s' % (name, _store.get_owner(name)))
+
+    return run
+
+
+def end_run(run):
+    if run is not None:
+        run.release_all()
+        _local.run = run.outer_run
+
+
+def lease_partitions(partitions):
+    # Returns the partitions this run may work on. Without leases, or in EXIT mode where only the lease holder gets this far, that
+    # is every partition. In PARTITIONS mode it is the partitions whose lease this run could take
+    run = current_run()
+
+    if run is None or run.mode != 'PARTITIONS':
+        return partitions
+
+    leased = dict((partition, items) for partition, items in partitions.items() if run.acquire(partition))
+
+    if len(leased) < len(partitions):
+        logger.warning('Skipping %s partitions leased by another run' % (len(partitions) - len(leased)))
+
+    return leased
+
+
+def lease_held():
+    # False once this run has lost its run lease, in any mode, so it must not make further changes. Runs that work on leased
+    # partitions without the run lease are checked per partition by partition_lease_held
+    run = current_run()
+
+    if run is None or not run.acquired:
+        return True
+
+    return run.held()
+
+
+def partition_lease_held(partition):
+    # False once the lease of partition, or the run lease, has been lost, so no new work should start on it
+    run = current_run()
+
+    if not lease_held():
+        return False
+
+    if run is None or run.mode != 'PARTITIONS':
+        return True
+
+    return run.held(partition)
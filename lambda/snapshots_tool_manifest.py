@@ -0,0 +1,252 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# snapshots_tool_manifest
+# Optional handoff of newly shared snapshots from the source stack to the destination stack.
+# share_snapshots_aurora appends one JSON lines object per run, listing the snapshots it shared for the first time, under
+# <MANIFEST_LOCATION>/shared/. copy_snapshots_dest_aurora reads the objects written since its last run and only describes the
+# snapshots listed there and those it has not finished with, instead of listing every snapshot in both regions.
+# Set MANIFEST_LOCATION to s3://<bucket>/<prefix> in both stacks, or to a local directory for tests and command line runs
+# Set MANIFEST_FULL_DISCOVERY_HOURS to how often the destination falls back to listing everything (default: 24), which also picks
+# up snapshots shared before the manifest was enabled or shared by hand
+
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import threading
+import uuid
+
+import boto3
+
+
+_MANIFEST_LOCATION = os.getenv('MANIFEST_LOCATION', '').strip()
+
+_MANIFEST_FULL_DISCOVERY_HOURS = float(os.getenv('MANIFEST_FULL_DISCOVERY_HOURS', '24'))
+
+# Manifest objects written up to this long before the newest one read are read again, in case writers' clocks or uploads lag
+_MANIFEST_LOOKBACK_SECONDS = 600
+
+_KEY_TIMESTAMP_FORMAT = '%Y%m%dT%H%M%S%fZ'
+
+# Outcomes of copy_snapshots_dest_aurora after which a snapshot needs no further checks
+_FINAL_OUTCOMES = ('up_to_date', 'local_deleted', 'too_old', 'no_timestamp')
+
+logger = logging.getLogger()
+
+
+class LocalManifestStore(object):
+    # Keeps manifest objects as files under a directory. Used in tests and command line runs
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def put(self, key, body):
+        path = os.path.join(self.root, key)
+
+        with self._lock:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+
+            with open(path + '.tmp', 'wb') as output:
+                output.write(body)
+
+            os.rename(path + '.tmp', path)
+
+    def get(self, key):
+        path = os.path.join(self.root, key)
+
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'rb') as source:
+            return source.read()
+
+    def list(self, prefix, start_after=''):
+        directory = os.path.join(self.root, prefix)
+
+        if not os.path.isdir(directory):
+            return []
+
+        keys = [prefix + name for name in os.listdir(directory) if not name.endswith('.tmp')]
+
+        return sorted(key for key in keys if key > start_after)
+
+
+class S3ManifestStore(object):
+    # Keeps manifest objects in an S3 compatible bucket
+
+    def __init__(self, bucket, prefix='', client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.client = client or boto3.client('s3')
+
+    def put(self, key, body):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=body)
+
+    def get(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body'].read()
+
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def list(self, prefix, start_after=''):
+        keys = []
+        paginator = self.client.get_paginator('list_objects_v2')
+
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix, StartAfter=self.prefix + start_after):
+            keys.extend(item['Key'][len(self.prefix):] for item in page.get('Contents', []))
+
+        return keys
+
+
+def get_manifest_store(location=_MANIFEST_LOCATION):
+    # Returns the store for location, or None when the manifest is disabled
+    if not location:
+        return None
+
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        return S3ManifestStore(bucket, prefix)
+
+    return LocalManifestStore(location)
+
+
+_store = get_manifest_store()
+
+
+def set_manifest_store(store):
+    # Replaces the manifest store, for example with a LocalManifestStore in tests. Pass None to disable the manifest
+    global _store
+    _store = store
+
+
+def manifest_enabled():
+    return _store is not None
+
+
+def manifest_entry(snapshot, shared_with):
+    # Compact manifest line for a snapshot from a describe_db_cluster_snapshots response
+    return {
+        'Identifier': snapshot['DBClusterSnapshotIdentifier'],
+        'Arn': snapshot['DBClusterSnapshotArn'],
+        'ClusterId': snapshot['DBClusterIdentifier'],
+        'StorageEncrypted': snapshot.get('StorageEncrypted', False),
+        'KmsKeyId': snapshot.get('KmsKeyId'),
+        'AllocatedStorage': snapshot.get('AllocatedStorage'),
+        'SnapshotCreateTime': snapshot['SnapshotCreateTime'].isoformat() if hasattr(
+            snapshot.get('SnapshotCreateTime'), 'isoformat') else snapshot.get('SnapshotCreateTime'),
+        'SharedWith': shared_with}
+
+
+def publish_shared(account, region, snapshots, shared_with, prune=True):
+    # Appends the snapshots shared with shared_with that were not published before. Returns the number of entries written.
+    # The identifiers already published are kept in an index per account and region. With prune, the index is reduced to the
+    # snapshots passed in, so it does not grow with snapshots deleted since
+    if _store is None:
+        return 0
+
+    index_key = 'index/%s-%s.json' % (account, region)
+    body = _store.get(index_key)
+    published = set(json.loads(body.decode('utf-8'))) if body else set()
+
+    entries = [manifest_entry(snapshot, shared_with) for snapshot in snapshots
+               if snapshot['DBClusterSnapshotArn'] not in published]
+
+    if entries:
+        key = 'shared/%s-%s-%s-%s.jsonl' % (datetime.utcnow().strftime(_KEY_TIMESTAMP_FORMAT), account, region, uuid.uuid4().hex[:8])
+        _store.put(key, ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries).encode('utf-8'))
+        logger.info('Published %s shared snapshots to %s' % (len(entries), key))
+
+    listed = set(snapshot['DBClusterSnapshotArn'] for snapshot in snapshots)
+    current = sorted((published & listed if prune else published) | set(entry['Arn'] for entry in entries))
+
+    if set(current) != published:
+        _store.put(index_key, json.dumps(current).encode('utf-8'))
+
+    return len(entries)
+
+
+class ManifestReader(object):
+    # Manifest entries for one destination account and region since its last run, plus the snapshots it has not finished with.
+    # full_discovery is True when the caller should list every snapshot instead
+
+    def __init__(self, store, account, region, now=None):
+        self.store = store
+        self.account = account
+        self.now = now or datetime.utcnow()
+        self.cursor_key = 'readers/%s-%s.json' % (account, region)
+
+        body = store.get(self.cursor_key)
+        self.cursor = json.loads(body.decode('utf-8')) if body else {}
+        self.open = dict(self.cursor.get('Open', {}))
+        self.newest = self.cursor.get('Newest', '')
+
+        last_full = self.cursor.get('LastFullDiscovery')
+        self.full_discovery = last_full is None or self.now - datetime.strptime(
+            last_full, _KEY_TIMESTAMP_FORMAT) > timedelta(hours=_MANIFEST_FULL_DISCOVERY_HOURS)
+
+        self.entries = {}
+
+        if not self.full_discovery:
+            self._read()
+
+    def _read(self):
+        start_after = ''
+
+        if self.newest:
+            lookback = datetime.strptime(self.newest, _KEY_TIMESTAMP_FORMAT) - timedelta(seconds=_MANIFEST_LOOKBACK_SECONDS)
+            start_after = 'shared/%s' % lookback.strftime(_KEY_TIMESTAMP_FORMAT)
+
+        keys = self.store.list('shared/', start_after)
+
+        for key in keys:
+            body = self.store.get(key) or b''
+
+            for line in body.decode('utf-8').splitlines():
+                entry = json.loads(line)
+
+                if entry.get('SharedWith') in (self.account, None):
+                    self.entries[entry['Identifier'].split(':')[-1]] = entry['Arn']
+
+            self.newest = max(self.newest, key[len('shared/'):].split('-')[0])
+
+        logger.info('Read %s manifest objects with %s snapshots. %s snapshots still open' % (
+            len(keys), len(self.entries), len(self.open)))
+
+    def snapshots(self):
+        # Maps the name of each snapshot to check to the ARN of the shared snapshot
+        return dict(self.open, **self.entries)
+
+    def commit(self, outcomes, shared_snapshots):
+        # Saves the cursor. Shared snapshots without a final outcome, including those not processed, are checked again by the next run.
+        # shared_snapshots maps snapshot name to attributes with the ARN of the shared snapshot
+        self.open = dict((identifier, attributes['Arn']) for identifier, attributes in shared_snapshots.items()
+                         if outcomes.get(identifier) not in _FINAL_OUTCOMES)
+
+        cursor = {'Newest': self.newest, 'Open': self.open, 'LastFullDiscovery': self.cursor.get('LastFullDiscovery')}
+
+        if self.full_discovery:
+            cursor['LastFullDiscovery'] = self.now.strftime(_KEY_TIMESTAMP_FORMAT)
+            # Everything published so far was covered by the full listing
+            cursor['Newest'] = max(self.newest, self.now.strftime(_KEY_TIMESTAMP_FORMAT))
+
+        self.store.put(self.cursor_key, json.dumps(cursor, sort_keys=True).encode('utf-8'))
+
+
+def read_manifest(account, region):
+    # Returns the ManifestReader for this account and region, or None when the manifest is disabled
+    if _store is None:
+        return None
+
+    return ManifestReader(_store, account, region)
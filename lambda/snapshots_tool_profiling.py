@@ -0,0 +1,196 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# snapshots_tool_profiling
+# Opt-in profiling for the Snapshots Tool for Aurora Lambda handlers
+# Set PROFILE to YES to run each invocation under cProfile and tracemalloc and record the time spent in named stages
+# Set PROFILE_OUTPUT to a file path to write the report there (useful for local runs). Otherwise it is written to the log
+# Set PROFILE_TOP to the number of functions and allocation sites to report (default: 25)
+# Stage timings are kept per invocation. Allocations and peak memory are traced process wide, so they include invocations running at the same time
+# When PROFILE is not YES, profiled_handler returns the handler untouched and stage() returns a shared no-op context manager
+
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+
+_PROFILE = os.getenv('PROFILE', 'NO').strip().upper() == 'YES'
+
+_PROFILE_OUTPUT = os.getenv('PROFILE_OUTPUT', '').strip()
+
+_PROFILE_TOP = int(os.getenv('PROFILE_TOP', '25'))
+
+# The profile report is written even when LOG_LEVEL is ERROR, since it is only produced when explicitly requested
+_profile_logger = logging.getLogger('snapshots_tool.profile')
+_profile_logger.setLevel(logging.INFO)
+
+# The stage timings of the profiled invocation in progress, per thread. Maps stage name to [calls, seconds]. Worker threads
+# join the timings of the invocation that started them through timings_scope, so concurrent invocations are timed separately
+_local = threading.local()
+_stage_lock = threading.Lock()
+
+# tracemalloc is process wide, so it runs while any profiled invocation does
+_memory_tracers = 0
+
+
+def current_timings():
+    # The stage timings of this thread's profiled invocation, or None when not profiling
+    return getattr(_local, 'timings', None)
+
+
+class timings_scope(object):
+    # Makes timings the stage timings of this thread, for work handed to worker threads
+
+    def __init__(self, timings):
+        self.timings = timings
+
+    def __enter__(self):
+        self.outer_timings = current_timings()
+        _local.timings = self.timings
+        return self.timings
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.timings = self.outer_timings
+        return False
+
+
+class _NullStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _TimedStage(object):
+
+    def __init__(self, name, timings):
+        self.name = name
+        self.timings = timings
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start
+        timings = self.timings
+
+        if timings is not None:
+            with _stage_lock:
+                totals = timings.setdefault(self.name, [0, 0.0])
+                totals[0] += 1
+                totals[1] += elapsed
+
+        return False
+
+
+def stage(name):
+    # Context manager that accumulates the time spent in the named stage (pagination, filtering, tag_lookups, decision_loop, mutations)
+    timings = current_timings()
+
+    if timings is None:
+        return _NULL_STAGE
+
+    return _TimedStage(name, timings)
+
+
+def format_profile_report(name, elapsed, timings, profiler, memory_snapshot, peak_memory):
+    # Builds a plain text report with stage timings, top functions by cumulative time and top allocation sites
+    report = io.StringIO()
+    report.write('Profile for %s: %.3f s wall time, %.1f KiB peak traced memory\n' % (name, elapsed, peak_memory / 1024.0))
+
+    report.write('Stages (inclusive, nested stages are counted in their parents):\n')
+    for stage_name, totals in sorted(timings.items(), key=lambda item: item[1][1], reverse=True):
+        report.write('  %-16s %6d calls %10.3f s\n' % (stage_name, totals[0], totals[1]))
+
+    report.write('Top %s functions by cumulative time:\n' % _PROFILE_TOP)
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats('cumulative').print_stats(_PROFILE_TOP)
+
+    report.write('Top %s allocation sites:\n' % _PROFILE_TOP)
+    for statistic in memory_snapshot.statistics('lineno')[:_PROFILE_TOP]:
+        report.write('  %s\n' % statistic)
+
+    return report.getvalue()
+
+
+def write_profile_report(report):
+    if _PROFILE_OUTPUT:
+        with open(_PROFILE_OUTPUT, 'a') as output:
+            output.write(report)
+
+    else:
+        _profile_logger.info(report)
+
+
+def get_handler_name(handler):
+    # Lambda packages are flattened, so prefer the function name over the directory the handler was loaded from
+    return os.getenv('AWS_LAMBDA_FUNCTION_NAME') or os.path.basename(
+        os.path.dirname(os.path.abspath(handler.__globals__.get('__file__', handler.__module__))))
+
+
+def profiled_handler(handler):
+    # Decorator for lambda_handler. Only wraps the handler when PROFILE is YES
+    if not _PROFILE:
+        return handler
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _memory_tracers
+
+        # Handlers run as stages of a pipeline, and accounts of a fleet run, are already covered by the outer profile
+        if current_timings() is not None:
+            return handler(event, context)
+
+        timings = {}
+        _local.timings = timings
+        profiler = cProfile.Profile()
+
+        with _stage_lock:
+            _memory_tracers += 1
+
+            if _memory_tracers == 1:
+                tracemalloc.start()
+
+        start = time.perf_counter()
+        profiler.enable()
+
+        try:
+            return handler(event, context)
+
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            _local.timings = None
+
+            with _stage_lock:
+                memory_snapshot = tracemalloc.take_snapshot()
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                _memory_tracers -= 1
+
+                if _memory_tracers == 0:
+                    tracemalloc.stop()
+
+            write_profile_report(format_profile_report(
+                get_handler_name(handler), elapsed, timings, profiler, memory_snapshot, peak_memory))
+
+    return wrapper
@@ -0,0 +1,102 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# snapshots_tool_quota
+# Admission control for calls that use up the manual cluster snapshot quota of a region (ManualClusterSnapshots).
+# The quota and its usage are read once per invocation from describe_account_attributes. Every create or copy the tool starts is
+# reserved against it, so calls that would fail with SnapshotQuotaExceeded are not made.
+# High priority work (new backups and copies to DEST_REGION) is admitted while any headroom is left. Low priority work (local copies of
+# shared snapshots, which hold a second slot until they reach DEST_REGION) is deferred when headroom falls to QUOTA_RESERVE (default: 5).
+# Set QUOTA_CHECK to NO to disable admission control
+
+import logging
+import os
+import threading
+
+
+_QUOTA_CHECK = os.getenv('QUOTA_CHECK', 'YES').strip().upper() != 'NO'
+
+_QUOTA_RESERVE = int(os.getenv('QUOTA_RESERVE', '5'))
+
+_QUOTA_NAME = 'ManualClusterSnapshots'
+
+logger = logging.getLogger()
+
+
+class SnapshotQuota(object):
+    # Projected manual snapshot usage of one region during an invocation
+
+    def __init__(self, region, maximum, used, reserve=_QUOTA_RESERVE):
+        self.region = region
+        self.maximum = maximum
+        self.used = used
+        self.reserve = reserve
+        self.reserved = 0
+        self.deferred = 0
+        self._lock = threading.Lock()
+
+    def headroom(self):
+        with self._lock:
+            return self.maximum - self.used - self.reserved
+
+    def admit(self, priority='high'):
+        # Reserves a slot for a create or copy. Returns False when the call should not be made
+        with self._lock:
+            floor = 0 if priority == 'high' else self.reserve
+
+            if self.maximum - self.used - self.reserved > floor:
+                self.reserved += 1
+                return True
+
+            self.deferred += 1
+
+        logger.warning('Deferring %s priority snapshot in %s. Manual snapshot quota: %s used, %s reserved, %s maximum' % (
+            priority, self.region, self.used, self.reserved, self.maximum))
+
+        return False
+
+    def cancel(self, exception=None):
+        # Returns the slot of an admitted call that failed. If it failed on the quota, nothing else is admitted
+        with self._lock:
+            self.reserved -= 1
+
+            if exception is not None and 'SnapshotQuotaExceeded' in '%s %s' % (exception.__class__.__name__, exception):
+                self.used = self.maximum
+
+    def freed(self, count=1):
+        # Called after snapshots in the region were deleted
+        with self._lock:
+            self.used = max(0, self.used - count)
+
+
+def get_snapshot_quota(client, listed=0):
+    # Returns the SnapshotQuota of the client's region, or None when admission control is disabled or the quota cannot be read.
+    # listed is the number of manual snapshots the caller already knows about, used when it is higher than the reported usage
+    if not _QUOTA_CHECK:
+        return None
+
+    try:
+        response = client.describe_account_attributes()
+
+    except Exception as e:
+        logger.warning('Could not read the manual snapshot quota: %s' % e)
+        return None
+
+    for quota in response.get('AccountQuotas', []):
+        if quota['AccountQuotaName'] == _QUOTA_NAME:
+            return SnapshotQuota(client.meta.region_name, quota['Max'], max(quota['Used'], listed))
+
+    return None
+
+
+def admit(quota, priority='high'):
+    # Admission for callers that may not have a quota
+    return quota is None or quota.admit(priority)
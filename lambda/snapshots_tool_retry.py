@@ -0,0 +1,122 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# snapshots_tool_retry
+# Item level retries. A mutation that fails with a transient error (throttling, service errors, a snapshot or cluster that is busy)
+# is queued and tried again once the other items are done, up to ITEM_RETRY_ATTEMPTS times (default: 3) with exponential backoff
+# starting at ITEM_RETRY_BASE_SECONDS (default: 2). Items that still fail are reported with the error class of their last failure.
+# The state machines retry the failed and pending items of a scheduled run with the Retry event its handler returns
+
+from collections import OrderedDict
+import logging
+import os
+import random
+import threading
+import time
+
+from snapshots_tool_lease import lease_held
+
+
+_ITEM_RETRY_ATTEMPTS = int(os.getenv('ITEM_RETRY_ATTEMPTS', '3'))
+
+_ITEM_RETRY_BASE_SECONDS = float(os.getenv('ITEM_RETRY_BASE_SECONDS', '2'))
+
+_ITEM_RETRY_MAX_SECONDS = 30
+
+# Error classes worth retrying within the same run. Anything else needs a change in the account, or time, to succeed
+_TRANSIENT_ERRORS = (
+    'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException', 'RequestThrottled',
+    'ServiceUnavailable', 'InternalFailure', 'InternalError', 'RequestTimeout', 'RequestTimeoutException',
+    'InvalidDBClusterStateFault', 'InvalidDBClusterSnapshotStateFault',
+    'EndpointConnectionError', 'ConnectionClosedError', 'ReadTimeoutError', 'ConnectTimeoutError')
+
+logger = logging.getLogger()
+
+
+def error_class(exception):
+    # The error code of an API error, or the name of the exception class
+    response = getattr(exception, 'response', None)
+
+    if isinstance(response, dict) and response.get('Error', {}).get('Code'):
+        return response['Error']['Code']
+
+    return exception.__class__.__name__
+
+
+def is_transient(exception):
+    return error_class(exception) in _TRANSIENT_ERRORS
+
+
+class RetryQueue(object):
+    # Failed mutations of one run. Failures with a transient error class are retried by drain, the others are reported as they are
+
+    def __init__(self, attempts=_ITEM_RETRY_ATTEMPTS, deadline=None):
+        self.attempts = attempts
+        self.deadline = deadline
+        self.errors = OrderedDict()
+        self._calls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, item, exception, call):
+        # Records the failure of item. call makes the mutation again and raises if it fails. Returns True when it will be retried
+        with self._lock:
+            self.errors[item] = exception
+
+            if is_transient(exception):
+                self._calls[item] = call
+                return True
+
+        return False
+
+    def drain(self):
+        # Retries the queued calls with backoff. Returns a dict of item -> result of the calls that succeeded.
+        # The items that still fail keep their last exception in errors
+        results = {}
+
+        for attempt in range(self.attempts):
+            if not self._calls:
+                break
+
+            delay = min(_ITEM_RETRY_MAX_SECONDS, _ITEM_RETRY_BASE_SECONDS * 2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+
+            if self.deadline is not None and time.time() + delay > self.deadline:
+                logger.warning('Not retrying %s items. Out of time' % len(self._calls))
+                break
+
+            time.sleep(delay)
+
+            if not lease_held():
+                logger.warning('Not retrying %s items. Lost the run lease' % len(self._calls))
+                break
+
+            for item, call in list(self._calls.items()):
+                try:
+                    results[item] = call()
+
+                except Exception as e:
+                    self.errors[item] = e
+
+                    if not is_transient(e):
+                        del self._calls[item]
+
+                else:
+                    del self._calls[item]
+                    del self.errors[item]
+
+            logger.info('Retry %s: %s items succeeded, %s still failing' % (attempt + 1, len(results), len(self.errors)))
+
+        return results
+
+    def failed(self):
+        # Maps each item that still failed to its error class
+        return OrderedDict((item, error_class(exception)) for item, exception in self.errors.items())
+
@@ -0,0 +1,222 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# snapshots_tool_schedule
+# Size aware scheduling of snapshot copies. The duration of a copy is predicted from the AllocatedStorage of the snapshot and the copy
+# throughput observed between its source and destination regions. Copies start with the longest predicted duration first, so large
+# snapshots start early instead of holding up replication at the end. Set COPY_MAX_IN_FLIGHT to keep at most that many copies in progress
+# into each region, counting those already copying (default: 0, no cap). Copies that do not get a slot are left for the next run.
+# Copies started by the tool are tracked. When a later run finds one available, its duration updates the throughput of the region pair
+# and the prediction error is logged. Durations are measured between runs, so they are rounded up to the schedule of the function.
+# Tracked copies also count against the slots of retries, which only list the items they retry.
+# The history is kept in the warm container. Set COPY_HISTORY_LOCATION to s3://<bucket>/<prefix> or a local directory to share it between
+# containers and deployments. Set COPY_DEFAULT_GIB_PER_HOUR to the throughput assumed for region pairs with no history (default: 100)
+
+import json
+import logging
+import os
+import threading
+import time
+
+from snapshots_tool_manifest import get_manifest_store
+from snapshots_tool_summary import log_item
+
+
+_COPY_MAX_IN_FLIGHT = int(os.getenv('COPY_MAX_IN_FLIGHT', '0')) or None
+
+_COPY_DEFAULT_GIB_PER_HOUR = float(os.getenv('COPY_DEFAULT_GIB_PER_HOUR', '100'))
+
+_COPY_HISTORY_LOCATION = os.getenv('COPY_HISTORY_LOCATION', '').strip()
+
+# Time every copy takes whatever its size, on top of the time predicted from the throughput
+_COPY_OVERHEAD_SECONDS = 300
+
+# Weight of the latest copy in the throughput and error averages of a region pair
+_COPY_HISTORY_WEIGHT = 0.2
+
+# Tracked copies not seen completing within this time are forgotten
+_COPY_TRACKING_SECONDS = 7 * 24 * 3600
+
+# The copy model is reported even when LOG_LEVEL is ERROR, so its error can be checked
+_schedule_logger = logging.getLogger('snapshots_tool.schedule')
+_schedule_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger()
+
+
+class MemoryHistoryStore(object):
+    # Keeps the copy history in the warm container
+
+    def __init__(self):
+        self.objects = {}
+
+    def put(self, key, body):
+        self.objects[key] = body
+
+    def get(self, key):
+        return self.objects.get(key)
+
+
+_store = get_manifest_store(_COPY_HISTORY_LOCATION) or MemoryHistoryStore()
+
+
+def set_copy_history_store(store):
+    # Replaces the copy history store. Any object with put(key, body) and get(key) works, such as the manifest stores
+    global _store
+    _store = store
+
+
+def copy_history_shared():
+    # True when the history is kept outside the container, so it must be keyed by the real account id
+    return not isinstance(_store, MemoryHistoryStore)
+
+
+def region_pair(source_region, region):
+    return '%s>%s' % (source_region, region)
+
+
+class CopyPlanner(object):
+    # Copy slots and duration predictions of one run, and the throughput history they come from. max_in_flight None is no cap
+
+    def __init__(self, account, store=None, max_in_flight=_COPY_MAX_IN_FLIGHT, now=None):
+        self.key = 'copy-history/%s.json' % account
+        self.store = store or _store
+        self.max_in_flight = max_in_flight
+        self.now = now or time.time()
+        self.free = {}
+        self.deferred = 0
+        self.completed = 0
+        self._lock = threading.Lock()
+
+        body = None
+
+        try:
+            body = self.store.get(self.key)
+
+        except Exception as e:
+            logger.warning('Could not read the copy history: %s' % e)
+
+        history = json.loads(body) if body else {}
+        self.pairs = history.get('Pairs', {})
+        self.in_flight = dict((key, copy) for key, copy in history.get('InFlight', {}).items()
+                              if self.now - copy['Started'] < _COPY_TRACKING_SECONDS)
+
+    def observe(self, region, snapshots, complete=True):
+        # Takes the snapshots listed in region, as a dict of identifier -> attributes with Status. Counts the copies in progress
+        # there to size the free slots, and records the duration of tracked copies that are now available. A listing that is not
+        # complete, such as that of a retry, still counts the tracked copies it does not show, and complete listings forget
+        # the tracked copies that are gone
+        copying = len([attributes for attributes in snapshots.values() if attributes.get('Status') == 'copying'])
+
+        with self._lock:
+            for identifier, attributes in snapshots.items():
+                copy = self.in_flight.get('%s/%s' % (region, identifier))
+
+                if copy is not None and attributes.get('Status') == 'available':
+                    del self.in_flight['%s/%s' % (region, identifier)]
+                    self._record(identifier, copy, self.now - copy['Started'])
+
+            tracked = [key for key in self.in_flight if key.startswith(region + '/')]
+
+            if complete:
+                for key in tracked:
+                    if key[len(region) + 1:] not in snapshots:
+                        del self.in_flight[key]
+
+                tracked = [key for key in tracked if key in self.in_flight]
+
+            if self.max_in_flight is not None:
+                self.free[region] = max(0, self.max_in_flight - max(copying, len(tracked)))
+
+    def _record(self, identifier, copy, seconds):
+        pair = self.pairs.setdefault(copy['Pair'], {'GiBPerHour': _COPY_DEFAULT_GIB_PER_HOUR, 'Copies': 0, 'MeanAbsoluteError': None})
+        error = (seconds - copy['Predicted']) / max(seconds, 1.0)
+
+        log_item(logging.INFO, 'Copy of %s (%s GiB, %s) took %s seconds, predicted %s (%+.0f%%)',
+                 identifier, copy['GiB'], copy['Pair'], int(seconds), int(copy['Predicted']), -100 * error)
+
+        if copy['GiB'] > 0:
+            observed = copy['GiB'] * 3600.0 / max(seconds - _COPY_OVERHEAD_SECONDS, 60)
+            weight = max(_COPY_HISTORY_WEIGHT, 1.0 / (pair['Copies'] + 1))
+            pair['GiBPerHour'] = (1 - weight) * pair['GiBPerHour'] + weight * observed
+
+        if pair['MeanAbsoluteError'] is None:
+            pair['MeanAbsoluteError'] = abs(error)
+        else:
+            pair['MeanAbsoluteError'] = (1 - _COPY_HISTORY_WEIGHT) * pair['MeanAbsoluteError'] + _COPY_HISTORY_WEIGHT * abs(error)
+
+        pair['Copies'] += 1
+        self.completed += 1
+
+    def predict(self, source_region, region, gib):
+        # Predicted seconds to copy gib GiB from source_region to region
+        rate = self.pairs.get(region_pair(source_region, region), {}).get('GiBPerHour', _COPY_DEFAULT_GIB_PER_HOUR)
+
+        return _COPY_OVERHEAD_SECONDS + (gib or 0) * 3600.0 / max(rate, 1.0)
+
+    def predicted(self, copy):
+        # Predicted seconds of copy, a (source region, region, GiB) tuple. None is no copy
+        return self.predict(*copy) if copy is not None else 0
+
+    def longest_first(self, items, route):
+        # Orders items by predicted copy duration, longest first. route(item) returns (source region, region, GiB) for items
+        # that need a copy and None for the others, which go last
+        return sorted(items, key=lambda item: self.predicted(route(item)), reverse=True)
+
+    def admit(self, region):
+        # Takes a copy slot in region. Returns False when the copy should wait for the next run
+        if self.max_in_flight is None:
+            return True
+
+        with self._lock:
+            if self.free.get(region, self.max_in_flight) > 0:
+                self.free[region] = self.free.get(region, self.max_in_flight) - 1
+                return True
+
+            self.deferred += 1
+
+        log_item(logging.WARNING, 'Deferring copy into %s. %s copies in progress', region, self.max_in_flight)
+
+        return False
+
+    def cancel(self, region):
+        # Returns the slot of a copy that failed to start
+        if self.max_in_flight is None:
+            return
+
+        with self._lock:
+            self.free[region] = self.free.get(region, self.max_in_flight) + 1
+
+    def started(self, identifier, source_region, region, gib):
+        with self._lock:
+            self.in_flight['%s/%s' % (region, identifier)] = {
+                'Pair': region_pair(source_region, region), 'GiB': gib or 0, 'Started': time.time(),
+                'Predicted': self.predict(source_region, region, gib)}
+
+    def save(self):
+        # Writes the history back and reports the model of every region pair. A failed write is logged and does not fail the run
+        with self._lock:
+            body = json.dumps({'Pairs': self.pairs, 'InFlight': self.in_flight}, sort_keys=True, separators=(',', ':'))
+
+        try:
+            self.store.put(self.key, body.encode('utf-8'))
+
+        except Exception as e:
+            logger.warning('Could not save the copy history: %s' % e)
+
+        models = dict((name, {
+            'GiBPerHour': round(pair['GiBPerHour'], 1), 'Copies': pair['Copies'],
+            'MeanAbsoluteError': round(pair['MeanAbsoluteError'], 3) if pair['MeanAbsoluteError'] is not None else None})
+            for name, pair in self.pairs.items())
+
+        _schedule_logger.info(json.dumps({
+            'CopyModel': models, 'Completed': self.completed, 'InFlight': len(self.in_flight), 'Deferred': self.deferred},
+            sort_keys=True, separators=(',', ':')))
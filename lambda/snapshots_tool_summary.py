@@ -0,0 +1,115 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# snapshots_tool_summary
+# Optional summary logging for runs over many snapshots. Set LOG_SUMMARY to YES to replace the log line written for each snapshot or
+# cluster with one JSON line per run. It counts the outcome of every item and keeps up to LOG_SUMMARY_SAMPLES (default: 5) item names per outcome.
+# Failures are still logged in full, and the lines about each item are still written when LOG_LEVEL is DEBUG
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+_LOG_SUMMARY = os.getenv('LOG_SUMMARY', 'NO').strip().upper() == 'YES'
+
+_LOG_SUMMARY_SAMPLES = int(os.getenv('LOG_SUMMARY_SAMPLES', '5'))
+
+# The summary is written even when LOG_LEVEL is ERROR, since it replaces lines written at lower levels
+_summary_logger = logging.getLogger('snapshots_tool.summary')
+_summary_logger.setLevel(logging.INFO)
+
+# The summary of the run in progress, per thread
+_local = threading.local()
+
+logger = logging.getLogger()
+
+
+def summary_enabled():
+    return _LOG_SUMMARY
+
+
+def log_item(level, message, *args):
+    # Logs a line about one item. In summary mode it is only written at DEBUG, since the item is counted in the summary.
+    # message is formatted with args only when the line is written
+    logger.log(logging.DEBUG if _LOG_SUMMARY else level, message, *args)
+
+
+class RunSummary(object):
+    # Outcome counts and sample items of one run
+
+    def __init__(self, name, samples=_LOG_SUMMARY_SAMPLES):
+        self.name = name
+        self.samples = samples
+        self.start = time.time()
+        self.counts = {}
+        self.sampled = {}
+        self._lock = threading.Lock()
+
+    def record(self, item, outcome):
+        with self._lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+            sampled = self.sampled.setdefault(outcome, [])
+
+            if len(sampled) < self.samples:
+                sampled.append(item)
+
+    def emit(self, status):
+        with self._lock:
+            summary = {
+                'Summary': self.name,
+                'Status': status,
+                'Seconds': round(time.time() - self.start, 3),
+                'Items': sum(self.counts.values()),
+                'Counts': self.counts,
+                'Samples': self.sampled}
+
+            _summary_logger.info(json.dumps(summary, sort_keys=True, separators=(',', ':')))
+
+
+def current_summary():
+    return getattr(_local, 'summary', None)
+
+
+def begin_summary(name):
+    # Starts the summary of a run. Returns None when summary logging is off
+    if not _LOG_SUMMARY:
+        return None
+
+    summary = RunSummary(name)
+    summary.outer_summary = current_summary()
+    _local.summary = summary
+
+    return summary
+
+
+def end_summary(summary, status):
+    if summary is not None:
+        _local.summary = summary.outer_summary
+        summary.emit(status)
+
+
+def record_outcome(item, outcome):
+    summary = current_summary()
+
+    if summary is not None:
+        summary.record(item, outcome)
+
+
+def record_outcomes(outcomes):
+    # Counts a dict of item -> outcome in the summary of the run in progress
+    summary = current_summary()
+
+    if summary is not None:
+        for item, outcome in outcomes.items():
+            summary.record(item, outcome)
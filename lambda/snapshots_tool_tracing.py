@@ -0,0 +1,284 @@
+'''
+Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+'''
+
+
+# snapshots_tool_tracing
+# Optional OpenTelemetry style tracing for the Snapshots Tool for Aurora
+# Every invocation is a root span with child spans for its stages and for each RDS API call, tagged with snapshot and cluster identifiers.
+# The trace id is derived from a correlation id that stays the same across Step Functions retries: CorrelationId in the event when
+# the state machine passes one, otherwise the id of the scheduled CloudWatch event that started the execution.
+# Spans about a snapshot carry snapshot.journey_id, derived from the snapshot identifier, and a link to the trace of the same name, so
+# the take, share, copy and delete of one snapshot can be put on a single timeline.
+# Set TRACING to LOG to write finished spans to the log as JSON, or to MEMORY to keep them in memory (for tests). Default: NONE
+
+from datetime import datetime, timezone
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+
+_TRACING = os.getenv('TRACING', 'NONE').strip().upper()
+
+# API parameters copied to span attributes
+_TRACED_PARAMETERS = {
+    'DBClusterIdentifier': 'cluster.id',
+    'DBClusterSnapshotIdentifier': 'snapshot.id',
+    'SourceDBClusterSnapshotIdentifier': 'snapshot.source_id',
+    'TargetDBClusterSnapshotIdentifier': 'snapshot.id',
+    'ResourceName': 'resource.arn'}
+
+_span_logger = logging.getLogger('snapshots_tool.tracing')
+_span_logger.setLevel(logging.INFO)
+
+_local = threading.local()
+
+
+class InMemorySpanExporter(object):
+    # Keeps finished spans in a list. Used in tests and local runs
+
+    def __init__(self):
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def get_finished_spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            del self._spans[:]
+
+
+class LoggingSpanExporter(object):
+    # Writes each finished span to the log as one JSON line
+
+    def export(self, span):
+        _span_logger.info(json.dumps(span, default=str, separators=(',', ':')))
+
+
+if _TRACING == 'LOG':
+    _exporter = LoggingSpanExporter()
+elif _TRACING == 'MEMORY':
+    _exporter = InMemorySpanExporter()
+else:
+    _exporter = None
+
+
+def tracing_enabled():
+    return _exporter is not None
+
+
+def set_span_exporter(exporter):
+    # Replaces the exporter. Pass None to disable tracing
+    global _exporter
+    _exporter = exporter
+
+
+def get_span_exporter():
+    return _exporter
+
+
+def derive_id(value, length=32):
+    # Deterministic hex id, so every attempt and every handler derives the same trace or journey id from the same value
+    return hashlib.sha256(str(value).encode('utf-8')).hexdigest()[:length]
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+
+    return _local.stack
+
+
+def current_span():
+    # The innermost open span of this thread, or the span handed to it through span_scope
+    stack = _stack()
+
+    if stack:
+        return stack[-1]
+
+    return getattr(_local, 'invocation_span', None)
+
+
+class span_scope(object):
+    # Makes span the parent of the spans this thread starts outside its own spans. Used to hand the current span to worker threads
+
+    def __init__(self, span):
+        self.span = span
+
+    def __enter__(self):
+        self.outer_span = getattr(_local, 'invocation_span', None)
+        _local.invocation_span = self.span
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.invocation_span = self.outer_span
+        return False
+
+
+class Span(object):
+
+    def __init__(self, name, attributes=None, trace_id=None, parent=None):
+        parent = parent if parent is not None else current_span()
+        self.name = name
+        self.trace_id = trace_id or (parent.trace_id if parent is not None else uuid.uuid4().hex)
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = {}
+        self.links = []
+        self.status = 'UNSET'
+        self.description = None
+        self.start_time = None
+        self.end_time = None
+
+        for key, value in (attributes or {}).items():
+            self.set_attribute(key, value)
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+        if key in ('snapshot.id', 'snapshot.source_id') and 'snapshot.journey_id' not in self.attributes:
+            # Shared snapshots are identified by their ARN. The journey is keyed on the snapshot name
+            journey_id = derive_id(str(value).split(':')[-1])
+            self.attributes['snapshot.journey_id'] = journey_id
+            self.links.append({'trace_id': journey_id})
+
+    def start(self):
+        self.start_time = time.time()
+        return self
+
+    def end(self, exception=None):
+        self.end_time = time.time()
+
+        if exception is not None:
+            self.status = 'ERROR'
+            self.description = '%s: %s' % (exception.__class__.__name__, exception)
+
+        elif self.status == 'UNSET':
+            self.status = 'OK'
+
+        if _exporter is not None:
+            _exporter.export(self.to_dict())
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'context': {'trace_id': self.trace_id, 'span_id': self.span_id},
+            'parent_id': self.parent_id,
+            'start_time': datetime.fromtimestamp(self.start_time, timezone.utc).isoformat().replace('+00:00', 'Z'),
+            'end_time': datetime.fromtimestamp(self.end_time, timezone.utc).isoformat().replace('+00:00', 'Z'),
+            'duration_ms': round((self.end_time - self.start_time) * 1000, 3),
+            'attributes': self.attributes,
+            'links': self.links,
+            'status': {'status_code': self.status, 'description': self.description}}
+
+    def __enter__(self):
+        _stack().append(self.start())
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stack = _stack()
+
+        if stack and stack[-1] is self:
+            stack.pop()
+
+        self.end(exc_value)
+        return False
+
+
+def start_span(name, attributes=None):
+    # Context manager for a child of the current span
+    return Span(name, attributes)
+
+
+def get_correlation_id(event, context):
+    # Stays the same across Step Functions retries, since retries are invoked with the same input
+    if isinstance(event, dict):
+        for key in ('CorrelationId', 'correlation_id', 'id'):
+            if event.get(key):
+                return str(event[key])
+
+    if context is not None and getattr(context, 'aws_request_id', None):
+        return context.aws_request_id
+
+    return uuid.uuid4().hex
+
+
+class InvocationSpan(Span):
+    # Root span of a handler invocation. Nested invocations (pipeline stages) become children of the outer one
+
+    def __init__(self, name, event, context):
+        parent = current_span()
+        correlation_id = get_correlation_id(event, context)
+        Span.__init__(self, name, {'faas.name': name, 'correlation.id': correlation_id}, derive_id(correlation_id), parent)
+
+        if context is not None and getattr(context, 'aws_request_id', None):
+            self.set_attribute('faas.execution', context.aws_request_id)
+
+        if isinstance(event, dict) and 'Attempt' in event:
+            self.set_attribute('faas.attempt', event['Attempt'])
+
+    def __enter__(self):
+        self.outer_invocation_span = getattr(_local, 'invocation_span', None)
+
+        if self.outer_invocation_span is None:
+            _local.invocation_span = self
+
+        return Span.__enter__(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.invocation_span = self.outer_invocation_span
+        return Span.__exit__(self, exc_type, exc_value, traceback)
+
+
+def _before_api_call(params, model, context, **kwargs):
+    if _exporter is None:
+        return
+
+    attributes = {'rpc.system': 'aws-api', 'rpc.service': 'rds', 'rpc.method': model.name}
+
+    for parameter, attribute in _TRACED_PARAMETERS.items():
+        if parameter in params:
+            attributes[attribute] = params[parameter]
+
+    for api_filter in params.get('Filters', []):
+        attributes['filter.%s' % api_filter['Name']] = ','.join(api_filter['Values'])
+
+    context['snapshots_tool_span'] = Span(model.name, attributes).start()
+
+
+def _after_api_call(context, parsed=None, exception=None, **kwargs):
+    span = context.pop('snapshots_tool_span', None)
+
+    if span is None:
+        return
+
+    if parsed is not None and 'Error' in parsed:
+        span.status = 'ERROR'
+        span.description = parsed['Error'].get('Code')
+
+    span.end(exception)
+
+
+def instrument_client(client):
+    # Emits a child span for each API call made by client. The handlers are no-ops while tracing is off
+    client.meta.events.register('before-parameter-build.rds', _before_api_call)
+    client.meta.events.register('after-call.rds', _after_api_call)
+    client.meta.events.register('after-call-error.rds', _after_api_call)
+
+    return client
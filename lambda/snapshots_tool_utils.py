@@ -18,6 +18,21 @@ import time
 import os
 import logging
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from snapshots_tool_profiling import current_timings, get_handler_name, profiled_handler, stage as profile_stage, timings_scope
+from snapshots_tool_tracing import InvocationSpan, current_span, instrument_client, span_scope, start_span, tracing_enabled
+from snapshots_tool_inventory import cached_listing, cached_tags, record_snapshot, forget_snapshot, inventory_enabled, save_inventory
+from snapshots_tool_lease import begin_run, current_run, end_run, lease_held, lease_partitions, partition_lease_held, run_scope
+from snapshots_tool_quota import admit, get_snapshot_quota
+from snapshots_tool_manifest import manifest_enabled, publish_shared, read_manifest
+from snapshots_tool_summary import begin_summary, end_summary, log_item, record_outcome, record_outcomes
+from snapshots_tool_retry import RetryQueue, error_class
+from snapshots_tool_export import begin_export, current_export, end_export, export_enabled, export_listing, export_scope
+from snapshots_tool_schedule import CopyPlanner, copy_history_shared
+from snapshots_tool_fleet import account_scope, current_account, fleet_accounts, get_account_session, limit_account_calls
+import functools
+import importlib.util
 
 
 # Initialize everything
@@ -41,6 +56,29 @@ else:
 
 _SUPPORTED_ENGINES = [ 'aurora', 'aurora-mysql', 'aurora-postgresql', 'neptune']
 
+# Server-side filter so describe calls never return snapshots of engines we ignore
+_ENGINE_FILTER = [{'Name': 'engine', 'Values': _SUPPORTED_ENGINES}]
+
+# Rough number of snapshots kept per cluster. Used to estimate how many pages a full listing costs
+_SNAPSHOTS_PER_CLUSTER_ESTIMATE = int(os.getenv('SNAPSHOTS_PER_CLUSTER_ESTIMATE', '30'))
+
+# Number of cluster identifiers sent in each db-cluster-id filter when listing targeted clusters
+_CLUSTER_FILTER_CHUNK = int(os.getenv('CLUSTER_FILTER_CHUNK', '10'))
+
+# Shared snapshots given by ARN are described one call each up to this many. Above it, one listing of the shared snapshots is cheaper
+_SNAPSHOT_LOOKUP_LIMIT = int(os.getenv('SNAPSHOT_LOOKUP_LIMIT', '10'))
+
+_LISTING_MAX_WORKERS = int(os.getenv('LISTING_MAX_WORKERS', '8'))
+
+_LISTING_PAGE_SIZE = 100
+
+_RDS_CLIENTS = {}
+_RDS_CLIENTS_LOCK = threading.Lock()
+
+_ACCOUNT_ID = None
+
+_HANDLERS = {}
+
 logger = logging.getLogger()
 logger.setLevel(_LOGLEVEL.upper())
 
@@ -49,6 +87,294 @@ class SnapshotToolException(Exception):
     pass
 
 
+def items_pending(message, failed, kind='Snapshots', pending=()):
+    # Returns the SnapshotToolException that ends a scheduled run which left items failed or pending. failed maps each failed item
+    # to its error class. The exception keeps the targets for a retry, so that the retry only works on these items
+    if failed:
+        message = '%s. Failed: %s' % (message, ', '.join('%s (%s)' % (item, error) for item, error in failed.items()))
+
+    exception = SnapshotToolException(message)
+    exception.failed = failed
+    exception.retry = {kind: sorted(set(failed) | set(pending))}
+
+    return exception
+
+
+def get_rds_client(region):
+    # Returns a cached RDS client for region. Clients are thread safe but expensive to create, so reuse them.
+    # Inside an account_scope the client works in that account, and is replaced when the account's credentials are renewed
+    account = current_account()
+    session = get_account_session(account) if account is not None else None
+
+    with _RDS_CLIENTS_LOCK:
+        cached = _RDS_CLIENTS.get((account, region))
+
+        if cached is None or cached[0] is not session:
+            client = (session or boto3).client('rds', region_name=region)
+
+            if account is not None:
+                limit_account_calls(client, account)
+
+            _RDS_CLIENTS[(account, region)] = (session, instrument_client(client))
+
+        return _RDS_CLIENTS[(account, region)][1]
+
+
+def bind_context(work):
+    # Wraps work to run in the account scope, run lease, stage timings, trace span and catalog export of the calling thread. Used for work handed to worker threads
+    account = current_account()
+    run = current_run()
+    timings = current_timings()
+    span = current_span()
+    export = current_export()
+
+    @functools.wraps(work)
+    def bound(*args, **kwargs):
+        with account_scope(account), run_scope(run), timings_scope(timings), span_scope(span), export_scope(export):
+            return work(*args, **kwargs)
+
+    return bound
+
+
+def load_handler(function_name):
+    # Loads <function_name>/lambda_function.py, packaged next to this module, under a unique module name and returns the module.
+    # Used by entry points that run the logic of several Lambda functions in one process
+    if function_name in _HANDLERS:
+        return _HANDLERS[function_name]
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), function_name, 'lambda_function.py')
+
+    if not os.path.isfile(path):
+        raise SnapshotToolException('Could not find the code for %s at %s' % (function_name, path))
+
+    spec = importlib.util.spec_from_file_location('%s_lambda_function' % function_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    _HANDLERS[function_name] = module
+
+    return module
+
+
+def run_stages(function_names, event, context):
+    # Runs the lambda_handler of each function in order. Returns the result of each stage, the number of failed stages and the
+    # retry of the stages left with failed or pending items, which maps each such stage to the Clusters and Snapshots to work on.
+    # Stages with ReportRetry return their retry instead of raising. A stage that failed outright is retried in full. A retry event
+    # holds those Stages and runs only them, each on its own items
+    results = []
+    pending_stages = 0
+    retry = {}
+    retry_stages = event.get('Stages') if is_retry(event) else None
+
+    for function_name in function_names:
+        if retry_stages is not None and function_name not in retry_stages:
+            continue
+
+        start = time.time()
+        result = {'Stage': function_name}
+        stage_event = event
+
+        if retry_stages is not None:
+            stage_event = dict((key, value) for key, value in event.items() if key != 'Stages')
+            stage_event.update(retry_stages[function_name])
+
+        try:
+            result['Result'] = load_handler(function_name).lambda_handler(stage_event, context)
+            result['Status'] = 'succeeded'
+
+            if isinstance(result['Result'], dict) and result['Result'].get('Retry'):
+                pending_stages += 1
+                result['Status'] = 'pending'
+                retry[function_name] = dict((kind, result['Result']['Retry'][kind]) for kind in ('Clusters', 'Snapshots')
+                                            if result['Result']['Retry'].get(kind))
+
+        except Exception as e:
+            pending_stages += 1
+            result['Status'] = 'failed'
+            result['Error'] = '%s: %s' % (e.__class__.__name__, e)
+            retry[function_name] = retry_stages[function_name] if retry_stages is not None else {}
+            logger.error('Stage %s failed: %s' % (function_name, e))
+
+        result['Seconds'] = round(time.time() - start, 3)
+        results.append(result)
+        logger.info('Stage %s %s in %s seconds' % (function_name, result['Status'], result['Seconds']))
+
+    return results, pending_stages, retry
+
+
+def run_pipeline(function_names, event, context):
+    # Runs the lambda_handler of each function in order within one invocation. The stages share the inventory cache, so
+    # snapshots created, copied or deleted by one stage are seen by the next ones without listing or tagging them again.
+    # With ReportRetry, the stages left failed or pending are returned as Retry. Otherwise the pipeline raises
+    if not inventory_enabled():
+        logger.warning('INVENTORY_CACHE_TTL is not set. Each stage lists the inventory again')
+
+    results, pending_stages, retry = run_stages(function_names, event, context)
+
+    if pending_stages > 0:
+        log_message = 'Pipeline stages pending: %s. %s' % (pending_stages, ', '.join(
+            '%s %s in %s s' % (result['Stage'], result['Status'], result['Seconds']) for result in results))
+        logger.error(log_message)
+
+        if isinstance(event, dict) and event.get('ReportRetry'):
+            return {'Stages': results, 'Retry': {'Stages': retry}}
+
+        raise SnapshotToolException(log_message)
+
+    return {'Stages': results}
+
+
+def get_account_id():
+    # Returns the account the tool runs in, or the account of the enclosing account_scope in fleet mode.
+    # Only needed to key the inventory cache, the manifest, the export and the copy history, so it is looked up lazily once per container
+    global _ACCOUNT_ID
+
+    if current_account() is not None:
+        return current_account()
+
+    if _ACCOUNT_ID is None:
+        if inventory_enabled() or manifest_enabled() or export_enabled() or copy_history_shared():
+            _ACCOUNT_ID = boto3.client('sts').get_caller_identity()['Account']
+        else:
+            _ACCOUNT_ID = 'self'
+
+    return _ACCOUNT_ID
+
+
+class _TracedStage(object):
+
+    def __init__(self, name):
+        self.profile = profile_stage(name)
+        self.span = start_span(name)
+
+    def __enter__(self):
+        self.profile.__enter__()
+        self.span.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.span.__exit__(exc_type, exc_value, traceback)
+        self.profile.__exit__(exc_type, exc_value, traceback)
+        return False
+
+
+def stage(name):
+    # Marks a named stage of a handler (pagination, filtering, tag_lookups, decision_loop, mutations). It is timed when profiling
+    # and becomes a span when tracing. When both are off this is a shared no-op context manager.
+    # A run that has lost its lease makes no further changes: entering a mutations stage then raises SnapshotToolException
+    if name == 'mutations' and not lease_held():
+        raise SnapshotToolException('Lost lease %s. Not making further changes' % current_run().name)
+
+    if tracing_enabled():
+        return _TracedStage(name)
+
+    return profile_stage(name)
+
+
+def get_lease_name(handler):
+    # One lease per function, module (pipeline stages share the function name of the pipeline), region and pattern, and per
+    # account in fleet mode
+    handler_globals = handler.__globals__
+    region = handler_globals.get('DEST_REGION') or handler_globals.get('REGION') or _REGION
+    name = '%s:%s:%s:%s' % (get_handler_name(handler), handler.__module__, region, handler_globals.get('PATTERN', 'ALL_CLUSTERS'))
+
+    if current_account() is not None:
+        name = '%s:%s' % (name, current_account())
+
+    return name
+
+
+def is_retry(event):
+    # True for the events the state machine sends to retry the failed and pending items of a scheduled run
+    return isinstance(event, dict) and bool(event.get('Attempt'))
+
+
+def next_retry(event, retry):
+    # The event that retries the items in retry, which maps Clusters or Snapshots to names. It keeps the id and correlation id
+    # of the scheduled event and counts the attempts, so the state machine can stop retrying
+    retry_event = dict(retry, Attempt=int(event.get('Attempt') or 0) + 1, ReportRetry=True)
+
+    for key in ('id', 'CorrelationId'):
+        if event.get(key):
+            retry_event[key] = event[key]
+
+    return retry_event
+
+
+def snapshots_tool_handler(handler):
+    # Decorator for every lambda_handler. Adds opt-in profiling, tracing, run leases, run summaries and catalog exports and persists the inventory cache after each invocation.
+    # Events with ReportRetry set, as sent by the state machines, return the items left failed or pending as Retry, the event that
+    # retries only those items, instead of raising SnapshotToolException. Retries take the run lease like the scheduled run they continue
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        report_retry = isinstance(event, dict) and bool(event.get('ReportRetry'))
+
+        if is_retry(event):
+            logger.info('Retry %s of %s' % (event['Attempt'], ', '.join(
+                '%s %s' % (len(event.get(kind) or []), kind) for kind in ('Clusters', 'Snapshots') if event.get(kind))))
+
+        # On-demand runs for explicit clusters or snapshots are short and do not wait for the lease of scheduled runs
+        run = begin_run(get_lease_name(handler), context) if get_targets(event) is None or is_retry(event) else None
+        summary = begin_summary(get_lease_name(handler))
+        export = begin_export()
+        status = 'failed'
+
+        try:
+            # Functions that set PARTITIONED_LEASE take over unleased partitions in LEASE_MODE PARTITIONS. The others stop here
+            if run is not None and not run.acquired and not (
+                    run.mode == 'PARTITIONS' and handler.__globals__.get('PARTITIONED_LEASE')):
+                logger.warning('Another run of %s is in progress. Exiting' % run.name)
+                status = 'skipped'
+
+                # A skipped retry counts as an attempt and is tried again later with the same items
+                if report_retry and is_retry(event):
+                    status = 'pending'
+                    return {'Skipped': 'Lease %s is held by another run' % run.name, 'Failed': {}, 'Retry': next_retry(
+                        event, dict((kind, event[kind]) for kind in ('Clusters', 'Snapshots') if event.get(kind)))}
+
+                return {'Skipped': 'Lease %s is held by another run' % run.name}
+
+            if tracing_enabled():
+                with InvocationSpan(get_handler_name(handler), event, context):
+                    result = handler(event, context)
+
+            else:
+                result = handler(event, context)
+
+            # A retry runs as an on-demand run, which returns the items still failed or pending instead of raising
+            if report_retry and isinstance(result, dict) and result.get('Retry'):
+                status = 'pending'
+                return dict(result, Retry=next_retry(event, result['Retry']))
+
+            status = 'succeeded'
+            return result
+
+        except SnapshotToolException as e:
+            status = 'pending' if getattr(e, 'retry', None) else 'failed'
+
+            if report_retry and getattr(e, 'retry', None):
+                logger.error(e)
+                return {'Pending': str(e), 'Failed': e.failed, 'Retry': next_retry(event, e.retry)}
+
+            raise
+
+        finally:
+            end_summary(summary, status)
+            end_export(export)
+            end_run(run)
+            save_inventory()
+
+    return profiled_handler(wrapper)
+
+
+def list_tags(client, resource_arn):
+    # Returns the list_tags_for_resource response for resource_arn
+    def fetch():
+        with stage('tag_lookups'):
+            return client.list_tags_for_resource(ResourceName=resource_arn)
+
+    return cached_tags(resource_arn, fetch)
+
+
 def search_tag_created(response):
     # Takes a describe_db_cluster_snapshots response and searches for our shareAndCopy tag
     try:
@@ -89,24 +415,87 @@ def get_snapshot_identifier(snapshot):
     return match.group(1)
 
 
+def get_snapshot_owner(snapshot_arn):
+    # Returns the account that owns a snapshot given its ARN
+    return snapshot_arn.split(':')[4]
+
+
+def get_deadline(context, margin_seconds):
+    # Returns the time.time() after which no new work should start, or None when not running in Lambda
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+
+    return time.time() + context.get_remaining_time_in_millis() / 1000.0 - margin_seconds
+
+
+def run_fair_share(partitions, work, max_workers, max_per_partition, deadline=None):
+    # Runs work(item) for the items of every partition concurrently. Partitions take turns to start their next item, and no
+    # partition runs more than max_per_partition items at once, so one large partition cannot use up every worker or the time budget.
+    # Returns a dict of partition -> list of (item, result). Items not started before deadline get the result None
+    results = dict((partition, []) for partition in partitions)
+    queues = dict((partition, list(items)) for partition, items in partitions.items())
+    in_flight = dict((partition, 0) for partition in partitions)
+    order = list(partitions)
+    next_turn = 0
+    futures = {}
+    work = bind_context(work)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while any(queues.values()) or futures:
+            started = False
+
+            if deadline is None or time.time() < deadline:
+                while len(futures) < max_workers:
+                    eligible = [partition for partition in order[next_turn:] + order[:next_turn]
+                                if queues[partition] and in_flight[partition] < max_per_partition]
+
+                    if not eligible:
+                        break
+
+                    partition = eligible[0]
+                    next_turn = (order.index(partition) + 1) % len(order)
+                    item = queues[partition].pop(0)
+                    in_flight[partition] += 1
+                    futures[executor.submit(work, item)] = (partition, item)
+                    started = True
+
+            else:
+                for partition, items in queues.items():
+                    results[partition].extend((item, None) for item in items)
+                    del items[:]
+
+            if not futures:
+                if not started:
+                    break
+
+                continue
+
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                partition, item = futures.pop(future)
+                in_flight[partition] -= 1
+                results[partition].append((item, future.result()))
+
+    return results
+
+
 def get_own_snapshots_source(pattern, response):
     # Filters our own snapshots
     filtered = {}
     for snapshot in response['DBClusterSnapshots']:
 
         if snapshot['SnapshotType'] == 'manual' and re.search(pattern, snapshot['DBClusterIdentifier']) and snapshot['Engine'] in _SUPPORTED_ENGINES:
-            client = boto3.client('rds', region_name=_REGION)
-            response_tags = client.list_tags_for_resource(
-                ResourceName=snapshot['DBClusterSnapshotArn'])
+            client = get_rds_client(_REGION)
+            response_tags = list_tags(client, snapshot['DBClusterSnapshotArn'])
 
             if search_tag_created(response_tags):
                 filtered[snapshot['DBClusterSnapshotIdentifier']] = {
                     'Arn': snapshot['DBClusterSnapshotArn'], 'Status': snapshot['Status'], 'DBClusterIdentifier': snapshot['DBClusterIdentifier']}
         #Changed the next line to search for ALL_CLUSTERS or ALL_SNAPSHOTS so it will work with no-x-account
         elif snapshot['SnapshotType'] == 'manual' and (pattern == 'ALL_CLUSTERS' or pattern == 'ALL_SNAPSHOTS') and snapshot['Engine'] in _SUPPORTED_ENGINES:
-            client = boto3.client('rds', region_name=_REGION)
-            response_tags = client.list_tags_for_resource(
-                ResourceName=snapshot['DBClusterSnapshotArn'])
+            client = get_rds_client(_REGION)
+            response_tags = list_tags(client, snapshot['DBClusterSnapshotArn'])
 
             if search_tag_created(response_tags):
                 filtered[snapshot['DBClusterSnapshotIdentifier']] = {
@@ -120,18 +509,16 @@ def get_own_snapshots_no_x_account(pattern, response, REGION):
     for snapshot in response['DBClusterSnapshots']:
 
         if snapshot['SnapshotType'] == 'manual' and re.search(pattern, snapshot['DBClusterIdentifier']) and snapshot['Engine'] in _SUPPORTED_ENGINES:
-            client = boto3.client('rds', region_name=REGION)
-            response_tags = client.list_tags_for_resource(
-                ResourceName=snapshot['DBClusterSnapshotArn'])
+            client = get_rds_client(REGION)
+            response_tags = list_tags(client, snapshot['DBClusterSnapshotArn'])
 
             if search_tag_created(response_tags):
                 filtered[snapshot['DBClusterSnapshotIdentifier']] = {
                     'Arn': snapshot['DBClusterSnapshotArn'], 'Status': snapshot['Status'], 'DBClusterIdentifier': snapshot['DBClusterIdentifier']}
         #Changed the next line to search for ALL_CLUSTERS or ALL_SNAPSHOTS so it will work with no-x-account
         elif snapshot['SnapshotType'] == 'manual' and pattern == 'ALL_SNAPSHOTS' and snapshot['Engine'] in _SUPPORTED_ENGINES:
-            client = boto3.client('rds', region_name=REGION)
-            response_tags = client.list_tags_for_resource(
-                ResourceName=snapshot['DBClusterSnapshotArn'])
+            client = get_rds_client(REGION)
+            response_tags = list_tags(client, snapshot['DBClusterSnapshotArn'])
 
             if search_tag_created(response_tags):
                 filtered[snapshot['DBClusterSnapshotIdentifier']] = {
@@ -158,14 +545,16 @@ def get_shared_snapshots(pattern, response):
     for snapshot in response['DBClusterSnapshots']:
         if snapshot['SnapshotType'] == 'shared' and re.search(pattern, snapshot['DBClusterIdentifier']) and snapshot['Engine'] in _SUPPORTED_ENGINES:
             filtered[get_snapshot_identifier(snapshot)] = {
-                'Arn': snapshot['DBClusterSnapshotIdentifier'], 'StorageEncrypted': snapshot['StorageEncrypted'], 'DBClusterIdentifier': snapshot['DBClusterIdentifier']}
+                'Arn': snapshot['DBClusterSnapshotIdentifier'], 'StorageEncrypted': snapshot['StorageEncrypted'], 'DBClusterIdentifier': snapshot['DBClusterIdentifier'],
+                'AllocatedStorage': snapshot.get('AllocatedStorage', 0)}
             if snapshot['StorageEncrypted'] is True:
                 filtered[get_snapshot_identifier(
                     snapshot)]['KmsKeyId'] = snapshot['KmsKeyId']
 
         elif snapshot['SnapshotType'] == 'shared' and pattern == 'ALL_SNAPSHOTS' and snapshot['Engine'] in _SUPPORTED_ENGINES:
             filtered[get_snapshot_identifier(snapshot)] = {
-                'Arn': snapshot['DBClusterSnapshotIdentifier'], 'StorageEncrypted': snapshot['StorageEncrypted'], 'DBClusterIdentifier': snapshot['DBClusterIdentifier']}
+                'Arn': snapshot['DBClusterSnapshotIdentifier'], 'StorageEncrypted': snapshot['StorageEncrypted'], 'DBClusterIdentifier': snapshot['DBClusterIdentifier'],
+                'AllocatedStorage': snapshot.get('AllocatedStorage', 0)}
             if snapshot['StorageEncrypted'] is True:
                 filtered[get_snapshot_identifier(
                     snapshot)]['KmsKeyId'] = snapshot['KmsKeyId']
@@ -173,13 +562,14 @@ def get_shared_snapshots(pattern, response):
 
 
 def get_own_snapshots_dest(pattern, response):
-    # Returns a dict  with local snapshots, filtered by pattern, with DBClusterSnapshotIdentifier as key and Arn, Status as attributes
+    # Returns a dict  with local snapshots, filtered by pattern, with DBClusterSnapshotIdentifier as key and Arn, Status, AllocatedStorage as attributes
     filtered = {}
     for snapshot in response['DBClusterSnapshots']:
 
         if snapshot['SnapshotType'] == 'manual' and re.search(pattern, snapshot['DBClusterIdentifier']) and snapshot['Engine'] in _SUPPORTED_ENGINES:
             filtered[snapshot['DBClusterSnapshotIdentifier']] = {
-                'Arn': snapshot['DBClusterSnapshotArn'], 'Status': snapshot['Status'], 'StorageEncrypted': snapshot['StorageEncrypted'], 'DBClusterIdentifier': snapshot['DBClusterIdentifier']}
+                'Arn': snapshot['DBClusterSnapshotArn'], 'Status': snapshot['Status'], 'StorageEncrypted': snapshot['StorageEncrypted'], 'DBClusterIdentifier': snapshot['DBClusterIdentifier'],
+                'AllocatedStorage': snapshot.get('AllocatedStorage', 0)}
 
             if snapshot['StorageEncrypted'] is True:
                 filtered[snapshot['DBClusterSnapshotIdentifier']
@@ -187,7 +577,8 @@ def get_own_snapshots_dest(pattern, response):
 
         elif snapshot['SnapshotType'] == 'manual' and pattern == 'ALL_SNAPSHOTS' and snapshot['Engine'] in _SUPPORTED_ENGINES:
             filtered[snapshot['DBClusterSnapshotIdentifier']] = {
-                'Arn': snapshot['DBClusterSnapshotArn'], 'Status': snapshot['Status'], 'StorageEncrypted': snapshot['StorageEncrypted'], 'DBClusterIdentifier': snapshot['DBClusterIdentifier']}
+                'Arn': snapshot['DBClusterSnapshotArn'], 'Status': snapshot['Status'], 'StorageEncrypted': snapshot['StorageEncrypted'], 'DBClusterIdentifier': snapshot['DBClusterIdentifier'],
+                'AllocatedStorage': snapshot.get('AllocatedStorage', 0)}
 
             if snapshot['StorageEncrypted'] is True:
                 filtered[snapshot['DBClusterSnapshotIdentifier']
@@ -197,7 +588,7 @@ def get_own_snapshots_dest(pattern, response):
 
 
 def copy_local(snapshot_identifier, snapshot_object):
-    client = boto3.client('rds', region_name=_REGION)
+    client = get_rds_client(_REGION)
 
     tags = [{
             'Key': 'CopiedBy',
@@ -205,8 +596,7 @@ def copy_local(snapshot_identifier, snapshot_object):
             }]
 
     if snapshot_object['StorageEncrypted']:
-        logger.info('Copying encrypted snapshot %s locally' %
-                    snapshot_identifier)
+        log_item(logging.INFO, 'Copying encrypted snapshot %s locally', snapshot_identifier)
 
         response = client.copy_db_cluster_snapshot(
             SourceDBClusterSnapshotIdentifier=snapshot_object['Arn'],
@@ -215,22 +605,23 @@ def copy_local(snapshot_identifier, snapshot_object):
             Tags=tags)
 
     else:
-        logger.info('Copying snapshot %s locally' % snapshot_identifier)
+        log_item(logging.INFO, 'Copying snapshot %s locally', snapshot_identifier)
 
         response = client.copy_db_cluster_snapshot(
             SourceDBClusterSnapshotIdentifier=snapshot_object['Arn'],
             TargetDBClusterSnapshotIdentifier=snapshot_identifier,
             Tags=tags)
 
+    record_snapshot(_REGION, get_account_id(), response['DBClusterSnapshot'], tags)
+
     return response
 
 
 def copy_remote(snapshot_identifier, snapshot_object):
-    client = boto3.client('rds', region_name=_DESTINATION_REGION)
+    client = get_rds_client(_DESTINATION_REGION)
 
     if snapshot_object['StorageEncrypted']:
-        logger.info('Copying encrypted snapshot %s to remote region %s' %
-                    (snapshot_object['Arn'], _DESTINATION_REGION))
+        log_item(logging.INFO, 'Copying encrypted snapshot %s to remote region %s', snapshot_object['Arn'], _DESTINATION_REGION)
 
         response = client.copy_db_cluster_snapshot(
             SourceDBClusterSnapshotIdentifier=snapshot_object['Arn'],
@@ -240,8 +631,7 @@ def copy_remote(snapshot_identifier, snapshot_object):
             CopyTags=True)
 
     else:
-        logger.info('Copying snapshot %s to remote region %s' %
-                    (snapshot_object['Arn'], _DESTINATION_REGION))
+        log_item(logging.INFO, 'Copying snapshot %s to remote region %s', snapshot_object['Arn'], _DESTINATION_REGION)
 
         response = client.copy_db_cluster_snapshot(
             SourceDBClusterSnapshotIdentifier=snapshot_object['Arn'],
@@ -249,6 +639,8 @@ def copy_remote(snapshot_identifier, snapshot_object):
             SourceRegion=_REGION,
             CopyTags=True)
 
+    record_snapshot(_DESTINATION_REGION, get_account_id(), response['DBClusterSnapshot'])
+
     return response
 
 
@@ -269,6 +661,48 @@ def get_timestamp(snapshot_identifier, snapshot_list):
     return None
 
 
+def expire_snapshots(client, quota, snapshot_list, retention_days, needed, eligible=None):
+    # Deletes snapshots of snapshot_list older than retention_days, oldest first, until quota has room for needed new snapshots.
+    # eligible is an optional check on each candidate identifier. Returns the identifiers deleted
+    if quota is None or retention_days is None:
+        return []
+
+    shortfall = needed - quota.headroom()
+
+    if shortfall <= 0:
+        return []
+
+    candidates = []
+    for snapshot_identifier, snapshot_object in snapshot_list.items():
+        creation_date = get_timestamp(snapshot_identifier, snapshot_list)
+
+        if creation_date and snapshot_object['Status'] == 'available' and (
+                datetime.now() - creation_date).total_seconds() / 3600 / 24 > retention_days:
+            candidates.append((creation_date, snapshot_identifier))
+
+    deleted = []
+    for creation_date, snapshot_identifier in sorted(candidates):
+        if len(deleted) >= shortfall:
+            break
+
+        if eligible is not None and not eligible(snapshot_identifier):
+            continue
+
+        try:
+            with stage('mutations'):
+                delete_cluster_snapshot(client, snapshot_identifier)
+
+        except Exception as e:
+            logger.error('Could not expire %s: %s' % (snapshot_identifier, e))
+            continue
+
+        log_item(logging.INFO, 'Expired %s to make room for %s new snapshots in %s', snapshot_identifier, needed, quota.region)
+        quota.freed()
+        deleted.append(snapshot_identifier)
+
+    return deleted
+
+
 def get_timestamp_no_minute(snapshot_identifier, snapshot_list):
 
     # Get a timestamp from the name of a snapshot and strip out the minutes
@@ -328,18 +762,191 @@ def paginate_api_call(client, api_call, objecttype, *args, **kwargs):
     response = {}
     response[objecttype] = []
 
-    # Create a paginator
-    paginator = client.get_paginator(api_call)
+    with stage('pagination'):
+        # Create a paginator
+        paginator = client.get_paginator(api_call)
 
-    # Create a PageIterator from the Paginator
-    page_iterator = paginator.paginate(**kwargs)
-    for page in page_iterator:
-        for item in page[objecttype]:
-            response[objecttype].append(item)
+        # Create a PageIterator from the Paginator
+        page_iterator = paginator.paginate(**kwargs)
+        for page in page_iterator:
+            for item in page[objecttype]:
+                response[objecttype].append(item)
 
     return response
 
 
+def use_targeted_listing(target_clusters, total_clusters):
+    # Compares the API calls needed to page through every snapshot in the region against one filtered query per chunk of target clusters
+    if total_clusters is None:
+        return True
+
+    full_listing_calls = max(1, -(-total_clusters * _SNAPSHOTS_PER_CLUSTER_ESTIMATE // _LISTING_PAGE_SIZE))
+    targeted_calls = -(-target_clusters // _CLUSTER_FILTER_CHUNK)
+
+    return targeted_calls < full_listing_calls
+
+
+def describe_cluster_snapshots(client, cluster_identifiers=None, total_clusters=None, **kwargs):
+    # Lists cluster snapshots with the engine filter pushed down to the API. Pass SnapshotType and IncludeShared through kwargs.
+    # When cluster_identifiers is known, it is cheaper to run concurrent db-cluster-id filtered queries than to page through the whole region
+    # Results come from the warm-container inventory cache when it is fresh. Full listings are exported when EXPORT_LOCATION is set
+    filters = list(kwargs.pop('Filters', [])) + _ENGINE_FILTER
+
+    if cluster_identifiers is not None and use_targeted_listing(len(cluster_identifiers), total_clusters):
+        query = dict(kwargs, Filters=filters + [{'Name': 'db-cluster-id', 'Values': sorted(cluster_identifiers)}])
+
+        def fetch():
+            chunks = [cluster_identifiers[i:i + _CLUSTER_FILTER_CHUNK]
+                      for i in range(0, len(cluster_identifiers), _CLUSTER_FILTER_CHUNK)]
+
+            logger.debug('Listing snapshots for %s clusters in %s targeted queries' % (len(cluster_identifiers), len(chunks)))
+
+            @bind_context
+            def list_chunk(chunk):
+                return paginate_api_call(client, 'describe_db_cluster_snapshots', 'DBClusterSnapshots',
+                                         Filters=filters + [{'Name': 'db-cluster-id', 'Values': chunk}], **kwargs)
+
+            response = {'DBClusterSnapshots': []}
+
+            if chunks:
+                with ThreadPoolExecutor(max_workers=min(_LISTING_MAX_WORKERS, len(chunks))) as executor:
+                    for chunk_response in executor.map(list_chunk, chunks):
+                        response['DBClusterSnapshots'].extend(chunk_response['DBClusterSnapshots'])
+
+            return response
+
+    else:
+        query = dict(kwargs, Filters=filters)
+
+        def fetch():
+            return paginate_api_call(client, 'describe_db_cluster_snapshots', 'DBClusterSnapshots', **query)
+
+    snapshots = cached_listing(client, get_account_id(), query, fetch)
+    export_listing(client.meta.region_name, get_account_id(), query, snapshots)
+
+    return {'DBClusterSnapshots': snapshots}
+
+
+def create_cluster_snapshot(client, **kwargs):
+    # Calls create_db_cluster_snapshot and adds the new snapshot to the inventory cache
+    response = client.create_db_cluster_snapshot(**kwargs)
+    record_snapshot(client.meta.region_name, get_account_id(), response['DBClusterSnapshot'], kwargs.get('Tags'))
+
+    return response
+
+
+def delete_cluster_snapshot(client, snapshot_identifier):
+    # Calls delete_db_cluster_snapshot and removes the snapshot from the inventory cache
+    response = client.delete_db_cluster_snapshot(DBClusterSnapshotIdentifier=snapshot_identifier)
+    forget_snapshot(client.meta.region_name, get_account_id(), snapshot_identifier)
+
+    return response
+
+
+def describe_clusters(client, cluster_identifiers=None):
+    # Lists DB clusters of the supported engines only. Pass cluster_identifiers to describe just those clusters
+    if cluster_identifiers is None:
+        return paginate_api_call(client, 'describe_db_clusters', 'DBClusters', Filters=_ENGINE_FILTER)
+
+    response = {'DBClusters': []}
+
+    for i in range(0, len(cluster_identifiers), _CLUSTER_FILTER_CHUNK):
+        response['DBClusters'].extend(paginate_api_call(client, 'describe_db_clusters', 'DBClusters', Filters=_ENGINE_FILTER + [
+            {'Name': 'db-cluster-id', 'Values': cluster_identifiers[i:i + _CLUSTER_FILTER_CHUNK]}])['DBClusters'])
+
+    return response
+
+
+def get_targets(event):
+    # On-demand invocations pass {"Clusters": [...], "Snapshots": [...], "Force": true} to work on just those clusters or snapshots.
+    # Snapshots are names, or ARNs for snapshots shared with this account. Force skips the interval and retention checks.
+    # Returns None for scheduled invocations
+    if not isinstance(event, dict) or not (event.get('Clusters') or event.get('Snapshots')):
+        return None
+
+    return {
+        'Clusters': [str(identifier) for identifier in event.get('Clusters') or []],
+        'Snapshots': [str(identifier) for identifier in event.get('Snapshots') or []],
+        'Force': str(event.get('Force', False)).upper() in ('TRUE', 'YES')}
+
+
+def forced_snapshots(targets):
+    # Names of the snapshots that Force lets a delete skip the retention check for: only those listed by name under Snapshots.
+    # Snapshots found through Clusters keep their retention, so forcing a cluster does not delete every snapshot it has
+    if targets is None or not targets['Force']:
+        return set()
+
+    return set(identifier.split(':')[-1] for identifier in targets['Snapshots'])
+
+
+def describe_target_snapshots(client, targets, **kwargs):
+    # Describes the snapshots named in targets and the snapshots of the clusters in targets without listing the whole region.
+    # With IncludeShared, snapshots given by name are also looked up among the snapshots shared with this account, and more than
+    # SNAPSHOT_LOOKUP_LIMIT snapshots given by ARN are picked from that one listing instead of being described one by one
+    snapshots = []
+
+    if targets['Clusters']:
+        snapshots.extend(describe_cluster_snapshots(client, targets['Clusters'], **kwargs)['DBClusterSnapshots'])
+
+    names = [identifier for identifier in targets['Snapshots'] if not identifier.startswith('arn:')]
+    arns = [identifier for identifier in targets['Snapshots'] if identifier.startswith('arn:')]
+
+    for i in range(0, len(names), _CLUSTER_FILTER_CHUNK):
+        snapshots.extend(describe_cluster_snapshots(client, Filters=[
+            {'Name': 'db-cluster-snapshot-id', 'Values': names[i:i + _CLUSTER_FILTER_CHUNK]}], **kwargs)['DBClusterSnapshots'])
+
+    shared = None
+
+    if kwargs.get('IncludeShared') and (names or len(arns) > _SNAPSHOT_LOOKUP_LIMIT):
+        shared = describe_cluster_snapshots(client, IncludeShared=True, SnapshotType='shared')['DBClusterSnapshots']
+
+    if shared is not None and len(arns) > _SNAPSHOT_LOOKUP_LIMIT:
+        wanted = set(arns)
+        snapshots.extend(snapshot for snapshot in shared if snapshot['DBClusterSnapshotArn'] in wanted)
+
+    else:
+        for arn in arns:
+            try:
+                snapshots.extend(describe_cluster_snapshots(client, DBClusterSnapshotIdentifier=arn, **kwargs)['DBClusterSnapshots'])
+
+            except Exception as e:
+                if getattr(e, 'response', {}).get('Error', {}).get('Code') != 'DBClusterSnapshotNotFoundFault':
+                    raise
+
+    if names and shared is not None:
+        snapshots.extend(snapshot for snapshot in shared if get_snapshot_identifier(snapshot) in names)
+
+    unique = {}
+    for snapshot in snapshots:
+        unique.setdefault(snapshot['DBClusterSnapshotArn'], snapshot)
+
+    return {'DBClusterSnapshots': list(unique.values())}
+
+
+def target_outcomes(targets, kind='Snapshots'):
+    # Starts the per-item outcomes of an on-demand run with every requested item not found. Items are keyed by name
+    return dict((identifier.split(':')[-1], 'not_found') for identifier in targets[kind])
+
+
+def targeted_result(outcomes, failed=None, kind='Snapshots', pending=()):
+    # Structured result of an on-demand run. Outcomes ending in _failed are failures, reported with the error class from failed
+    # when known. Retry holds the event that works on the failed items and those still pending. Outcomes are counted in the run summary
+    failed = dict((identifier, (failed or {}).get(identifier, outcome)) for identifier, outcome in sorted(outcomes.items())
+                  if outcome.endswith('failed'))
+
+    for identifier, outcome in sorted(outcomes.items()):
+        log_item(logging.INFO, '%s: %s', identifier, outcome)
+
+    record_outcomes(outcomes)
+
+    result = {'Items': outcomes, 'Failed': failed}
+
+    if failed or pending:
+        result['Retry'] = {kind: sorted(set(failed) | set(pending))}
+
+    return result
+
+
 def search_tag_share(response):
     # Takes a describe_db_cluster_snapshots response and searches for our shareAndCopy tag
     try:
@@ -13,8 +13,12 @@ or in the "license" file accompanying this file. This file is distributed on an
 # This lambda function takes a snapshot of Aurora clusters according to the environment variable PATTERN and INTERVAL
 # Set PATTERN to a regex that matches your Aurora cluster identifiers (by default: <instance_name>-cluster)
 # Set INTERVAL to the amount of hours between backups. This function will list available manual snapshots and only trigger a new one if the latest is older than INTERVAL hours
+# Set QUOTA_EXPIRE to YES and RETENTION_DAYS to let this function delete its snapshots older than RETENTION_DAYS when the manual snapshot quota has no room for new ones.
+# By default it deletes nothing: backups that do not fit in the quota are deferred
+# Invoke with {"Clusters": ["<cluster identifier>"], "Force": true} to back up only those clusters. Force skips the INTERVAL check. The outcome for each cluster is returned
 import boto3
 from datetime import datetime
+import functools
 import os
 import logging
 from snapshots_tool_utils import *
@@ -24,6 +28,10 @@ LOGLEVEL = os.getenv('LOG_LEVEL').strip()
 BACKUP_INTERVAL = int(os.getenv('INTERVAL', '24'))
 PATTERN = os.getenv('PATTERN', 'ALL_CLUSTERS')
 SNAPSHOT_NAME_PREFIX = os.getenv('SNAPSHOT_NAME_PREFIX', 'NONE')
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS')) if os.getenv('RETENTION_DAYS') else None
+QUOTA_EXPIRE = os.getenv('QUOTA_EXPIRE', 'NO').strip().upper() == 'YES'
+# Stop retrying failed backups this many seconds before the Lambda timeout
+TIME_MARGIN_SECONDS = int(os.getenv('TIME_MARGIN_SECONDS', '30'))
 
 if os.getenv('REGION_OVERRIDE', 'NO') != 'NO':
     REGION = os.getenv('REGION_OVERRIDE').strip()
@@ -36,64 +44,131 @@ logger.setLevel(LOGLEVEL.upper())
 
 
 
+def create_backup(client, quota, admitted=False, **kwargs):
+    # Starts a backup that was admitted against the quota, or is admitted now. Returns the slot when the call fails
+    if not admitted and not admit(quota):
+        raise SnapshotToolException('No room left in the manual snapshot quota')
+
+    try:
+        return create_cluster_snapshot(client, **kwargs)
+
+    except Exception as e:
+        if quota is not None:
+            quota.cancel(e)
+        raise
+
+
+@snapshots_tool_handler
 def lambda_handler(event, context):
 
-    client = boto3.client('rds', region_name=REGION)
-    response = paginate_api_call(client, 'describe_db_clusters', 'DBClusters')
+    client = get_rds_client(REGION)
+    targets = get_targets(event)
+    force = targets is not None and targets['Force']
+
+    if targets is not None:
+        # On-demand run: describe only the requested clusters
+        response = describe_clusters(client, targets['Clusters'])
+        outcomes = target_outcomes(targets, 'Clusters')
+        total_clusters = None
+
+    else:
+        response = describe_clusters(client)
+        outcomes = {}
+        total_clusters = len(response['DBClusters'])
+
     now = datetime.now()
-    pending_backups = 0
-    filtered_clusters = filter_clusters(PATTERN, response)
-    filtered_snapshots = get_own_snapshots_source(PATTERN, paginate_api_call(client, 'describe_db_cluster_snapshots', 'DBClusterSnapshots'))
+    retries = RetryQueue(deadline=get_deadline(context, TIME_MARGIN_SECONDS))
+    with stage('filtering'):
+        filtered_clusters = filter_clusters(PATTERN, response)
 
-    for db_cluster in filtered_clusters:
+    for db_cluster in response['DBClusters']:
+        outcomes[db_cluster['DBClusterIdentifier']] = 'not_matched'
 
-        timestamp_format = now.strftime('%Y-%m-%d-%H-%M')
+    # Only list manual snapshots of the clusters we back up
+    cluster_identifiers = [cluster['DBClusterIdentifier'] for cluster in filtered_clusters]
+    filtered_snapshots = get_own_snapshots_source(PATTERN, describe_cluster_snapshots(
+        client, cluster_identifiers, total_clusters, SnapshotType='manual'))
 
-        if requires_backup(BACKUP_INTERVAL, db_cluster, filtered_snapshots):
+    quota = get_snapshot_quota(client, len(filtered_snapshots))
 
-            backup_age = get_latest_snapshot_ts(
-                db_cluster['DBClusterIdentifier'],
-                filtered_snapshots)
+    # Only make room for the new backups by deleting old ones when asked to. Otherwise backups that do not fit are deferred
+    if quota is not None and QUOTA_EXPIRE:
+        needed = len([db_cluster for db_cluster in filtered_clusters if force or requires_backup(BACKUP_INTERVAL, db_cluster, filtered_snapshots)])
 
-            if backup_age is not None:
-                logger.info('Backing up %s. Backed up %s minutes ago' % (
-                    db_cluster['DBClusterIdentifier'], ((now - backup_age).total_seconds() / 60)))
+        for snapshot_identifier in expire_snapshots(client, quota, filtered_snapshots, RETENTION_DAYS, needed):
+            filtered_snapshots.pop(snapshot_identifier)
 
-            else:
-                logger.info('Backing up %s. No previous backup found' %
-                            db_cluster['DBClusterIdentifier'])
+    with stage('decision_loop'):
+        for db_cluster in filtered_clusters:
 
-            if SNAPSHOT_NAME_PREFIX != 'NONE' and SNAPSHOT_NAME_PREFIX != '':
-                snapshot_identifier = '%s-%s-%s' % (
-                    SNAPSHOT_NAME_PREFIX, db_cluster['DBClusterIdentifier'], timestamp_format
-                )
-            else:
-                snapshot_identifier = '%s-%s' % (
-                    db_cluster['DBClusterIdentifier'], timestamp_format)
+            timestamp_format = now.strftime('%Y-%m-%d-%H-%M')
+
+            if force or requires_backup(BACKUP_INTERVAL, db_cluster, filtered_snapshots):
 
-            try:
-                response = client.create_db_cluster_snapshot(
+                backup_age = get_latest_snapshot_ts(
+                    db_cluster['DBClusterIdentifier'],
+                    filtered_snapshots)
+
+                if backup_age is not None:
+                    log_item(logging.INFO, 'Backing up %s. Backed up %s minutes ago',
+                             db_cluster['DBClusterIdentifier'], (now - backup_age).total_seconds() / 60)
+
+                else:
+                    log_item(logging.INFO, 'Backing up %s. No previous backup found', db_cluster['DBClusterIdentifier'])
+
+                if SNAPSHOT_NAME_PREFIX != 'NONE' and SNAPSHOT_NAME_PREFIX != '':
+                    snapshot_identifier = '%s-%s-%s' % (
+                        SNAPSHOT_NAME_PREFIX, db_cluster['DBClusterIdentifier'], timestamp_format
+                    )
+                else:
+                    snapshot_identifier = '%s-%s' % (
+                        db_cluster['DBClusterIdentifier'], timestamp_format)
+
+                # Retrying cannot succeed until snapshots are deleted, so backups deferred on the quota are not retried
+                if not admit(quota):
+                    log_item(logging.ERROR, 'Not backing up %s. No room left in the manual snapshot quota', db_cluster['DBClusterIdentifier'])
+                    outcomes[db_cluster['DBClusterIdentifier']] = 'deferred_quota'
+                    continue
+
+                backup = functools.partial(
+                    create_backup, client, quota,
                     DBClusterSnapshotIdentifier=snapshot_identifier,
                     DBClusterIdentifier=db_cluster['DBClusterIdentifier'],
                     Tags=[{'Key': 'CreatedBy', 'Value': 'Snapshot Tool for Aurora'}, {
                         'Key': 'CreatedOn', 'Value': timestamp_format}, {'Key': 'shareAndCopy', 'Value': 'YES'}]
                 )
-            except Exception as e:
-                logger.error(e)
-                pending_backups += 1
-        else:
 
-            backup_age = get_latest_snapshot_ts(
-                db_cluster['DBClusterIdentifier'],
-                filtered_snapshots)
+                try:
+                    with stage('mutations'):
+                        response = backup(admitted=True)
+                    outcomes[db_cluster['DBClusterIdentifier']] = 'snapshot_started'
+                except Exception as e:
+                    logger.error(e)
+                    retries.add(db_cluster['DBClusterIdentifier'], e, backup)
+                    outcomes[db_cluster['DBClusterIdentifier']] = 'snapshot_failed'
+            else:
+                outcomes[db_cluster['DBClusterIdentifier']] = 'not_required'
+
+                backup_age = get_latest_snapshot_ts(
+                    db_cluster['DBClusterIdentifier'],
+                    filtered_snapshots)
+
+                log_item(logging.INFO, 'Skipped %s. Does not require backup. Backed up %s minutes ago',
+                         db_cluster['DBClusterIdentifier'], (now - backup_age).total_seconds() / 60)
+
+    # Throttled or busy clusters get another try once every other cluster was handled
+    for cluster_identifier in retries.drain():
+        outcomes[cluster_identifier] = 'snapshot_started'
+
+    if targets is not None:
+        return targeted_result(outcomes, retries.failed(), 'Clusters')
 
-            logger.info('Skipped %s. Does not require backup. Backed up %s minutes ago' % (
-                db_cluster['DBClusterIdentifier'], (now - backup_age).total_seconds() / 60))
+    record_outcomes(outcomes)
 
-    if pending_backups > 0:
-        log_message = 'Could not back up every cluster. Backups pending: %s' % pending_backups
+    if retries.errors:
+        log_message = 'Could not back up every cluster. Backups pending: %s' % len(retries.errors)
         logger.error(log_message)
-        raise SnapshotToolException(log_message)
+        raise items_pending(log_message, retries.failed(), 'Clusters')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,130 @@
+import os
+import sys
+import types
+
+import pytest
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('DEST_REGION', 'us-west-2')
+os.environ.setdefault('RETENTION_DAYS', '7')
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda'))
+
+
+class FakePaginator(object):
+
+    def __init__(self, client, api_call):
+        self.client = client
+        self.api_call = api_call
+
+    def paginate(self, **kwargs):
+        yield getattr(self.client, self.api_call)(**kwargs)
+
+
+class FakeRDS(object):
+    # Answers describe_db_cluster_snapshots from a list of snapshots, with the filters the tool uses. Set quota to a
+    # (maximum, used) pair to report the manual snapshot quota
+
+    def __init__(self, region, snapshots=(), clusters=()):
+        self.meta = types.SimpleNamespace(region_name=region)
+        self.snapshots = list(snapshots)
+        self.clusters = list(clusters)
+        self.tags = {}
+        self.calls = []
+        self.mutations = []
+        self.quota = None
+
+    def get_paginator(self, api_call):
+        return FakePaginator(self, api_call)
+
+    def describe_db_clusters(self, **kwargs):
+        clusters = self.clusters
+
+        for query_filter in kwargs.get('Filters', []):
+            field = {'engine': 'Engine', 'db-cluster-id': 'DBClusterIdentifier'}[query_filter['Name']]
+            clusters = [cluster for cluster in clusters if cluster[field] in query_filter['Values']]
+
+        return {'DBClusters': [dict(cluster) for cluster in clusters]}
+
+    def describe_account_attributes(self):
+        if self.quota is None:
+            return {'AccountQuotas': []}
+
+        return {'AccountQuotas': [{'AccountQuotaName': 'ManualClusterSnapshots', 'Max': self.quota[0], 'Used': self.quota[1]}]}
+
+    def describe_db_cluster_snapshots(self, **kwargs):
+        self.calls.append(kwargs)
+        snapshots = [snapshot for snapshot in self.snapshots
+                     if kwargs.get('IncludeShared') or snapshot['SnapshotType'] != 'shared']
+
+        if kwargs.get('SnapshotType'):
+            snapshots = [snapshot for snapshot in snapshots if snapshot['SnapshotType'] == kwargs['SnapshotType']]
+
+        if kwargs.get('DBClusterSnapshotIdentifier'):
+            snapshots = [snapshot for snapshot in snapshots if kwargs['DBClusterSnapshotIdentifier'] in (
+                snapshot['DBClusterSnapshotIdentifier'], snapshot['DBClusterSnapshotArn'])]
+
+        for query_filter in kwargs.get('Filters', []):
+            field = {'engine': 'Engine', 'db-cluster-id': 'DBClusterIdentifier',
+                     'db-cluster-snapshot-id': 'DBClusterSnapshotIdentifier'}[query_filter['Name']]
+            snapshots = [snapshot for snapshot in snapshots if snapshot[field] in query_filter['Values']]
+
+        return {'DBClusterSnapshots': [dict(snapshot) for snapshot in snapshots]}
+
+    def _add(self, identifier, cluster, status, tags):
+        snapshot = {'DBClusterSnapshotIdentifier': identifier, 'DBClusterIdentifier': cluster, 'SnapshotType': 'manual',
+                    'DBClusterSnapshotArn': 'arn:aws:rds:%s:111111111111:cluster-snapshot:%s' % (self.meta.region_name, identifier),
+                    'Status': status, 'Engine': 'aurora-mysql', 'AllocatedStorage': 10}
+        self.snapshots.append(snapshot)
+        self.tags[snapshot['DBClusterSnapshotArn']] = list(tags or [])
+        self.mutations.append(identifier)
+
+        return {'DBClusterSnapshot': dict(snapshot)}
+
+    def create_db_cluster_snapshot(self, **kwargs):
+        return self._add(kwargs['DBClusterSnapshotIdentifier'], kwargs['DBClusterIdentifier'], 'creating', kwargs.get('Tags'))
+
+    def copy_db_cluster_snapshot(self, **kwargs):
+        # Snapshot names end in the -YYYY-MM-DD-HH-MM timestamp
+        target = kwargs['TargetDBClusterSnapshotIdentifier']
+        return self._add(target, target.rsplit('-', 5)[0], 'copying', kwargs.get('Tags'))
+
+    def delete_db_cluster_snapshot(self, **kwargs):
+        snapshot = [snapshot for snapshot in self.snapshots if snapshot['DBClusterSnapshotIdentifier'] == kwargs['DBClusterSnapshotIdentifier']][0]
+        self.snapshots.remove(snapshot)
+        self.mutations.append(kwargs['DBClusterSnapshotIdentifier'])
+
+        return {'DBClusterSnapshot': dict(snapshot, Status='deleting')}
+
+    def list_tags_for_resource(self, ResourceName):
+        self.calls.append({'ResourceName': ResourceName})
+
+        return {'TagList': self.tags.get(ResourceName, [])}
+
+
+@pytest.fixture
+def fake_rds():
+    return FakeRDS
+
+
+@pytest.fixture
+def utils(monkeypatch):
+    # The shared module with a fixed account id and an empty inventory cache
+    import snapshots_tool_inventory
+    import snapshots_tool_utils
+
+    monkeypatch.setattr(snapshots_tool_utils, '_ACCOUNT_ID', '111111111111')
+    snapshots_tool_inventory.clear_inventory()
+    yield snapshots_tool_utils
+    snapshots_tool_inventory.clear_inventory()
+
+
+@pytest.fixture
+def inventory(utils, monkeypatch):
+    # The inventory cache switched on, as with INVENTORY_CACHE_TTL=600
+    import snapshots_tool_inventory
+
+    monkeypatch.setattr(snapshots_tool_inventory, '_INVENTORY_CACHE_TTL', 600)
+
+    return snapshots_tool_inventory
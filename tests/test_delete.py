@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def snapshot_name(cluster, days_ago):
+    return '%s-%s' % (cluster, (datetime.now() - timedelta(days=days_ago)).strftime('%Y-%m-%d-%H-%M'))
+
+
+@pytest.fixture
+def backend(utils, fake_rds, monkeypatch):
+    # One fake RDS client for both regions, holding snapshots of the orders cluster taken 10, 2 and 1 days ago
+    client = fake_rds('us-east-1')
+    names = [snapshot_name('orders', days_ago) for days_ago in (10, 2, 1)]
+
+    for name in names:
+        client.create_db_cluster_snapshot(DBClusterSnapshotIdentifier=name, DBClusterIdentifier='orders', Tags=[
+            {'Key': 'CreatedBy', 'Value': 'Snapshot Tool for Aurora'}, {'Key': 'CopiedBy', 'Value': 'Snapshot Tool for Aurora'}])
+
+    for snapshot in client.snapshots:
+        snapshot.update(Status='available', StorageEncrypted=False)
+
+    monkeypatch.setattr(utils, '_RDS_CLIENTS', {(None, 'us-east-1'): (None, client), (None, 'us-west-2'): (None, client)})
+    del client.mutations[:]
+
+    return client, names
+
+
+@pytest.mark.parametrize('function_name', ['delete_old_snapshots_aurora', 'delete_old_snapshots_dest_aurora'])
+def test_force_skips_retention_only_for_snapshots_listed_by_name(utils, backend, function_name):
+    client, (old, recent, latest) = backend
+    handler = utils.load_handler(function_name)
+
+    result = handler.lambda_handler({'Clusters': ['orders'], 'Snapshots': [recent], 'Force': True}, None)
+
+    assert result['Items'] == {old: 'deleted', recent: 'deleted', latest: 'retained'}
+    assert sorted(client.mutations) == sorted([old, recent])
+    assert [snapshot['DBClusterSnapshotIdentifier'] for snapshot in client.snapshots] == [latest]
+
+
+@pytest.mark.parametrize('function_name', ['delete_old_snapshots_aurora', 'delete_old_snapshots_dest_aurora'])
+def test_force_on_a_cluster_keeps_its_retention(utils, backend, function_name):
+    client, (old, recent, latest) = backend
+    handler = utils.load_handler(function_name)
+
+    result = handler.lambda_handler({'Clusters': ['orders'], 'Force': True}, None)
+
+    assert result['Items'] == {old: 'deleted', recent: 'retained', latest: 'retained'}
+    assert client.mutations == [old]
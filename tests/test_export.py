@@ -0,0 +1,170 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import gzip
+import json
+import os
+import threading
+
+import snapshots_tool_export
+
+
+SOURCE_ARN = 'arn:aws:rds:us-east-1:222222222222:cluster-snapshot:orders-2026-10-17-00-00'
+
+
+def copying_snapshot():
+    return {
+        'DBClusterSnapshotIdentifier': 'orders-2026-10-17-00-00', 'DBClusterIdentifier': 'orders',
+        'DBClusterSnapshotArn': 'arn:aws:rds:us-east-1:111111111111:cluster-snapshot:orders-2026-10-17-00-00',
+        'SnapshotType': 'manual', 'Status': 'copying', 'Engine': 'aurora-mysql', 'StorageEncrypted': False,
+        'AllocatedStorage': 50, 'PercentProgress': 40, 'SourceDBClusterSnapshotArn': SOURCE_ARN,
+        'DBClusterSnapshotAttributes': []}
+
+
+def exported_rows(root):
+    rows = []
+
+    for directory, _, files in os.walk(root):
+        for name in files:
+            with gzip.open(os.path.join(directory, name), 'rt') as export:
+                rows.extend(json.loads(line) for line in export)
+
+    return rows
+
+
+def test_export_keeps_progress_and_source_with_inventory_cache(utils, inventory, fake_rds, tmp_path, monkeypatch):
+    assert inventory.inventory_enabled()
+    monkeypatch.setattr(snapshots_tool_export, '_store', snapshots_tool_export.LocalExportStore(str(tmp_path)))
+    client = fake_rds('us-east-1', [copying_snapshot()])
+
+    # The first run fills the cache and the second is answered from it
+    for _ in range(2):
+        run = snapshots_tool_export.begin_export()
+
+        try:
+            utils.describe_cluster_snapshots(client, SnapshotType='manual')
+
+        finally:
+            snapshots_tool_export.end_export(run)
+
+    rows = exported_rows(str(tmp_path))
+
+    assert len(rows) == 2
+    assert len(client.calls) == 2
+
+    for row in rows:
+        assert row['PercentProgress'] == 40
+        assert row['SourceDBClusterSnapshotArn'] == SOURCE_ARN
+        assert 'DBClusterSnapshotAttributes' not in row
+        assert row['Listing'] == 'manual'
+
+
+def test_listings_are_named_after_the_snapshots_they_return():
+    assert snapshots_tool_export.listing_name({'SnapshotType': 'manual'}) == 'manual'
+    assert snapshots_tool_export.listing_name({'IncludeShared': True, 'SnapshotType': 'shared'}) == 'shared'
+    assert snapshots_tool_export.listing_name({'IncludeShared': True}) == 'all-shared'
+    assert snapshots_tool_export.listing_name({'Filters': [{'Name': 'engine', 'Values': ['aurora-mysql']}]}) == 'all'
+    assert snapshots_tool_export.listing_name({'Filters': [{'Name': 'db-cluster-id', 'Values': ['orders']}]}) is None
+    assert snapshots_tool_export.listing_name({'DBClusterSnapshotIdentifier': SOURCE_ARN}) is None
+
+
+def test_rows_keep_the_exported_fields_and_encode_dates():
+    snapshot = dict(copying_snapshot(), SnapshotCreateTime=datetime(2026, 10, 17, 0, 5, tzinfo=timezone.utc))
+
+    row = snapshots_tool_export.export_row(snapshot, 'us-east-1', '111111111111', 'manual', '2026-10-17T01:00:00Z')
+    line = json.loads(json.dumps(row, default=snapshots_tool_export._encode))
+
+    assert set(row) == set(field for field in snapshots_tool_export._EXPORT_FIELDS if field in snapshot) | set(
+        ['Region', 'Account', 'Listing', 'ExportedAt'])
+    assert 'DBClusterSnapshotAttributes' not in row
+    assert line['SnapshotCreateTime'] == '2026-10-17T00:05:00+00:00'
+    assert (line['Region'], line['Account'], line['Listing'], line['ExportedAt']) == (
+        'us-east-1', '111111111111', 'manual', '2026-10-17T01:00:00Z')
+
+    key = snapshots_tool_export.export_key('us-east-1', '111111111111', 'manual', datetime(2026, 10, 17, 1, 2, 3))
+    assert key.startswith('snapshots/date=2026-10-17/region=us-east-1/account=111111111111/010203Z-manual-')
+    assert key.endswith('.jsonl.gz')
+
+
+def test_rows_are_streamed_to_a_temporary_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots_tool_export, '_EXPORT_TMP_DIR', str(tmp_path / 'tmp'))
+    os.makedirs(str(tmp_path / 'tmp'))
+    store = snapshots_tool_export.LocalExportStore(str(tmp_path / 'export'))
+    pending = []
+
+    def rows():
+        # Each row is generated only once the one before was written
+        for index in range(10000):
+            pending.append(index)
+            assert len(pending) == 1
+            yield {'DBClusterSnapshotIdentifier': 'orders-%d' % index}
+            pending.pop()
+
+    assert snapshots_tool_export.write_export(store, 'snapshots/manual.jsonl.gz', rows()) == 10000
+    assert len(exported_rows(str(tmp_path / 'export'))) == 10000
+    assert os.listdir(str(tmp_path / 'tmp')) == []
+
+
+def test_failed_upload_leaves_no_temporary_file_and_does_not_fail_the_run(utils, tmp_path, monkeypatch):
+    class FailingStore(object):
+        def put_file(self, key, source_path):
+            raise IOError('bucket not found')
+
+    monkeypatch.setattr(snapshots_tool_export, '_EXPORT_TMP_DIR', str(tmp_path))
+    monkeypatch.setattr(snapshots_tool_export, '_store', FailingStore())
+    run = snapshots_tool_export.begin_export()
+
+    try:
+        snapshots_tool_export.export_listing('us-east-1', '111111111111', {'SnapshotType': 'manual'}, [copying_snapshot()])
+
+    finally:
+        snapshots_tool_export.end_export(run)
+
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_each_listing_is_written_once_per_invocation(utils, tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots_tool_export, '_store', snapshots_tool_export.LocalExportStore(str(tmp_path)))
+
+    @utils.snapshots_tool_handler
+    def stage_handler(event, context):
+        snapshots_tool_export.export_listing('us-east-1', '111111111111', {'SnapshotType': 'manual'}, [copying_snapshot()])
+
+    @utils.snapshots_tool_handler
+    def lambda_handler(event, context):
+        stage_handler(event, context)
+        stage_handler(event, context)
+
+        # Fleet accounts run in worker threads with the export of the invocation
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            list(pool.map(utils.bind_context(lambda account: snapshots_tool_export.export_listing(
+                'us-east-1', account, {'SnapshotType': 'manual'}, [copying_snapshot()])), ['222222222222', '222222222222']))
+
+    lambda_handler({}, None)
+
+    assert sorted(row['Account'] for row in exported_rows(str(tmp_path))) == ['111111111111', '222222222222']
+    assert snapshots_tool_export.current_export() is None
+
+
+def test_concurrent_invocations_keep_their_own_export(utils, tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots_tool_export, '_store', snapshots_tool_export.LocalExportStore(str(tmp_path)))
+    started = threading.Barrier(2)
+    runs = []
+
+    def invoke():
+        run = snapshots_tool_export.begin_export()
+        runs.append(run)
+        started.wait()
+        snapshots_tool_export.export_listing('us-east-1', '111111111111', {'SnapshotType': 'manual'}, [copying_snapshot()])
+        started.wait()
+        snapshots_tool_export.end_export(run)
+
+    threads = [threading.Thread(target=invoke) for _ in range(2)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert runs[0] is not runs[1]
+    assert len(exported_rows(str(tmp_path))) == 2
@@ -0,0 +1,67 @@
+import threading
+import time
+
+
+def tracked(work=None):
+    # Work function that records the highest number of items in flight per partition
+    lock = threading.Lock()
+    state = {'in_flight': {}, 'peak': {}, 'total': 0, 'peak_total': 0, 'order': []}
+
+    def run(item):
+        partition = item.split('/')[0]
+
+        with lock:
+            state['order'].append(item)
+            state['in_flight'][partition] = state['in_flight'].get(partition, 0) + 1
+            state['peak'][partition] = max(state['peak'].get(partition, 0), state['in_flight'][partition])
+            state['total'] += 1
+            state['peak_total'] = max(state['peak_total'], state['total'])
+
+        time.sleep(0.01)
+
+        with lock:
+            state['in_flight'][partition] -= 1
+            state['total'] -= 1
+
+        return work(item) if work else item.upper()
+
+    return run, state
+
+
+def test_partition_never_exceeds_its_cap(utils):
+    partitions = {'big': ['big/%d' % index for index in range(12)], 'small': ['small/0', 'small/1']}
+    work, state = tracked()
+
+    results = utils.run_fair_share(partitions, work, max_workers=4, max_per_partition=2)
+
+    assert state['peak']['big'] == 2
+    assert state['peak']['small'] <= 2
+    assert state['peak_total'] <= 4
+    assert sorted(item for item, _ in results['big']) == sorted(partitions['big'])
+    assert dict(results['small']) == {'small/0': 'SMALL/0', 'small/1': 'SMALL/1'}
+
+
+def test_partitions_take_turns(utils):
+    partitions = {'a': ['a/0', 'a/1', 'a/2'], 'b': ['b/0', 'b/1', 'b/2']}
+    work, state = tracked()
+
+    utils.run_fair_share(partitions, work, max_workers=1, max_per_partition=1)
+
+    assert state['order'] == ['a/0', 'b/0', 'a/1', 'b/1', 'a/2', 'b/2']
+
+
+def test_items_not_started_before_the_deadline_get_none(utils):
+    partitions = {'a': ['a/0', 'a/1'], 'b': ['b/0']}
+
+    results = utils.run_fair_share(partitions, lambda item: item, max_workers=2, max_per_partition=1, deadline=time.time() - 1)
+
+    assert results == {'a': [('a/0', None), ('a/1', None)], 'b': [('b/0', None)]}
+
+
+def test_workers_run_in_the_callers_account_scope(utils):
+    partitions = {'a': ['a/0'], 'b': ['b/0']}
+
+    with utils.account_scope({'AccountId': '222222222222'}):
+        results = utils.run_fair_share(partitions, lambda item: utils.current_account(), max_workers=2, max_per_partition=1)
+
+    assert [result for items in results.values() for _, result in items] == [{'AccountId': '222222222222'}] * 2
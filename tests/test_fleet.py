@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta, timezone
+import threading
+import time
+import types
+
+import boto3
+import pytest
+
+import snapshots_tool_fleet
+
+
+class FakeSTS(object):
+
+    def __init__(self, duration=3600):
+        self.duration = duration
+        self.assumed = []
+
+    def assume_role(self, **kwargs):
+        self.assumed.append(kwargs['RoleArn'])
+        number = len(self.assumed)
+
+        return {'Credentials': {'AccessKeyId': 'key-%s' % number, 'SecretAccessKey': 'secret', 'SessionToken': 'token-%s' % number,
+                                'Expiration': datetime.now(timezone.utc) + timedelta(seconds=self.duration)}}
+
+
+@pytest.fixture
+def sts(monkeypatch):
+    sts = FakeSTS()
+    monkeypatch.setattr(snapshots_tool_fleet, '_sessions', {})
+    monkeypatch.setattr(snapshots_tool_fleet, '_account_locks', {})
+    monkeypatch.setattr(snapshots_tool_fleet.boto3, 'client', lambda service, **kwargs: sts)
+
+    return sts
+
+
+def test_credentials_are_cached_per_account(sts):
+    session = snapshots_tool_fleet.get_account_session('222222222222')
+
+    assert snapshots_tool_fleet.get_account_session('222222222222') is session
+    assert snapshots_tool_fleet.get_account_session('333333333333') is not session
+    assert sts.assumed == ['arn:aws:iam::222222222222:role/SnapshotsToolFleetRole', 'arn:aws:iam::333333333333:role/SnapshotsToolFleetRole']
+
+
+def test_credentials_are_renewed_before_they_expire(sts):
+    # Valid for less than FLEET_CREDENTIAL_MARGIN_SECONDS, so every run assumes the role again
+    sts.duration = snapshots_tool_fleet._FLEET_CREDENTIAL_MARGIN_SECONDS - 60
+    session = snapshots_tool_fleet.get_account_session('222222222222')
+
+    renewed = snapshots_tool_fleet.get_account_session('222222222222')
+
+    assert renewed is not session
+    assert renewed.get_credentials().token == 'token-2'
+    assert len(sts.assumed) == 2
+
+
+def test_concurrent_runs_assume_the_role_once(sts):
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append(snapshots_tool_fleet.get_account_session('222222222222')))
+               for _ in range(8)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert len(sts.assumed) == 1
+    assert all(session is sessions[0] for session in sessions)
+
+
+def test_rds_clients_follow_the_account_session(utils, sts, monkeypatch):
+    monkeypatch.setattr(utils, '_RDS_CLIENTS', {})
+    monkeypatch.setattr(snapshots_tool_fleet, '_call_limits', {})
+
+    with utils.account_scope('222222222222'):
+        client = utils.get_rds_client('us-east-1')
+
+        assert utils.get_rds_client('us-east-1') is client
+        assert client._request_signer._credentials.token == 'token-1'
+
+        # Renewed credentials replace the cached client
+        snapshots_tool_fleet._sessions['222222222222'] = (snapshots_tool_fleet._sessions['222222222222'][0], time.time())
+
+        assert utils.get_rds_client('us-east-1') is not client
+
+    assert len(sts.assumed) == 2
+
+
+@pytest.fixture
+def limited_clients(monkeypatch):
+    # RDS clients whose calls are answered locally after a short wait, recording the most calls in flight at once
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setattr(snapshots_tool_fleet, '_FLEET_MAX_CALLS_PER_ACCOUNT', 2)
+    monkeypatch.setattr(snapshots_tool_fleet, '_call_limits', {})
+    lock = threading.Lock()
+    state = {'in_flight': 0, 'peak': 0}
+
+    def answer(**kwargs):
+        with lock:
+            state['in_flight'] += 1
+            state['peak'] = max(state['peak'], state['in_flight'])
+
+        time.sleep(0.02)
+
+        with lock:
+            state['in_flight'] -= 1
+
+        if state.get('fail'):
+            return types.SimpleNamespace(status_code=400, headers={}), {
+                'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}, 'ResponseMetadata': {'HTTPStatusCode': 400}}
+
+        return types.SimpleNamespace(status_code=200, headers={}), {'DBClusters': []}
+
+    def make(account):
+        client = snapshots_tool_fleet.limit_account_calls(boto3.client('rds', region_name='us-east-1'), account)
+        client.meta.events.register('before-call.rds', answer)
+
+        return client
+
+    return make, state
+
+
+def run_calls(clients, calls_per_client=3):
+    def call(client):
+        try:
+            client.describe_db_clusters()
+
+        except client.exceptions.ClientError:
+            pass
+
+    threads = [threading.Thread(target=call, args=(client,)) for client in clients for _ in range(calls_per_client)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+
+def test_calls_in_one_account_are_capped_across_its_clients(limited_clients):
+    make, state = limited_clients
+
+    run_calls([make('222222222222'), make('222222222222')])
+
+    assert state['peak'] == 2
+
+
+def test_accounts_have_their_own_cap(limited_clients):
+    make, state = limited_clients
+
+    run_calls([make('222222222222'), make('333333333333')], calls_per_client=4)
+
+    assert state['peak'] > 2
+
+
+def test_failed_calls_release_their_slot(limited_clients):
+    make, state = limited_clients
+    state['fail'] = True
+    client = make('222222222222')
+
+    run_calls([client], calls_per_client=4)
+
+    limit = snapshots_tool_fleet._call_limits['222222222222']
+
+    assert limit.acquire(blocking=False) and limit.acquire(blocking=False)
@@ -0,0 +1,224 @@
+import sys
+import threading
+
+import pytest
+
+
+TAGS = [{'Key': 'CreatedBy', 'Value': 'Snapshot Tool for Aurora'}]
+
+
+def snapshot(name, cluster='orders', status='available', snapshot_type='manual', region='us-east-1'):
+    return {'DBClusterSnapshotIdentifier': name, 'DBClusterIdentifier': cluster, 'SnapshotType': snapshot_type, 'Status': status,
+            'DBClusterSnapshotArn': 'arn:aws:rds:%s:111111111111:cluster-snapshot:%s' % (region, name),
+            'Engine': 'aurora-mysql', 'AllocatedStorage': 10}
+
+
+def names(response):
+    return sorted(item['DBClusterSnapshotIdentifier'] for item in response['DBClusterSnapshots'])
+
+
+def expire(inventory):
+    for entry in inventory._listings.values():
+        entry['Time'] -= inventory._INVENTORY_CACHE_TTL + 1
+
+
+@pytest.fixture
+def client(fake_rds):
+    return fake_rds('us-east-1', [snapshot('orders-2026-10-16-00-00'), snapshot('billing-2026-10-16-00-00', 'billing')])
+
+
+def test_cache_is_off_by_default(utils, client):
+    import snapshots_tool_inventory
+
+    assert not snapshots_tool_inventory.inventory_enabled()
+
+    utils.describe_cluster_snapshots(client, SnapshotType='manual')
+    utils.describe_cluster_snapshots(client, SnapshotType='manual')
+
+    assert len(client.calls) == 2
+    assert snapshots_tool_inventory._listings == {}
+
+
+def test_fresh_listing_is_reused_and_answers_narrower_queries(utils, inventory, client):
+    utils.describe_cluster_snapshots(client, SnapshotType='manual')
+
+    assert names(utils.describe_cluster_snapshots(client, SnapshotType='manual')) == ['billing-2026-10-16-00-00', 'orders-2026-10-16-00-00']
+    assert names(utils.describe_cluster_snapshots(client, ['orders'], SnapshotType='manual')) == ['orders-2026-10-16-00-00']
+    assert len(client.calls) == 1
+
+
+def test_listing_is_listed_again_after_the_ttl(utils, inventory, client):
+    utils.describe_cluster_snapshots(client, SnapshotType='manual')
+    client.snapshots.append(snapshot('orders-2026-10-17-00-00'))
+    expire(inventory)
+
+    assert 'orders-2026-10-17-00-00' in names(utils.describe_cluster_snapshots(client, SnapshotType='manual'))
+    assert len(client.calls) == 2
+
+
+def test_only_transitional_snapshots_are_described_again(utils, inventory, client):
+    client.snapshots.append(snapshot('orders-2026-10-17-00-00', status='copying'))
+    utils.describe_cluster_snapshots(client, SnapshotType='manual')
+    client.snapshots[-1]['Status'] = 'available'
+
+    response = utils.describe_cluster_snapshots(client, SnapshotType='manual')
+
+    assert [item['Status'] for item in response['DBClusterSnapshots'] if item['DBClusterSnapshotIdentifier'] == 'orders-2026-10-17-00-00'] == ['available']
+    assert client.calls[1]['Filters'] == [{'Name': 'db-cluster-snapshot-id', 'Values': ['orders-2026-10-17-00-00']}]
+
+
+def test_snapshots_created_and_deleted_by_the_tool_are_patched_in_place(utils, inventory, client):
+    utils.describe_cluster_snapshots(client, SnapshotType='manual')
+
+    utils.create_cluster_snapshot(client, DBClusterSnapshotIdentifier='orders-2026-10-17-00-00', DBClusterIdentifier='orders', Tags=TAGS)
+    utils.delete_cluster_snapshot(client, 'billing-2026-10-16-00-00')
+    client.calls[:] = []
+
+    response = utils.describe_cluster_snapshots(client, SnapshotType='manual')
+
+    assert names(response) == ['orders-2026-10-16-00-00', 'orders-2026-10-17-00-00']
+    assert utils.list_tags(client, response['DBClusterSnapshots'][1]['DBClusterSnapshotArn']) == {'TagList': TAGS}
+
+    # The created snapshot is still creating, so only it is described again
+    assert client.calls == [{'IncludeShared': True, 'Filters': [{'Name': 'db-cluster-snapshot-id', 'Values': ['orders-2026-10-17-00-00']}]}]
+
+
+def test_copies_are_patched_into_the_listing_of_their_region(utils, inventory, fake_rds, monkeypatch):
+    source = fake_rds('us-east-1', [snapshot('orders-2026-10-16-00-00', snapshot_type='shared')])
+    destination = fake_rds('us-west-2')
+    monkeypatch.setattr(utils, 'get_rds_client', {'us-east-1': source, 'us-west-2': destination}.get)
+
+    utils.describe_cluster_snapshots(source, SnapshotType='manual')
+    utils.describe_cluster_snapshots(destination, SnapshotType='manual')
+
+    shared = {'Arn': source.snapshots[0]['DBClusterSnapshotArn'], 'StorageEncrypted': False}
+    utils.copy_local('orders-2026-10-16-00-00', shared)
+    utils.copy_remote('orders-2026-10-16-00-00', dict(shared, Arn='arn:aws:rds:us-east-1:111111111111:cluster-snapshot:orders-2026-10-16-00-00'))
+
+    for client in (source, destination):
+        client.calls[:] = []
+        response = utils.describe_cluster_snapshots(client, SnapshotType='manual')
+
+        assert [(item['DBClusterSnapshotIdentifier'], item['Status']) for item in response['DBClusterSnapshots']] == [
+            ('orders-2026-10-16-00-00', 'copying')]
+
+    tags = utils.list_tags(source, 'arn:aws:rds:us-east-1:111111111111:cluster-snapshot:orders-2026-10-16-00-00')
+
+    assert tags == {'TagList': [{'Key': 'CopiedBy', 'Value': 'Snapshot Tool for Aurora'}]}
+    assert not any('ResourceName' in call for call in source.calls)
+
+
+def test_tags_are_reused_until_the_ttl(utils, inventory, client):
+    arn = client.snapshots[0]['DBClusterSnapshotArn']
+    client.tags[arn] = TAGS
+
+    assert utils.list_tags(client, arn) == utils.list_tags(client, arn) == {'TagList': TAGS}
+    assert len(client.calls) == 1
+
+    inventory._tags[arn]['Time'] -= inventory._INVENTORY_CACHE_TTL + 1
+    utils.list_tags(client, arn)
+
+    assert len(client.calls) == 2
+
+
+def test_oldest_listings_and_tags_are_evicted(utils, inventory, client, monkeypatch):
+    monkeypatch.setattr(inventory, '_INVENTORY_CACHE_MAX_ENTRIES', 2)
+    monkeypatch.setattr(inventory, '_INVENTORY_CACHE_MAX_TAGS', 1)
+
+    for cluster in ('orders', 'billing', 'orders'):
+        utils.describe_cluster_snapshots(client, [cluster], SnapshotType='manual')
+
+    utils.describe_cluster_snapshots(client, SnapshotType='manual')
+
+    assert len(inventory._listings) == 2
+    assert len(client.calls) == 3
+
+    utils.list_tags(client, client.snapshots[0]['DBClusterSnapshotArn'])
+    utils.list_tags(client, client.snapshots[1]['DBClusterSnapshotArn'])
+
+    assert list(inventory._tags) == [client.snapshots[1]['DBClusterSnapshotArn']]
+
+
+def test_lookups_of_named_snapshots_do_not_evict_listings(utils, inventory, client, monkeypatch):
+    monkeypatch.setattr(inventory, '_INVENTORY_CACHE_MAX_ENTRIES', 1)
+    utils.describe_cluster_snapshots(client, SnapshotType='manual')
+
+    for name in ('orders-2026-10-16-00-00', 'billing-2026-10-16-00-00'):
+        utils.describe_cluster_snapshots(client, DBClusterSnapshotIdentifier=name)
+        utils.describe_cluster_snapshots(client, SnapshotType='manual', Filters=[{'Name': 'db-cluster-snapshot-id', 'Values': [name]}])
+
+    client.calls[:] = []
+    utils.describe_cluster_snapshots(client, SnapshotType='manual')
+
+    assert client.calls == []
+
+
+def test_persisted_index_is_loaded_by_a_later_invocation(utils, inventory, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(inventory, '_INVENTORY_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(inventory, '_loaded', False)
+
+    utils.describe_cluster_snapshots(client, SnapshotType='manual')
+    utils.list_tags(client, client.snapshots[0]['DBClusterSnapshotArn'])
+    inventory.save_inventory()
+
+    assert (tmp_path / 'inventory.json.gz').exists()
+
+    # A new invocation on the same container starts from the persisted index
+    inventory._listings.clear()
+    inventory._tags.clear()
+    monkeypatch.setattr(inventory, '_loaded', False)
+
+    assert names(utils.describe_cluster_snapshots(client, ['orders'], SnapshotType='manual')) == ['orders-2026-10-16-00-00']
+    utils.list_tags(client, client.snapshots[0]['DBClusterSnapshotArn'])
+    assert len(client.calls) == 2
+
+
+def test_expired_entries_are_not_loaded(utils, inventory, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(inventory, '_INVENTORY_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(inventory, '_loaded', False)
+
+    utils.describe_cluster_snapshots(client, SnapshotType='manual')
+    expire(inventory)
+    inventory.save_inventory()
+
+    inventory._listings.clear()
+    monkeypatch.setattr(inventory, '_loaded', False)
+    utils.describe_cluster_snapshots(client, SnapshotType='manual')
+
+    assert len(client.calls) == 2
+
+
+def test_listing_can_be_read_while_worker_threads_patch_it(utils, inventory, client):
+    utils.describe_cluster_snapshots(client, SnapshotType='manual')
+    errors = []
+
+    def create(worker):
+        for i in range(500):
+            inventory.record_snapshot('us-east-1', '111111111111', snapshot('orders-%s-%03d' % (worker, i)))
+
+    def read():
+        try:
+            for _ in range(200):
+                utils.describe_cluster_snapshots(client, SnapshotType='manual')
+
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=create, args=(worker,)) for worker in range(4)] + [threading.Thread(target=read)]
+    interval = sys.getswitchinterval()
+
+    # Switch threads as often as possible, so reads and patches interleave
+    sys.setswitchinterval(1e-6)
+
+    try:
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert errors == []
+    assert len(utils.describe_cluster_snapshots(client, SnapshotType='manual')['DBClusterSnapshots']) == 2002
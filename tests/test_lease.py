@@ -0,0 +1,172 @@
+import pytest
+
+import snapshots_tool_lease
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def lease_store(monkeypatch):
+    store = snapshots_tool_lease.InMemoryLeaseStore()
+    monkeypatch.setattr(snapshots_tool_lease, '_store', store)
+
+    return store
+
+
+def test_lease_expires_without_heartbeat():
+    clock = Clock()
+    store = snapshots_tool_lease.InMemoryLeaseStore(clock)
+
+    assert store.acquire('copy', 'run-1', 120)
+    assert not store.acquire('copy', 'run-2', 120)
+    assert not store.renew('copy', 'run-2', 120)
+
+    clock.now += 121
+
+    assert store.get_owner('copy') is None
+    assert store.acquire('copy', 'run-2', 120)
+    assert not store.renew('copy', 'run-1', 120)
+
+
+def test_run_exits_when_lease_is_held_by_another_run(utils, lease_store):
+    calls = []
+
+    @utils.snapshots_tool_handler
+    def lambda_handler(event, context):
+        calls.append(event)
+        return {'Done': True}
+
+    name = utils.get_lease_name(lambda_handler.__wrapped__)
+    lease_store.acquire(name, 'other-run', 600)
+
+    result = lambda_handler({'id': 'scheduled'}, None)
+
+    assert calls == []
+    assert result == {'Skipped': 'Lease %s is held by another run' % name}
+    assert lease_store.get_owner(name) == 'other-run'
+
+
+def test_retry_skipped_by_lease_is_returned_for_a_later_attempt(utils, lease_store):
+    calls = []
+
+    @utils.snapshots_tool_handler
+    def lambda_handler(event, context):
+        calls.append(event)
+
+    name = utils.get_lease_name(lambda_handler.__wrapped__)
+    lease_store.acquire(name, 'other-run', 600)
+
+    result = lambda_handler({'Snapshots': ['orders-2026-10-17-00-00'], 'Attempt': 2, 'ReportRetry': True, 'id': 'scheduled'}, None)
+
+    assert calls == []
+    assert result['Retry'] == {'Snapshots': ['orders-2026-10-17-00-00'], 'Attempt': 3, 'ReportRetry': True, 'id': 'scheduled'}
+
+
+def test_on_demand_run_does_not_wait_for_the_lease(utils, lease_store):
+    @utils.snapshots_tool_handler
+    def lambda_handler(event, context):
+        return {'Done': True}
+
+    lease_store.acquire(utils.get_lease_name(lambda_handler.__wrapped__), 'other-run', 600)
+
+    assert lambda_handler({'Snapshots': ['orders-2026-10-17-00-00']}, None) == {'Done': True}
+
+
+def test_lease_is_released_after_the_run(utils, lease_store):
+    @utils.snapshots_tool_handler
+    def lambda_handler(event, context):
+        return lease_store.get_owner(utils.get_lease_name(lambda_handler.__wrapped__))
+
+    assert lambda_handler({'id': 'scheduled'}, None) is not None
+    assert lease_store.get_owner(utils.get_lease_name(lambda_handler.__wrapped__)) is None
+
+
+def test_partitions_mode_skips_partitions_leased_by_another_run(lease_store):
+    lease_store.acquire('copy:222222222222', 'other-run', 600)
+    run = snapshots_tool_lease.RunLease(lease_store, 'copy', 'this-run', mode='PARTITIONS')
+
+    with snapshots_tool_lease.run_scope(run):
+        try:
+            leased = snapshots_tool_lease.lease_partitions({'222222222222': ['a'], '333333333333': ['b']})
+
+            assert leased == {'333333333333': ['b']}
+            assert snapshots_tool_lease.partition_lease_held('333333333333')
+            assert not snapshots_tool_lease.partition_lease_held('222222222222')
+
+        finally:
+            run.release_all()
+
+    assert lease_store.get_owner('copy:333333333333') is None
+    assert lease_store.get_owner('copy:222222222222') == 'other-run'
+
+
+def test_run_that_loses_its_lease_makes_no_further_changes(utils, monkeypatch):
+    clock = Clock()
+    store = snapshots_tool_lease.InMemoryLeaseStore(clock)
+    monkeypatch.setattr(snapshots_tool_lease, '_store', store)
+    changed = []
+
+    @utils.snapshots_tool_handler
+    def lambda_handler(event, context):
+        retries = utils.RetryQueue()
+
+        for snapshot in ['orders-1', 'orders-2', 'orders-3']:
+            try:
+                with utils.stage('mutations'):
+                    changed.append(snapshot)
+
+            except Exception as e:
+                retries.add(snapshot, e, lambda: changed.append('retried'))
+
+            if snapshot == 'orders-1':
+                # The heartbeat finds the lease expired and taken over by another run
+                clock.now += 1000
+                store.acquire(utils.current_run().name, 'other-run', 600)
+                utils.current_run().renew()
+
+        retries.drain()
+
+        if retries.failed():
+            raise utils.items_pending('Lease lost', retries.failed())
+
+    result = lambda_handler({'id': 'scheduled', 'ReportRetry': True}, None)
+
+    assert changed == ['orders-1']
+    assert result['Failed'] == {'orders-2': 'SnapshotToolException', 'orders-3': 'SnapshotToolException'}
+    assert result['Retry']['Snapshots'] == ['orders-2', 'orders-3']
+    assert store.get_owner(utils.get_lease_name(lambda_handler.__wrapped__)) == 'other-run'
+
+
+def test_retries_stop_when_the_lease_is_lost(lease_store, monkeypatch):
+    import snapshots_tool_retry
+
+    monkeypatch.setattr(snapshots_tool_retry, '_ITEM_RETRY_BASE_SECONDS', 0)
+    run = snapshots_tool_lease.RunLease(lease_store, 'copy', 'this-run')
+    run.acquired = run.acquire()
+    calls = []
+
+    class Throttled(Exception):
+        response = {'Error': {'Code': 'Throttling'}}
+
+    with snapshots_tool_lease.run_scope(run):
+        try:
+            retries = snapshots_tool_retry.RetryQueue()
+            retries.add('orders-1', Throttled(), lambda: calls.append('orders-1'))
+            lease_store.release('copy', 'this-run')
+            lease_store.acquire('copy', 'other-run', 600)
+            run.renew()
+
+            assert retries.drain() == {}
+
+        finally:
+            run.release_all()
+
+    assert calls == []
+    assert retries.failed() == {'orders-1': 'Throttling'}
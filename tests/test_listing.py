@@ -0,0 +1,87 @@
+import boto3
+
+
+def snapshot(name, cluster, engine='aurora-mysql', snapshot_type='manual'):
+    return {'DBClusterSnapshotIdentifier': name, 'DBClusterIdentifier': cluster, 'Engine': engine, 'SnapshotType': snapshot_type,
+            'DBClusterSnapshotArn': 'arn:aws:rds:us-east-1:111111111111:cluster-snapshot:' + name, 'Status': 'available'}
+
+
+def test_targeted_listing_only_when_cheaper_than_paging_the_region(utils):
+    assert utils.use_targeted_listing(3, None)
+    assert utils.use_targeted_listing(3, 100)
+    assert utils.use_targeted_listing(100, 100)
+    assert not utils.use_targeted_listing(100, 20)
+    assert not utils.use_targeted_listing(1, 1)
+
+
+def test_targeted_listing_filters_by_cluster_in_chunks(utils, fake_rds):
+    clusters = ['cluster-%02d' % i for i in range(25)]
+    client = fake_rds('us-east-1', [snapshot('%s-1' % cluster, cluster) for cluster in clusters] +
+                      [snapshot('other-1', 'other'), snapshot('mysql-1', 'cluster-00', engine='mysql')])
+
+    response = utils.describe_cluster_snapshots(client, clusters, 1000, SnapshotType='manual')
+
+    assert sorted(item['DBClusterIdentifier'] for item in response['DBClusterSnapshots']) == clusters
+    assert len(client.calls) == 3
+
+    for call in client.calls:
+        filters = dict((query_filter['Name'], query_filter['Values']) for query_filter in call['Filters'])
+        assert filters['engine'] == ['aurora', 'aurora-mysql', 'aurora-postgresql', 'neptune']
+        assert len(filters['db-cluster-id']) <= 10
+        assert call['SnapshotType'] == 'manual'
+
+
+def test_full_listing_pushes_the_engine_filter_down(utils, fake_rds):
+    client = fake_rds('us-east-1', [snapshot('orders-1', 'orders'), snapshot('mysql-1', 'legacy', engine='mysql'),
+                                    snapshot('shared-1', 'partner', snapshot_type='shared')])
+
+    response = utils.describe_cluster_snapshots(client, ['orders'], 1, SnapshotType='manual')
+
+    assert [item['DBClusterSnapshotIdentifier'] for item in response['DBClusterSnapshots']] == ['orders-1']
+    assert len(client.calls) == 1
+    assert [query_filter['Name'] for query_filter in client.calls[0]['Filters']] == ['engine']
+
+
+def test_rds_clients_are_created_once_per_region(utils, monkeypatch):
+    created = []
+    create_client = boto3.client
+
+    def client(service, region_name=None):
+        created.append(region_name)
+        return create_client(service, region_name=region_name)
+
+    monkeypatch.setattr(utils, '_RDS_CLIENTS', {})
+    monkeypatch.setattr(utils.boto3, 'client', client)
+
+    assert utils.get_rds_client('us-east-1') is utils.get_rds_client('us-east-1')
+    assert utils.get_rds_client('us-west-2') is not utils.get_rds_client('us-east-1')
+    assert created == ['us-east-1', 'us-west-2']
+
+
+def shared_snapshot(name, account='222222222222'):
+    return dict(snapshot(name, name.split('-')[0], snapshot_type='shared'),
+                DBClusterSnapshotArn='arn:aws:rds:us-east-1:%s:cluster-snapshot:%s' % (account, name))
+
+
+def test_few_shared_snapshots_are_described_by_arn(utils, fake_rds):
+    snapshots = [shared_snapshot('orders-%d' % index) for index in range(12)]
+    client = fake_rds('us-east-1', snapshots)
+    arns = [snapshot['DBClusterSnapshotArn'] for snapshot in snapshots[:3]]
+
+    response = utils.describe_target_snapshots(client, {'Clusters': [], 'Snapshots': arns}, IncludeShared=True)
+
+    assert sorted(snapshot['DBClusterSnapshotArn'] for snapshot in response['DBClusterSnapshots']) == sorted(arns)
+    assert [call.get('DBClusterSnapshotIdentifier') for call in client.calls] == arns
+
+
+def test_many_shared_snapshots_are_picked_from_one_listing(utils, fake_rds):
+    snapshots = [shared_snapshot('orders-%d' % index) for index in range(30)]
+    client = fake_rds('us-east-1', snapshots)
+    arns = [snapshot['DBClusterSnapshotArn'] for snapshot in snapshots[:20]]
+
+    response = utils.describe_target_snapshots(client, {'Clusters': [], 'Snapshots': arns + ['orders-25']}, IncludeShared=True)
+
+    assert sorted(snapshot['DBClusterSnapshotArn'] for snapshot in response['DBClusterSnapshots']) == sorted(
+        arns + [snapshots[25]['DBClusterSnapshotArn']])
+    assert len([call for call in client.calls if call.get('SnapshotType') == 'shared']) == 1
+    assert not any(call.get('DBClusterSnapshotIdentifier') for call in client.calls)
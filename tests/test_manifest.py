@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+import json
+
+import pytest
+
+import snapshots_tool_manifest
+from snapshots_tool_manifest import LocalManifestStore, ManifestReader
+
+
+SOURCE_ACCOUNT = '222222222222'
+DEST_ACCOUNT = '111111111111'
+
+
+def shared_snapshot(name, shared_with=DEST_ACCOUNT):
+    return {'DBClusterSnapshotIdentifier': name, 'DBClusterIdentifier': name.split('-')[0],
+            'DBClusterSnapshotArn': 'arn:aws:rds:us-east-1:%s:cluster-snapshot:%s' % (SOURCE_ACCOUNT, name),
+            'SnapshotCreateTime': datetime(2026, 10, 17), 'AllocatedStorage': 10}
+
+
+def attributes(name):
+    return {'Arn': shared_snapshot(name)['DBClusterSnapshotArn']}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = LocalManifestStore(str(tmp_path))
+    monkeypatch.setattr(snapshots_tool_manifest, '_store', store)
+
+    return store
+
+
+def cursor(store):
+    return json.loads(store.get('readers/%s-us-east-1.json' % DEST_ACCOUNT).decode('utf-8'))
+
+
+def test_first_run_lists_everything_and_keeps_unfinished_snapshots_open(store):
+    reader = ManifestReader(store, DEST_ACCOUNT, 'us-east-1')
+
+    assert reader.full_discovery
+    assert reader.snapshots() == {}
+
+    reader.commit({'orders-1': 'up_to_date', 'orders-2': 'remote_copy_pending', 'orders-3': 'local_copy_in_progress'},
+                  {'orders-1': attributes('orders-1'), 'orders-2': attributes('orders-2'), 'orders-3': attributes('orders-3'),
+                   'orders-4': attributes('orders-4')})
+
+    saved = cursor(store)
+
+    assert sorted(saved['Open']) == ['orders-2', 'orders-3', 'orders-4']
+    assert saved['LastFullDiscovery'] == saved['Newest']
+
+
+def test_cursor_advances_past_objects_read(store):
+    ManifestReader(store, DEST_ACCOUNT, 'us-east-1').commit({}, {'orders-1': attributes('orders-1')})
+
+    # Written well before the cursor, so covered by the full listing
+    store.put('shared/20200101T000000000000Z-%s-us-east-1-old.jsonl' % SOURCE_ACCOUNT, (json.dumps(
+        snapshots_tool_manifest.manifest_entry(shared_snapshot('stale-1'), DEST_ACCOUNT)) + '\n').encode('utf-8'))
+
+    assert snapshots_tool_manifest.publish_shared(SOURCE_ACCOUNT, 'us-east-1', [shared_snapshot('orders-2')], DEST_ACCOUNT) == 1
+    assert snapshots_tool_manifest.publish_shared(SOURCE_ACCOUNT, 'us-east-1', [shared_snapshot('billing-1')], '333333333333', False) == 1
+
+    # Snapshots already published are not published again
+    assert snapshots_tool_manifest.publish_shared(SOURCE_ACCOUNT, 'us-east-1', [shared_snapshot('orders-2')], DEST_ACCOUNT) == 0
+
+    reader = ManifestReader(store, DEST_ACCOUNT, 'us-east-1', datetime.utcnow() + timedelta(hours=1))
+
+    assert not reader.full_discovery
+    assert reader.snapshots() == {'orders-1': attributes('orders-1')['Arn'], 'orders-2': attributes('orders-2')['Arn']}
+
+    newest = reader.newest
+    reader.commit({'orders-1': 'local_deleted', 'orders-2': 'remote_copy_pending'},
+                  {'orders-1': attributes('orders-1'), 'orders-2': attributes('orders-2')})
+
+    saved = cursor(store)
+
+    assert saved['Newest'] == newest > saved['LastFullDiscovery']
+    assert saved['Open'] == {'orders-2': attributes('orders-2')['Arn']}
+
+
+def test_remote_copy_pending_stays_open_until_a_final_outcome(store):
+    ManifestReader(store, DEST_ACCOUNT, 'us-east-1').commit({'orders-1': 'remote_copy_pending'}, {'orders-1': attributes('orders-1')})
+
+    for outcome in ('remote_copy_pending', 'local_deleted'):
+        reader = ManifestReader(store, DEST_ACCOUNT, 'us-east-1', datetime.utcnow() + timedelta(hours=1))
+
+        assert reader.snapshots() == {'orders-1': attributes('orders-1')['Arn']}
+
+        reader.commit({'orders-1': outcome}, {'orders-1': attributes('orders-1')})
+
+    assert cursor(store)['Open'] == {}
+
+
+def test_full_discovery_again_after_the_interval(store):
+    ManifestReader(store, DEST_ACCOUNT, 'us-east-1').commit({}, {})
+
+    assert not ManifestReader(store, DEST_ACCOUNT, 'us-east-1', datetime.utcnow() + timedelta(hours=23)).full_discovery
+    assert ManifestReader(store, DEST_ACCOUNT, 'us-east-1', datetime.utcnow() + timedelta(hours=25)).full_discovery
+
+
+def test_remote_copy_in_progress_is_not_a_final_outcome(utils):
+    copy = utils.load_handler('copy_snapshots_dest_aurora')
+    own_snapshots = {'orders-1': {'Arn': 'arn:aws:rds:us-east-1:111111111111:cluster-snapshot:orders-1', 'Status': 'available'}}
+    own_dest_snapshots = {'orders-1': {'Arn': 'arn:aws:rds:us-west-2:111111111111:cluster-snapshot:orders-1', 'Status': 'copying'}}
+
+    outcome, pending = copy.process_shared_snapshot('orders-1', attributes('orders-1'), own_snapshots, own_dest_snapshots, None)
+
+    assert (outcome, pending) == ('remote_copy_pending', False)
+    assert outcome not in snapshots_tool_manifest._FINAL_OUTCOMES
@@ -0,0 +1,103 @@
+import types
+
+import pytest
+
+
+@pytest.fixture
+def stages(utils, monkeypatch):
+    calls = []
+
+    def handler(name, error=None):
+        @utils.snapshots_tool_handler
+        def lambda_handler(event, context):
+            calls.append((name, event))
+
+            if error is not None:
+                raise error
+
+            return {'Stage': name}
+
+        return types.SimpleNamespace(lambda_handler=lambda_handler)
+
+    monkeypatch.setattr(utils, '_HANDLERS', {
+        'take': handler('take'), 'share': handler('share', utils.items_pending('Snapshots pending', {}, pending=['orders-1'])),
+        'delete': handler('delete', RuntimeError('delete failed'))})
+
+    return calls
+
+
+def test_stages_run_in_order_and_a_failed_stage_does_not_stop_the_others(utils, stages):
+    results, pending_stages, retry = utils.run_stages(['take', 'share', 'delete'], {'id': 'scheduled'}, None)
+
+    assert [name for name, _ in stages] == ['take', 'share', 'delete']
+    assert [(result['Stage'], result['Status']) for result in results] == [
+        ('take', 'succeeded'), ('share', 'failed'), ('delete', 'failed')]
+    assert results[1]['Error'] == 'SnapshotToolException: Snapshots pending'
+    assert pending_stages == 2
+
+
+def test_pipeline_raises_when_a_stage_failed(utils, stages):
+    with pytest.raises(utils.SnapshotToolException, match='Pipeline stages pending: 2'):
+        utils.run_pipeline(['take', 'share', 'delete'], {'id': 'scheduled'}, None)
+
+    assert utils.run_pipeline(['take'], {'id': 'scheduled'}, None)['Stages'][0]['Result'] == {'Stage': 'take'}
+
+
+def test_pipeline_returns_the_retry_of_each_stage(utils, stages):
+    result = utils.run_pipeline(['take', 'share', 'delete'], {'id': 'scheduled', 'ReportRetry': True}, None)
+
+    assert [(stage['Stage'], stage['Status']) for stage in result['Stages']] == [
+        ('take', 'succeeded'), ('share', 'pending'), ('delete', 'failed')]
+    # The share stage is retried on its pending snapshot, the delete stage, which failed outright, in full
+    assert result['Retry'] == {'Stages': {'share': {'Snapshots': ['orders-1']}, 'delete': {}}}
+
+
+def test_pipeline_retry_runs_only_the_pending_stages_on_their_items(utils, stages):
+    @utils.snapshots_tool_handler
+    def lambda_handler(event, context):
+        return utils.run_pipeline(['take', 'share', 'delete'], event, context)
+
+    first = lambda_handler({'id': 'scheduled', 'ReportRetry': True}, None)
+    del stages[:]
+
+    second = lambda_handler(first['Retry'], None)
+
+    assert [(name, event.get('Snapshots'), event['Attempt']) for name, event in stages] == [('share', ['orders-1'], 1), ('delete', None, 1)]
+    assert all('Stages' not in event for _, event in stages)
+    assert second['Retry'] == {'Stages': {'share': {'Snapshots': ['orders-1']}, 'delete': {}}, 'Attempt': 2, 'ReportRetry': True,
+                               'id': 'scheduled'}
+
+
+def test_handlers_are_loaded_once_under_their_own_module_name(utils, monkeypatch):
+    monkeypatch.setattr(utils, '_HANDLERS', {})
+
+    share = utils.load_handler('share_snapshots_aurora')
+
+    assert utils.load_handler('share_snapshots_aurora') is share
+    assert share.__name__ == 'share_snapshots_aurora_lambda_function'
+    assert share.lambda_handler is not utils.load_handler('take_snapshots_aurora').lambda_handler
+
+    with pytest.raises(utils.SnapshotToolException, match='Could not find the code for missing_function'):
+        utils.load_handler('missing_function')
+
+
+def test_fleet_retry_runs_only_the_pending_accounts_and_stages(utils, stages, monkeypatch):
+    fleet = utils.load_handler('fleet_snapshots_aurora')
+    monkeypatch.setattr(fleet, 'FLEET_STAGES', ['take', 'share', 'delete'])
+    monkeypatch.setattr(fleet, 'fleet_accounts', lambda: ['222222222222', '333333333333'])
+    monkeypatch.setattr(fleet, 'get_rds_client', lambda region: None)
+    monkeypatch.setattr(fleet, 'describe_cluster_snapshots', lambda client, **kwargs: {'DBClusterSnapshots': []})
+
+    first = fleet.lambda_handler({'id': 'scheduled', 'ReportRetry': True}, None)
+
+    assert first['Pending'] == ['222222222222', '333333333333']
+    assert first['Retry']['Accounts'] == dict((account, {'Stages': {'share': {'Snapshots': ['orders-1']}, 'delete': {}}})
+                                              for account in ('222222222222', '333333333333'))
+
+    del stages[:]
+    retry = dict(first['Retry'], Accounts={'333333333333': first['Retry']['Accounts']['333333333333']})
+    second = fleet.lambda_handler(retry, None)
+
+    assert [report['Account'] for report in second['Accounts']] == ['333333333333']
+    assert [(name, event.get('Snapshots')) for name, event in stages] == [('share', ['orders-1']), ('delete', None)]
+    assert second['Retry']['Attempt'] == 2
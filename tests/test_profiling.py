@@ -0,0 +1,104 @@
+import re
+import threading
+
+import pytest
+
+import snapshots_tool_profiling
+from snapshots_tool_profiling import current_timings, profiled_handler, stage, timings_scope
+
+
+@pytest.fixture
+def profile(tmp_path, monkeypatch):
+    output = tmp_path / 'profile.txt'
+    monkeypatch.setattr(snapshots_tool_profiling, '_PROFILE', True)
+    monkeypatch.setattr(snapshots_tool_profiling, '_PROFILE_OUTPUT', str(output))
+
+    return output
+
+
+def stage_calls(report, name):
+    return [int(calls) for calls in re.findall(r'^  %s +(\d+) calls' % name, report, re.MULTILINE)]
+
+
+def test_handler_is_untouched_when_profiling_is_off():
+    def lambda_handler(event, context):
+        return current_timings()
+
+    assert profiled_handler(lambda_handler) is lambda_handler
+    assert stage('pagination') is stage('mutations')
+    assert lambda_handler(None, None) is None
+
+
+def test_report_counts_stages_including_worker_threads(profile):
+    def lambda_handler(event, context):
+        timings = current_timings()
+
+        def work():
+            with timings_scope(timings), stage('mutations'):
+                pass
+
+        with stage('pagination'):
+            pass
+
+        workers = [threading.Thread(target=work) for _ in range(3)]
+
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+        return 'done'
+
+    assert profiled_handler(lambda_handler)(None, None) == 'done'
+
+    report = profile.read_text()
+
+    assert report.startswith('Profile for ')
+    assert stage_calls(report, 'pagination') == [1]
+    assert stage_calls(report, 'mutations') == [3]
+    assert 'Top 25 functions by cumulative time' in report
+    assert current_timings() is None
+
+
+def test_nested_handlers_are_covered_by_the_outer_profile(profile):
+    @profiled_handler
+    def stage_handler(event, context):
+        with stage('filtering'):
+            pass
+
+    @profiled_handler
+    def pipeline_handler(event, context):
+        stage_handler(event, context)
+        stage_handler(event, context)
+
+    pipeline_handler(None, None)
+
+    report = profile.read_text()
+
+    assert report.count('Profile for ') == 1
+    assert stage_calls(report, 'filtering') == [2]
+
+
+def test_concurrent_invocations_are_timed_separately(profile):
+    barrier = threading.Barrier(2)
+
+    @profiled_handler
+    def lambda_handler(event, context):
+        barrier.wait()
+
+        for _ in range(event):
+            with stage('decision_loop'):
+                pass
+
+        barrier.wait()
+
+    invocations = [threading.Thread(target=lambda_handler, args=(calls, None)) for calls in (2, 5)]
+
+    for invocation in invocations:
+        invocation.start()
+
+    for invocation in invocations:
+        invocation.join()
+
+    assert sorted(stage_calls(profile.read_text(), 'decision_loop')) == [2, 5]
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import snapshots_tool_quota
+from snapshots_tool_quota import SnapshotQuota
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def test_high_priority_is_admitted_while_any_headroom_is_left():
+    quota = SnapshotQuota('us-east-1', 10, 7, reserve=2)
+
+    assert [quota.admit() for _ in range(4)] == [True, True, True, False]
+    assert quota.headroom() == 0
+    assert quota.deferred == 1
+
+
+def test_low_priority_keeps_the_reserve_for_high_priority():
+    quota = SnapshotQuota('us-east-1', 10, 6, reserve=2)
+
+    assert [quota.admit('low') for _ in range(3)] == [True, True, False]
+    assert quota.admit('high')
+    assert quota.headroom() == 1
+
+
+def test_cancel_returns_the_slot_and_quota_errors_close_admission():
+    quota = SnapshotQuota('us-east-1', 10, 5, reserve=2)
+
+    assert quota.admit()
+    quota.cancel(Exception('Throttling'))
+
+    assert quota.headroom() == 5
+
+    assert quota.admit()
+    quota.cancel(QuotaExceeded('SnapshotQuotaExceeded: Cannot create more than 10 manual snapshots'))
+
+    assert quota.headroom() == 0
+    assert not quota.admit()
+
+
+def test_freed_slots_are_admitted_again():
+    quota = SnapshotQuota('us-east-1', 10, 10)
+
+    assert not quota.admit()
+    quota.freed(2)
+
+    assert quota.admit() and quota.admit() and not quota.admit()
+
+
+def test_quota_is_read_from_the_account_attributes(fake_rds, monkeypatch):
+    client = fake_rds('us-east-1')
+    client.quota = (100, 40)
+
+    quota = snapshots_tool_quota.get_snapshot_quota(client, listed=55)
+
+    assert (quota.region, quota.maximum, quota.used) == ('us-east-1', 100, 55)
+    assert snapshots_tool_quota.admit(None)
+
+    monkeypatch.setattr(snapshots_tool_quota, '_QUOTA_CHECK', False)
+
+    assert snapshots_tool_quota.get_snapshot_quota(client) is None
+
+
+def test_unreadable_quota_disables_admission(fake_rds):
+    assert snapshots_tool_quota.get_snapshot_quota(fake_rds('us-east-1')) is None
+    assert snapshots_tool_quota.get_snapshot_quota(object()) is None
+
+
+@pytest.fixture
+def take(utils, fake_rds, monkeypatch):
+    # Two clusters due for a backup, one old snapshot and a quota with room for one more snapshot
+    clusters = [{'DBClusterIdentifier': name, 'Engine': 'aurora-mysql'} for name in ('orders', 'billing')]
+    client = fake_rds('us-east-1', clusters=clusters)
+    client.quota = (2, 1)
+    old = 'orders-%s' % (datetime.now() - timedelta(days=10)).strftime('%Y-%m-%d-%H-%M')
+    client.create_db_cluster_snapshot(DBClusterSnapshotIdentifier=old, DBClusterIdentifier='orders',
+                                      Tags=[{'Key': 'CreatedBy', 'Value': 'Snapshot Tool for Aurora'}])
+    client.snapshots[0]['Status'] = 'available'
+    del client.mutations[:]
+    monkeypatch.setattr(utils, '_RDS_CLIENTS', {(None, 'us-east-1'): (None, client)})
+
+    return utils.load_handler('take_snapshots_aurora'), client, old
+
+
+def test_backups_that_do_not_fit_are_deferred_without_deleting(take):
+    handler, client, old = take
+
+    result = handler.lambda_handler({'Clusters': ['orders', 'billing']}, None)
+
+    assert result['Items'] == {'orders': 'snapshot_started', 'billing': 'deferred_quota'}
+    assert old not in client.mutations
+    assert old in [snapshot['DBClusterSnapshotIdentifier'] for snapshot in client.snapshots]
+
+
+def test_old_snapshots_are_expired_for_room_only_when_asked(take, monkeypatch):
+    handler, client, old = take
+    monkeypatch.setattr(handler, 'QUOTA_EXPIRE', True)
+    monkeypatch.setattr(handler, 'RETENTION_DAYS', 7)
+
+    result = handler.lambda_handler({'Clusters': ['orders', 'billing']}, None)
+
+    assert result['Items'] == {'orders': 'snapshot_started', 'billing': 'snapshot_started'}
+    assert client.mutations[0] == old
@@ -0,0 +1,246 @@
+import types
+
+import pytest
+
+
+STARTED = 1000000.0
+
+
+class FakeDrillRDS(object):
+    # Holds one drill cluster and its instances and records the mutations, in order
+
+    def __init__(self, instances=()):
+        self.meta = types.SimpleNamespace(region_name='us-west-2')
+        self.instances = list(instances)
+        self.mutations = []
+
+    def get_paginator(self, api_call):
+        assert api_call == 'describe_db_instances'
+        return types.SimpleNamespace(paginate=lambda **kwargs: [{'DBInstances': list(self.instances)}])
+
+    def delete_db_instance(self, **kwargs):
+        self.mutations.append(('delete_db_instance', kwargs['DBInstanceIdentifier']))
+
+    def delete_db_cluster(self, **kwargs):
+        self.mutations.append(('delete_db_cluster', kwargs['DBClusterIdentifier']))
+
+    def add_tags_to_resource(self, **kwargs):
+        self.mutations.append(('add_tags_to_resource', kwargs['Tags'][0]['Key']))
+
+    def create_db_instance(self, **kwargs):
+        self.mutations.append(('create_db_instance', kwargs['DBInstanceIdentifier']))
+
+
+@pytest.fixture
+def drill(utils):
+    return utils.load_handler('restore_drill_aurora')
+
+
+def drill_cluster(drill, status, **tags):
+    tags = dict({drill.TAG_SOURCE_CLUSTER: 'orders', drill.TAG_SNAPSHOT: 'orders-2026-10-17-00-00',
+                 drill.TAG_SNAPSHOT_SIZE: '50', drill.TAG_STARTED: '%.0f' % STARTED}, **tags)
+
+    return {'DBClusterIdentifier': drill.get_drill_identifier('orders'), 'Status': status, 'Engine': 'aurora-mysql',
+            'DBClusterArn': 'arn:aws:rds:us-west-2:111111111111:cluster:' + drill.get_drill_identifier('orders'),
+            'TagList': [{'Key': key, 'Value': value} for key, value in tags.items()]}
+
+
+def drill_instance(drill, status):
+    return {'DBInstanceIdentifier': drill.get_drill_identifier('orders') + '-instance', 'DBInstanceStatus': status}
+
+
+def test_timed_out_drill_is_torn_down_before_it_is_published(drill):
+    client = FakeDrillRDS([drill_instance(drill, 'creating')])
+    published = []
+
+    def publish(state):
+        published.append((state['Phase'], list(client.mutations)))
+
+    now = STARTED + drill.DRILL_TIMEOUT_HOURS * 3600 + 1
+    state = drill.advance_drill(client, drill_cluster(drill, 'creating'), now, publish)
+
+    assert state['Phase'] == 'failed'
+    assert published == [('failed', [('delete_db_instance', drill.get_drill_identifier('orders') + '-instance'),
+                                      ('delete_db_cluster', drill.get_drill_identifier('orders'))])]
+
+
+def test_drill_within_the_timeout_keeps_restoring(drill):
+    client = FakeDrillRDS()
+
+    state = drill.advance_drill(client, drill_cluster(drill, 'creating'), STARTED + 3600, None)
+
+    assert state['Phase'] == 'restoring_cluster'
+    assert client.mutations == []
+
+
+def test_failed_publish_still_tears_down_the_drill(drill):
+    client = FakeDrillRDS()
+
+    def publish(state):
+        raise RuntimeError('put_metric_data failed')
+
+    with pytest.raises(RuntimeError):
+        drill.advance_drill(client, drill_cluster(drill, 'incompatible-restore'), STARTED + 60, publish)
+
+    assert client.mutations == [('delete_db_cluster', drill.get_drill_identifier('orders'))]
+
+
+def test_completed_drill_reports_phase_durations_after_teardown(drill):
+    client = FakeDrillRDS([drill_instance(drill, 'available')])
+    published = []
+    cluster = drill_cluster(drill, 'available', **{drill.TAG_CLUSTER_AVAILABLE: '%.0f' % (STARTED + 1200)})
+
+    state = drill.advance_drill(client, cluster, STARTED + 1800, lambda state: published.append(len(client.mutations)))
+
+    assert state == {'Cluster': 'orders', 'Snapshot': 'orders-2026-10-17-00-00', 'Phase': 'completed',
+                     'ClusterSeconds': 1200, 'InstanceSeconds': 600, 'TotalSeconds': 1800, 'SnapshotSizeGiB': 50}
+    assert published == [2]
+
+
+def test_deleting_drill_is_left_alone(drill):
+    client = FakeDrillRDS([drill_instance(drill, 'deleting')])
+
+    state = drill.advance_drill(client, drill_cluster(drill, 'deleting'), STARTED + 7 * 24 * 3600, None)
+
+    assert state['Phase'] == 'deleting'
+    assert client.mutations == []
+
+
+@pytest.fixture
+def backend(drill, fake_rds):
+    # A destination region with the orders cluster, a copied snapshot of it and a cluster that only shares the drill prefix
+
+    class DrillBackend(fake_rds):
+
+        def __init__(self):
+            fake_rds.__init__(self, 'us-west-2', clusters=[
+                {'DBClusterIdentifier': 'orders', 'Status': 'available', 'Engine': 'aurora-mysql', 'TagList': []},
+                {'DBClusterIdentifier': drill.get_drill_identifier('reports'), 'Status': 'stopped', 'Engine': 'aurora-mysql',
+                 'TagList': [{'Key': 'CreatedBy', 'Value': 'Snapshot Tool for Aurora'}]}])
+            self.instances = []
+            self.drill_mutations = []
+
+        def describe_db_instances(self, **kwargs):
+            return {'DBInstances': [dict(db_instance) for db_instance in self.instances
+                                    if db_instance['DBClusterIdentifier'] in kwargs['Filters'][0]['Values']]}
+
+        def cluster(self, identifier):
+            return [db_cluster for db_cluster in self.clusters if db_cluster['DBClusterIdentifier'] == identifier][0]
+
+        def restore_db_cluster_from_snapshot(self, **kwargs):
+            self.drill_mutations.append(('restore_db_cluster_from_snapshot', kwargs['DBClusterIdentifier']))
+            self.clusters.append({'DBClusterIdentifier': kwargs['DBClusterIdentifier'], 'Status': 'creating', 'Engine': kwargs['Engine'],
+                                  'DBClusterArn': 'arn:aws:rds:us-west-2:111111111111:cluster:' + kwargs['DBClusterIdentifier'],
+                                  'TagList': list(kwargs['Tags'])})
+
+        def add_tags_to_resource(self, **kwargs):
+            identifier = kwargs['ResourceName'].split(':')[-1]
+            self.drill_mutations.append(('add_tags_to_resource', identifier))
+            self.cluster(identifier)['TagList'].extend(kwargs['Tags'])
+
+        def create_db_instance(self, **kwargs):
+            self.drill_mutations.append(('create_db_instance', kwargs['DBInstanceIdentifier']))
+            self.instances.append({'DBInstanceIdentifier': kwargs['DBInstanceIdentifier'], 'DBClusterIdentifier': kwargs['DBClusterIdentifier'],
+                                   'DBInstanceStatus': 'creating'})
+
+        def delete_db_instance(self, **kwargs):
+            self.drill_mutations.append(('delete_db_instance', kwargs['DBInstanceIdentifier']))
+            self.instances = [db_instance for db_instance in self.instances if db_instance['DBInstanceIdentifier'] != kwargs['DBInstanceIdentifier']]
+
+        def delete_db_cluster(self, **kwargs):
+            self.drill_mutations.append(('delete_db_cluster', kwargs['DBClusterIdentifier']))
+            self.clusters.remove(self.cluster(kwargs['DBClusterIdentifier']))
+
+    client = DrillBackend()
+
+    for name, copied in (('orders-2026-10-16-00-00', True), ('orders-2026-10-17-00-00', True), ('orders-2026-10-17-12-00', False)):
+        client.copy_db_cluster_snapshot(TargetDBClusterSnapshotIdentifier=name, Tags=[
+            {'Key': 'CopiedBy', 'Value': 'Snapshot Tool for Aurora'}] if copied else [])
+
+    for snapshot in client.snapshots:
+        snapshot.update(Status='available', StorageEncrypted=False, AllocatedStorage=50)
+
+    return client
+
+
+class FakeCloudWatch(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def put_metric_data(self, **kwargs):
+        self.metrics.append(kwargs)
+
+
+def test_drill_runs_end_to_end_and_publishes_its_durations(drill, backend):
+    cloudwatch = FakeCloudWatch()
+    publish = lambda state: drill.publish_drill(state, cloudwatch)
+    drill_identifier = drill.get_drill_identifier('orders')
+
+    # The latest snapshot copied by the tool is restored. The stopped cluster with the drill prefix is not a drill
+    assert drill.run_drills(backend, STARTED, publish) == [
+        {'Cluster': 'orders', 'Snapshot': 'orders-2026-10-17-00-00', 'Phase': 'restoring_cluster'}]
+    assert drill.run_drills(backend, STARTED + 600, publish)[0]['Phase'] == 'restoring_cluster'
+
+    backend.cluster(drill_identifier)['Status'] = 'available'
+    assert drill.run_drills(backend, STARTED + 1200, publish)[0]['Phase'] == 'creating_instance'
+    assert drill.run_drills(backend, STARTED + 1500, publish)[0]['Phase'] == 'creating_instance'
+
+    backend.instances[0]['DBInstanceStatus'] = 'available'
+    state = drill.run_drills(backend, STARTED + 1800, publish)[0]
+
+    assert state == {'Cluster': 'orders', 'Snapshot': 'orders-2026-10-17-00-00', 'Phase': 'completed',
+                     'ClusterSeconds': 1200, 'InstanceSeconds': 600, 'TotalSeconds': 1800, 'SnapshotSizeGiB': 50}
+    assert backend.drill_mutations == [
+        ('restore_db_cluster_from_snapshot', drill_identifier), ('add_tags_to_resource', drill_identifier),
+        ('create_db_instance', drill_identifier + '-instance'), ('delete_db_instance', drill_identifier + '-instance'),
+        ('delete_db_cluster', drill_identifier)]
+    assert [db_cluster['DBClusterIdentifier'] for db_cluster in backend.clusters] == ['orders', drill.get_drill_identifier('reports')]
+
+    metrics = dict((metric['MetricName'], metric['Value']) for metric in cloudwatch.metrics[0]['MetricData'])
+    assert cloudwatch.metrics[0]['Namespace'] == drill.DRILL_METRIC_NAMESPACE
+    assert metrics == {'RestoreClusterSeconds': 1200, 'RestoreInstanceSeconds': 600, 'RestoreTotalSeconds': 1800,
+                       'RestoreSnapshotSizeGiB': 50}
+
+
+def test_stopped_or_upgrading_drill_is_still_in_progress(drill, backend):
+    drill.run_drills(backend, STARTED, None)
+
+    for status in ('stopped', 'upgrading', 'maintenance'):
+        backend.cluster(drill.get_drill_identifier('orders'))['Status'] = status
+
+        assert drill.run_drills(backend, STARTED + 600, None)[0]['Phase'] == 'restoring_cluster'
+
+    assert [mutation[0] for mutation in backend.drill_mutations] == ['restore_db_cluster_from_snapshot']
+
+
+def test_clusters_without_the_drill_tags_are_never_torn_down(drill, backend):
+    timed_out = STARTED + drill.DRILL_TIMEOUT_HOURS * 3600 * 2
+    backend.clusters.append({'DBClusterIdentifier': drill.get_drill_identifier('billing'), 'Status': 'failed',
+                             'Engine': 'aurora-mysql', 'TagList': [{'Key': drill.TAG_STARTED, 'Value': '%.0f' % STARTED}]})
+
+    drill.run_drills(backend, timed_out, None)
+
+    assert [mutation[0] for mutation in backend.drill_mutations] == ['restore_db_cluster_from_snapshot']
+    assert drill.get_drill_identifier('billing') in [db_cluster['DBClusterIdentifier'] for db_cluster in backend.clusters]
+
+
+@pytest.mark.parametrize('prefix', ['', '   '])
+def test_empty_drill_prefix_is_refused(drill, backend, monkeypatch, prefix):
+    monkeypatch.setattr(drill, 'DRILL_PREFIX', prefix.strip())
+
+    with pytest.raises(drill.SnapshotToolException):
+        drill.run_drills(backend, STARTED, None)
+
+    assert backend.drill_mutations == []
+
+
+def test_drills_in_progress_are_returned_as_a_retry(utils, drill, backend, monkeypatch):
+    monkeypatch.setattr(utils, '_RDS_CLIENTS', {(None, 'us-west-2'): (None, backend)})
+
+    result = drill.lambda_handler({'id': 'scheduled', 'ReportRetry': True}, None)
+
+    assert result['Retry'] == {'Clusters': ['orders'], 'Attempt': 1, 'ReportRetry': True, 'id': 'scheduled'}
+
+    with pytest.raises(drill.SnapshotToolException, match='Restore drills in progress: orders'):
+        drill.lambda_handler({'id': 'scheduled'}, None)
@@ -0,0 +1,200 @@
+import json
+import os
+
+import pytest
+
+import snapshots_tool_retry
+from snapshots_tool_retry import RetryQueue
+
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cftemplates')
+
+
+class Throttled(Exception):
+    response = {'Error': {'Code': 'Throttling'}}
+
+
+class Clock(object):
+    # Stands in for the time module of snapshots_tool_retry. Sleeping moves the clock
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(snapshots_tool_retry, 'time', clock)
+    monkeypatch.setattr(snapshots_tool_retry, '_ITEM_RETRY_BASE_SECONDS', 2)
+    monkeypatch.setattr(snapshots_tool_retry.random, 'uniform', lambda low, high: high)
+
+    return clock
+
+
+def failing(times, calls):
+    def call():
+        calls.append(1)
+
+        if len(calls) <= times:
+            raise Throttled()
+
+        return 'done'
+
+    return call
+
+
+def test_is_retry_and_next_retry(utils):
+    scheduled = {'id': 'scheduled-event', 'ReportRetry': True}
+
+    assert not utils.is_retry(scheduled)
+    assert not utils.is_retry(None)
+
+    retry = utils.next_retry(scheduled, {'Snapshots': ['orders-1']})
+
+    assert retry == {'Snapshots': ['orders-1'], 'Attempt': 1, 'ReportRetry': True, 'id': 'scheduled-event'}
+    assert utils.is_retry(retry)
+    assert utils.next_retry(dict(retry, CorrelationId='run-1'), {'Snapshots': ['orders-1']}) == {
+        'Snapshots': ['orders-1'], 'Attempt': 2, 'ReportRetry': True, 'id': 'scheduled-event', 'CorrelationId': 'run-1'}
+
+
+def test_transient_failures_are_retried_with_exponential_backoff(clock):
+    calls = []
+    retries = RetryQueue(attempts=3)
+
+    assert retries.add('orders-1', Throttled(), failing(2, calls))
+    assert not retries.add('orders-2', ValueError('bad request'), failing(0, []))
+
+    assert retries.drain() == {'orders-1': 'done'}
+    assert clock.sleeps == [2, 4, 8]
+    assert retries.failed() == {'orders-2': 'ValueError'}
+
+
+def test_backoff_is_capped(clock, monkeypatch):
+    monkeypatch.setattr(snapshots_tool_retry, '_ITEM_RETRY_BASE_SECONDS', 20)
+    retries = RetryQueue(attempts=2)
+    retries.add('orders-1', Throttled(), failing(5, []))
+
+    retries.drain()
+
+    assert clock.sleeps == [20, 30]
+    assert retries.failed() == {'orders-1': 'Throttling'}
+
+
+def test_no_retry_is_started_that_would_end_after_the_deadline(clock):
+    calls = []
+    retries = RetryQueue(attempts=5, deadline=clock.now + 10)
+    retries.add('orders-1', Throttled(), failing(5, calls))
+
+    assert retries.drain() == {}
+    # 2 and 4 seconds fit before the deadline, the next 8 do not
+    assert clock.sleeps == [2, 4]
+    assert len(calls) == 2
+    assert retries.failed() == {'orders-1': 'Throttling'}
+
+
+def build_definition(value):
+    # Resolves the Fn::Join and Fn::GetAtt of a DefinitionString into the state machine definition
+    if isinstance(value, str):
+        return value
+
+    if 'Fn::Join' in value:
+        separator, parts = value['Fn::Join']
+        return separator.join(build_definition(part) for part in parts)
+
+    return 'arn:aws:lambda:us-east-1:111111111111:function:%s' % value['Fn::GetAtt'][0]
+
+
+def state_machines():
+    for template in sorted(os.listdir(TEMPLATES)):
+        with open(os.path.join(TEMPLATES, template)) as template_file:
+            resources = json.load(template_file)['Resources']
+
+        for name, resource in sorted(resources.items()):
+            if resource['Type'] == 'AWS::StepFunctions::StateMachine':
+                yield name, json.loads(build_definition(resource['Properties']['DefinitionString']))
+
+
+def get_path(data, path):
+    for key in path.split('.')[1:]:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+
+    return data
+
+
+def matches(rule, data):
+    if 'And' in rule:
+        return all(matches(condition, data) for condition in rule['And'])
+
+    value = get_path(data, rule['Variable'])
+
+    if 'IsPresent' in rule:
+        return (value is not None) == rule['IsPresent']
+
+    return value is not None and value > rule['NumericGreaterThan']
+
+
+def execute(definition, handler, event):
+    # Runs the Pass, Task, Choice, Wait, Fail and Succeed states the tool uses. Returns the final state type and the task events
+    name, data, events = definition['StartAt'], dict(event), []
+
+    while True:
+        state = definition['States'][name]
+
+        if state['Type'] in ('Fail', 'Succeed'):
+            return state['Type'], events
+
+        if state['Type'] == 'Pass':
+            data[state['ResultPath'].split('.')[1]] = state['Result']
+
+        elif state['Type'] == 'Task':
+            events.append(data)
+            data = dict(data, **{state['ResultPath'].split('.')[1]: handler(json.loads(json.dumps(data)), None)})
+
+        elif state['Type'] == 'Wait':
+            data = get_path(data, state['OutputPath'])
+
+        if state['Type'] == 'Choice':
+            name = next((rule['Next'] for rule in state['Choices'] if matches(rule, data)), state['Default'])
+        else:
+            name = state['Next']
+
+
+@pytest.mark.parametrize('name,definition', list(state_machines()))
+def test_state_machines_stop_retrying_after_their_attempt_limit(utils, name, definition):
+    limit = [rule for rule in definition['States']['CheckRetry']['Choices'] if 'And' in rule][0]['And'][1]['NumericGreaterThan']
+
+    @utils.snapshots_tool_handler
+    def lambda_handler(event, context):
+        raise utils.items_pending('Snapshots pending', {}, pending=['orders-1'])
+
+    outcome, events = execute(definition, lambda_handler, {'id': 'scheduled-event'})
+
+    assert outcome == 'Fail'
+    assert len(events) == limit + 1
+    assert [event.get('Attempt') for event in events] == [None] + list(range(1, limit + 1))
+    assert all(event['Snapshots'] == ['orders-1'] and event['id'] == 'scheduled-event' for event in events[1:])
+
+
+@pytest.mark.parametrize('name,definition', list(state_machines()))
+def test_state_machines_finish_once_nothing_is_pending(utils, name, definition):
+    @utils.snapshots_tool_handler
+    def lambda_handler(event, context):
+        if int(event.get('Attempt') or 0) < 2:
+            raise utils.items_pending('Snapshots pending', {'orders-1': 'Throttling'})
+
+        return {'Items': {'orders-1': 'shared'}}
+
+    outcome, events = execute(definition, lambda_handler, {'id': 'scheduled-event'})
+
+    assert outcome == 'Succeed'
+    assert len(events) == 3
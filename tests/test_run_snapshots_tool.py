@@ -0,0 +1,96 @@
+import argparse
+import io
+import json
+import os
+
+import pytest
+
+import run_snapshots_tool
+
+
+def arguments(*argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('function')
+    parser.add_argument('--regions', nargs='+')
+    parser.add_argument('--accounts', nargs='+')
+    parser.add_argument('--role-name')
+    parser.add_argument('--pattern')
+    parser.add_argument('--env', nargs='*', default=[])
+    parser.add_argument('--event')
+    parser.add_argument('--log-level', default='ERROR')
+
+    return parser.parse_args(argv)
+
+
+def test_functions_are_the_folders_with_a_lambda_function():
+    functions = run_snapshots_tool.list_functions()
+
+    assert 'take_snapshots_aurora' in functions
+    assert 'copy_snapshots_dest_aurora' in functions
+    assert '__pycache__' not in functions
+
+
+def test_env_assignments_are_parsed():
+    assert run_snapshots_tool.parse_env(['INTERVAL=24', 'PATTERN=^prod-=x']) == {'INTERVAL': '24', 'PATTERN': '^prod-=x'}
+
+    with pytest.raises(argparse.ArgumentTypeError):
+        run_snapshots_tool.parse_env(['INTERVAL'])
+
+
+def test_one_task_per_account_and_region():
+    tasks = run_snapshots_tool.build_tasks(arguments(
+        'take_snapshots_aurora', '--regions', 'us-east-1', 'us-west-2', '--accounts', '111111111111', '222222222222',
+        '--role-name', 'SnapshotsTool', '--pattern', '^prod-', '--env', 'INTERVAL=24', '--event', '{"Force": true}'))
+
+    assert [(task['Account'], task['Region']) for task in tasks] == [
+        ('111111111111', 'us-east-1'), ('111111111111', 'us-west-2'), ('222222222222', 'us-east-1'), ('222222222222', 'us-west-2')]
+    assert tasks[0]['Env'] == {'INTERVAL': '24', 'LOG_LEVEL': 'ERROR', 'PATTERN': '^prod-', 'SNAPSHOT_PATTERN': '^prod-'}
+    assert tasks[0]['Event'] == {'Force': True}
+    assert tasks[0]['RoleName'] == 'SnapshotsTool'
+
+
+def test_task_without_accounts_uses_the_current_credentials():
+    tasks = run_snapshots_tool.build_tasks(arguments('take_snapshots_aurora', '--regions', 'eu-west-1'))
+
+    assert [(task['Account'], task['Region'], task['Event']) for task in tasks] == [(None, 'eu-west-1', {})]
+
+
+def test_task_sets_the_worker_region(monkeypatch):
+    environment = {}
+    monkeypatch.setattr(os, 'environ', environment)
+
+    result = run_snapshots_tool.run_task({'Function': 'missing_function', 'Region': 'eu-west-1', 'Account': None, 'RoleName': None,
+                                          'Env': {'LOG_LEVEL': 'ERROR'}, 'Event': {}})
+
+    assert environment['AWS_DEFAULT_REGION'] == environment['REGION_OVERRIDE'] == environment['DEST_REGION'] == 'eu-west-1'
+    assert result['Status'] == 'failed'
+    assert result['Error'].startswith('SnapshotToolException: Could not find the code for missing_function')
+
+
+def test_tasks_fan_out_to_worker_processes_and_report_progress():
+    tasks = [{'Function': 'missing_function', 'Region': region, 'Account': None, 'RoleName': None,
+              'Env': {'LOG_LEVEL': 'ERROR', 'DEST_REGION': 'us-west-2'}, 'Event': {}} for region in ('us-east-1', 'eu-west-1')]
+    output = io.StringIO()
+
+    results = run_snapshots_tool.run_tasks(tasks, 2, output)
+
+    assert sorted(result['Region'] for result in results) == ['eu-west-1', 'us-east-1']
+    assert all(result['Status'] == 'failed' for result in results)
+    assert [line.split(' ')[0] for line in output.getvalue().splitlines()] == ['[1/2]', '[2/2]']
+
+    summary = run_snapshots_tool.summarize(results)
+
+    assert (summary['Succeeded'], summary['Failed']) == (0, 2)
+    assert [result['Region'] for result in summary['Results']] == ['eu-west-1', 'us-east-1']
+
+
+def test_main_writes_the_summary_and_fails_when_a_task_failed(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_snapshots_tool, 'run_tasks', lambda tasks, processes: [
+        dict(task, Status='succeeded' if task['Region'] == 'us-east-1' else 'failed', Seconds=1) for task in tasks])
+
+    assert run_snapshots_tool.main(['take_snapshots_aurora', '--regions', 'us-east-1', '--output', str(tmp_path / 'summary.json')]) == 0
+    assert json.loads((tmp_path / 'summary.json').read_text())['Succeeded'] == 1
+    assert run_snapshots_tool.main(['take_snapshots_aurora', '--regions', 'us-east-1', 'us-west-2']) == 1
+
+    with pytest.raises(SystemExit):
+        run_snapshots_tool.main(['take_snapshots_aurora', '--regions', 'us-east-1', '--accounts', '111111111111'])
@@ -0,0 +1,89 @@
+import json
+import logging
+
+import pytest
+
+import snapshots_tool_schedule
+from snapshots_tool_schedule import CopyPlanner, MemoryHistoryStore
+
+
+ACCOUNT = '111111111111'
+
+
+@pytest.fixture
+def store():
+    return MemoryHistoryStore()
+
+
+def test_longest_copies_go_first_and_items_without_a_copy_last(store):
+    planner = CopyPlanner(ACCOUNT, store)
+    planner.pairs['us-east-1>us-west-2'] = {'GiBPerHour': 10.0, 'Copies': 3, 'MeanAbsoluteError': 0.1}
+    routes = {'small-remote': ('us-east-1', 'us-west-2', 20), 'large-local': ('us-east-1', 'us-east-1', 500),
+              'large-remote': ('us-east-1', 'us-west-2', 100), 'done': None}
+
+    ordered = planner.longest_first(['done', 'small-remote', 'large-local', 'large-remote'], routes.get)
+
+    # 100 GiB at 10 GiB/h outlasts 500 GiB at the default 100 GiB/h
+    assert ordered == ['large-remote', 'large-local', 'small-remote', 'done']
+
+
+def test_no_cap_unless_configured(store):
+    planner = CopyPlanner(ACCOUNT, store, max_in_flight=None)
+    planner.observe('us-west-2', dict(('copy-%s' % n, {'Status': 'copying'}) for n in range(50)))
+
+    assert all(planner.admit('us-west-2') for _ in range(50))
+    assert planner.deferred == 0
+
+
+def test_copies_in_progress_hold_slots(store):
+    planner = CopyPlanner(ACCOUNT, store, max_in_flight=2)
+    planner.observe('us-west-2', {'orders-1': {'Status': 'copying'}, 'orders-2': {'Status': 'available'}})
+
+    assert [planner.admit('us-west-2') for _ in range(2)] == [True, False]
+    assert planner.deferred == 1
+
+    planner.cancel('us-west-2')
+
+    assert planner.admit('us-west-2')
+
+
+def test_finished_copy_updates_the_throughput_and_reports_the_error(store, monkeypatch, caplog):
+    monkeypatch.setattr(snapshots_tool_schedule.time, 'time', lambda: 1000.0)
+    planner = CopyPlanner(ACCOUNT, store)
+    planner.started('orders-1', 'us-east-1', 'us-west-2', 200)
+    planner.save()
+
+    # Predicted at the default 100 GiB/h: 7200 seconds plus the overhead. It took an hour plus the overhead
+    seconds = 3600 + snapshots_tool_schedule._COPY_OVERHEAD_SECONDS
+    predicted = 7200 + snapshots_tool_schedule._COPY_OVERHEAD_SECONDS
+    planner = CopyPlanner(ACCOUNT, store, now=1000.0 + seconds)
+    planner.observe('us-west-2', {'orders-1': {'Status': 'available'}})
+
+    pair = planner.pairs['us-east-1>us-west-2']
+    assert pair['GiBPerHour'] == pytest.approx(200)
+    assert pair['Copies'] == 1
+    assert pair['MeanAbsoluteError'] == pytest.approx(float(predicted - seconds) / seconds)
+    assert planner.in_flight == {}
+
+    with caplog.at_level(logging.INFO, logger='snapshots_tool.schedule'):
+        planner.save()
+
+    report = json.loads([record.getMessage() for record in caplog.records if record.name == 'snapshots_tool.schedule'][-1])
+    assert report['Completed'] == 1
+    assert report['CopyModel']['us-east-1>us-west-2'] == {
+        'GiBPerHour': 200.0, 'Copies': 1, 'MeanAbsoluteError': round(float(predicted - seconds) / seconds, 3)}
+
+    # The next prediction for the pair uses the observed throughput
+    assert CopyPlanner(ACCOUNT, store).predict('us-east-1', 'us-west-2', 200) == pytest.approx(seconds)
+
+
+def test_copies_without_a_slot_are_pending(utils, store):
+    copy = utils.load_handler('copy_snapshots_dest_aurora')
+    planner = CopyPlanner(ACCOUNT, store, max_in_flight=1)
+    planner.observe('us-west-2', {'orders-0': {'Status': 'copying'}})
+    own_snapshots = {'orders-1': {'Arn': 'arn:aws:rds:us-east-1:111111111111:cluster-snapshot:orders-1', 'Status': 'available',
+                                  'AllocatedStorage': 10}}
+
+    result = copy.process_shared_snapshot('orders-1', {}, own_snapshots, {}, None, planner=planner)
+
+    assert result == ('deferred_copy_slots', True)
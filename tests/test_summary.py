@@ -0,0 +1,110 @@
+import json
+import logging
+import threading
+
+import pytest
+
+import snapshots_tool_summary
+
+
+@pytest.fixture
+def summaries(monkeypatch, caplog):
+    # Summary logging on, with the JSON lines written during the test
+    monkeypatch.setattr(snapshots_tool_summary, '_LOG_SUMMARY', True)
+    caplog.set_level(logging.DEBUG)
+
+    def written():
+        return [json.loads(record.getMessage()) for record in caplog.records if record.name == 'snapshots_tool.summary']
+
+    return written
+
+
+def test_item_lines_are_written_at_their_level_without_summaries(caplog):
+    caplog.set_level(logging.DEBUG)
+
+    snapshots_tool_summary.log_item(logging.INFO, 'Deleting %s', 'orders-1')
+
+    assert [(record.levelno, record.getMessage()) for record in caplog.records] == [(logging.INFO, 'Deleting orders-1')]
+    assert snapshots_tool_summary.begin_summary('delete') is None
+
+
+def test_item_lines_drop_to_debug_in_summary_mode(summaries, caplog):
+    snapshots_tool_summary.log_item(logging.INFO, 'Deleting %s', 'orders-1')
+
+    assert [(record.levelno, record.getMessage()) for record in caplog.records] == [(logging.DEBUG, 'Deleting orders-1')]
+
+
+def test_one_line_per_run_with_counts_and_samples(utils, summaries):
+    @utils.snapshots_tool_handler
+    def lambda_handler(event, context):
+        utils.record_outcomes(dict(('orders-%d' % index, 'deleted') for index in range(7)))
+        utils.record_outcome('billing-1', 'retained')
+
+    lambda_handler({'id': 'scheduled'}, None)
+
+    [summary] = summaries()
+
+    assert summary['Summary'] == utils.get_lease_name(lambda_handler.__wrapped__)
+    assert (summary['Status'], summary['Items'], summary['Counts']) == ('succeeded', 8, {'deleted': 7, 'retained': 1})
+    assert len(summary['Samples']['deleted']) == snapshots_tool_summary._LOG_SUMMARY_SAMPLES
+    assert summary['Samples']['retained'] == ['billing-1']
+
+
+def test_runs_that_raise_are_summarized_with_their_status(utils, summaries):
+    @utils.snapshots_tool_handler
+    def lambda_handler(event, context):
+        utils.record_outcome('orders-1', 'delete_failed')
+
+        if event.get('Pending'):
+            raise utils.items_pending('Snapshots pending delete: 1', {'orders-1': 'Throttling'})
+
+        raise RuntimeError('listing failed')
+
+    assert lambda_handler({'Pending': True, 'ReportRetry': True}, None)['Failed'] == {'orders-1': 'Throttling'}
+
+    with pytest.raises(RuntimeError):
+        lambda_handler({}, None)
+
+    assert [(summary['Status'], summary['Counts']) for summary in summaries()] == [
+        ('pending', {'delete_failed': 1}), ('failed', {'delete_failed': 1})]
+
+
+def test_nested_runs_keep_their_own_summaries(utils, summaries):
+    @utils.snapshots_tool_handler
+    def stage_handler(event, context):
+        utils.record_outcome('orders-1', 'shared')
+
+    @utils.snapshots_tool_handler
+    def pipeline_handler(event, context):
+        utils.record_outcome('orders', 'snapshot_started')
+        stage_handler(event, context)
+        utils.record_outcome('billing', 'snapshot_started')
+
+    pipeline_handler({}, None)
+
+    assert [summary['Counts'] for summary in summaries()] == [{'shared': 1}, {'snapshot_started': 2}]
+    assert snapshots_tool_summary.current_summary() is None
+
+
+def test_concurrent_runs_count_their_own_items(summaries):
+    started = threading.Barrier(4)
+
+    def run(name):
+        summary = snapshots_tool_summary.begin_summary(name)
+        started.wait()
+
+        for index in range(100):
+            snapshots_tool_summary.record_outcome('%s-%d' % (name, index), 'deleted')
+
+        snapshots_tool_summary.end_summary(summary, 'succeeded')
+
+    threads = [threading.Thread(target=run, args=('account-%d' % index,)) for index in range(4)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert sorted((summary['Summary'], summary['Items']) for summary in summaries()) == [
+        ('account-%d' % index, 100) for index in range(4)]
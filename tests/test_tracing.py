@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import threading
+
+import boto3
+from botocore.stub import Stubber
+import pytest
+
+import snapshots_tool_tracing
+from snapshots_tool_tracing import InMemorySpanExporter, derive_id
+
+
+@pytest.fixture
+def spans(monkeypatch):
+    exporter = InMemorySpanExporter()
+    monkeypatch.setattr(snapshots_tool_tracing, '_exporter', exporter)
+
+    return exporter
+
+
+def test_retries_share_the_trace_of_the_scheduled_event(utils, spans):
+    @utils.snapshots_tool_handler
+    def lambda_handler(event, context):
+        with utils.stage('decision_loop'):
+            with snapshots_tool_tracing.start_span('copy', {'snapshot.id': 'orders-2026-10-17-00-00'}):
+                pass
+
+    lambda_handler({'id': 'scheduled-event'}, None)
+    lambda_handler({'Snapshots': ['orders-2026-10-17-00-00'], 'Attempt': 1, 'ReportRetry': True, 'id': 'scheduled-event'}, None)
+
+    finished = spans.get_finished_spans()
+    roots = [span for span in finished if span['parent_id'] is None]
+
+    assert len(roots) == 2
+    assert set(span['context']['trace_id'] for span in finished) == set([derive_id('scheduled-event')])
+    assert 'faas.attempt' not in roots[0]['attributes']
+    assert roots[1]['attributes']['faas.attempt'] == 1
+
+    for root in roots:
+        stage = [span for span in finished if span['parent_id'] == root['context']['span_id']]
+        assert [span['name'] for span in stage] == ['decision_loop']
+        assert [span['name'] for span in finished if span['parent_id'] == stage[0]['context']['span_id']] == ['copy']
+
+
+def test_snapshot_journey_is_keyed_on_the_snapshot_name(spans):
+    with snapshots_tool_tracing.start_span('share', {'snapshot.id': 'orders-2026-10-17-00-00'}):
+        pass
+
+    with snapshots_tool_tracing.start_span('copy', {
+            'snapshot.source_id': 'arn:aws:rds:us-east-1:222222222222:cluster-snapshot:orders-2026-10-17-00-00'}):
+        pass
+
+    journeys = [span['attributes']['snapshot.journey_id'] for span in spans.get_finished_spans()]
+
+    assert journeys == [derive_id('orders-2026-10-17-00-00')] * 2
+    assert spans.get_finished_spans()[0]['links'] == [{'trace_id': journeys[0]}]
+
+
+def test_api_calls_are_child_spans_with_their_identifiers(spans, monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    client = snapshots_tool_tracing.instrument_client(boto3.client('rds', region_name='us-east-1'))
+
+    with Stubber(client) as stubber:
+        stubber.add_response('delete_db_cluster_snapshot', {'DBClusterSnapshot': {'DBClusterSnapshotIdentifier': 'orders-1'}})
+        stubber.add_client_error('delete_db_cluster_snapshot', 'InvalidDBClusterSnapshotStateFault')
+
+        with snapshots_tool_tracing.InvocationSpan('delete', {'CorrelationId': 'run-1'}, None):
+            client.delete_db_cluster_snapshot(DBClusterSnapshotIdentifier='orders-1')
+
+            with pytest.raises(client.exceptions.ClientError):
+                client.delete_db_cluster_snapshot(DBClusterSnapshotIdentifier='orders-2')
+
+    calls = spans.get_finished_spans()[:2]
+    root = spans.get_finished_spans()[2]
+
+    assert [call['attributes']['snapshot.id'] for call in calls] == ['orders-1', 'orders-2']
+    assert [call['status']['status_code'] for call in calls] == ['OK', 'ERROR']
+    assert calls[1]['status']['description'] == 'InvalidDBClusterSnapshotStateFault'
+    assert all(call['parent_id'] == root['context']['span_id'] for call in calls)
+    assert root['context']['trace_id'] == derive_id('run-1')
+
+
+def test_concurrent_invocations_keep_their_own_spans(spans):
+    started = threading.Barrier(2)
+
+    def invoke(name):
+        with snapshots_tool_tracing.InvocationSpan(name, {'CorrelationId': name}, None):
+            started.wait()
+            snapshots_tool_tracing.Span('call-' + name).start().end()
+            started.wait()
+
+    threads = [threading.Thread(target=invoke, args=(name,)) for name in ('account-1', 'account-2')]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    finished = dict((span['name'], span) for span in spans.get_finished_spans())
+
+    for name in ('account-1', 'account-2'):
+        assert finished['call-' + name]['parent_id'] == finished[name]['context']['span_id']
+        assert finished['call-' + name]['context']['trace_id'] == derive_id(name)
+
+    assert snapshots_tool_tracing.current_span() is None
+
+
+def test_worker_threads_are_parented_to_the_calling_span(utils, spans):
+    def work(identifier):
+        with snapshots_tool_tracing.start_span('copy', {'snapshot.id': identifier}):
+            pass
+
+    with snapshots_tool_tracing.InvocationSpan('copy', {'CorrelationId': 'run-1'}, None) as root:
+        with snapshots_tool_tracing.start_span('decision_loop') as loop:
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                list(pool.map(utils.bind_context(work), ['orders-1', 'orders-2']))
+
+    copies = [span for span in spans.get_finished_spans() if span['name'] == 'copy' and span['parent_id'] is not None]
+
+    assert len(copies) == 2
+    assert all(span['parent_id'] == loop.span_id for span in copies)
+    assert all(span['context']['trace_id'] == root.trace_id for span in copies)
+
+
+def test_timestamps_are_utc(spans):
+    span = snapshots_tool_tracing.Span('call').start()
+    span.end()
+
+    finished = spans.get_finished_spans()[0]
+    expected = datetime.fromtimestamp(span.start_time, timezone.utc)
+
+    assert finished['start_time'].endswith('Z')
+    assert datetime.fromisoformat(finished['start_time'][:-1] + '+00:00') == expected